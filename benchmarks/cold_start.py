@@ -0,0 +1,98 @@
+"""Measure how long a new worker takes to import, and to handle its first waiver.
+
+Each sample is a fresh interpreter, which imports `member.wsgi` and then
+handles the same completed waiver twice (the database & mitoc-trips are
+stubbed out). Workers are measured both as-is and after `warm_up()`, as
+gunicorn's `post_fork` hook calls it before any request is accepted.
+
+Usage:
+
+    python -m benchmarks.cold_start
+"""
+import json
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+from types import SimpleNamespace
+from unittest import mock
+
+SAMPLES = 10
+
+
+def _handle_waiver(application, environ) -> float:
+    start = time.perf_counter()
+    body = b''.join(application(environ, lambda status, headers: None))
+    assert not body.strip(b'{}\n'), body
+    return time.perf_counter() - start
+
+
+def sample(warm: bool) -> dict:
+    """Measure this (new) process: import, maybe warm up, then handle waivers."""
+    start = time.perf_counter()
+    from member.wsgi import application  # pylint: disable=import-outside-toplevel
+
+    result = {'import': time.perf_counter() - start}
+
+    # pylint: disable=import-outside-toplevel
+    from werkzeug.test import EnvironBuilder
+
+    from benchmarks.envelope_generator import generate_envelope
+    from member import app, extensions
+    from member.public import views
+
+    if warm:
+        start = time.perf_counter()
+        with mock.patch.object(extensions.pool, 'warm'):
+            app.warm_up(application)
+        result['warm_up'] = time.perf_counter() - start
+
+    # (Plain functions, since mocks are themselves slow to call the first time)
+    db = SimpleNamespace(
+        transaction=nullcontext,
+        person_to_update=lambda primary, all_emails: 37,
+        add_waiver=lambda person_id, time_signed: (37, None),
+        update_affiliation=lambda person_id, affiliation: None,
+    )
+    xml = generate_envelope()
+    with mock.patch.multiple(
+        views,
+        db=db,
+        other_verified_emails=lambda email: (email, [email]),
+        _inform_trips=lambda primary, **expirations: None,
+    ):
+        for request in ['first_request', 'second_request']:
+            environ = EnvironBuilder(
+                path='/members/waiver', method='POST', data=xml
+            ).get_environ()
+            result[request] = _handle_waiver(application, environ)
+    return result
+
+
+def main():
+    print(f"{'':>8}  {'import':>8}  {'warm_up':>8}  {'1st req':>8}  {'2nd req':>8}")
+    for warm in [False, True]:
+        args = [sys.executable, '-m', 'benchmarks.cold_start', '--sample']
+        if warm:
+            args.append('--warm')
+        samples = [
+            json.loads(subprocess.run(args, check=True, capture_output=True).stdout)
+            for _ in range(SAMPLES)
+        ]
+
+        def median_ms(key, samples=samples):
+            return statistics.median(s.get(key, 0) for s in samples) * 1000
+
+        print(
+            f"{'warm' if warm else 'cold':>8}  {median_ms('import'):>8.1f}  "
+            f"{median_ms('warm_up'):>8.1f}  {median_ms('first_request'):>8.1f}  "
+            f"{median_ms('second_request'):>8.1f}  (ms)"
+        )
+
+
+if __name__ == '__main__':
+    if '--sample' in sys.argv:
+        print(json.dumps(sample(warm='--warm' in sys.argv)))
+    else:
+        main()
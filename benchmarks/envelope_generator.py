@@ -0,0 +1,133 @@
+"""Generate completed DocuSignEnvelopeInformation documents of any shape.
+
+Documents follow the layout of `tests/completed_waiver.xml`: the first
+recipient signs the waiver (and holds every tab), while the remaining
+recipients are just copied on the completed envelope.
+"""
+import base64
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+from mitoc_const import affiliations
+
+DOCU = 'http://www.docusign.net/API/3.0'
+
+# Fields always given (the rest are filler questions)
+REQUIRED_TABS = ["Releasor's Name", "Releasor's Email", 'Affiliation']
+
+
+def timestamp(when: datetime, microseconds: bool = True) -> str:
+    """Format a datetime the way DocuSign does (with milliseconds, or none)."""
+    if microseconds:
+        return when.isoformat(timespec='milliseconds')
+    return when.isoformat(timespec='seconds')
+
+
+def _add(parent: ET.Element, tag: str, text=None, **attrib) -> ET.Element:
+    element = ET.SubElement(parent, tag, attrib)
+    if text is not None:
+        element.text = str(text)
+    return element
+
+
+def _add_tab(tabs: ET.Element, label: str, value: str):
+    tab = _add(tabs, 'TabStatus')
+    _add(tab, 'TabType', 'Custom')
+    _add(tab, 'Status', 'Signed')
+    _add(tab, 'TabLabel', label)
+    _add(tab, 'TabValue', value)
+    _add(tab, 'DocumentID', 1)
+
+
+def _add_signer(parent, *, name, email, affiliation, tabs, signed, microseconds):
+    # pylint: disable=too-many-arguments
+    recipient = _add(parent, 'RecipientStatus')
+    _add(recipient, 'Type', 'Signer')
+    _add(recipient, 'Email', email)
+    _add(recipient, 'UserName', name)
+    _add(recipient, 'RoutingOrder', 1)
+    _add(recipient, 'Signed', timestamp(signed, microseconds))
+    _add(recipient, 'Status', 'Completed')
+
+    values = {
+        "Releasor's Name": name,
+        "Releasor's Email": email,
+        'Affiliation': 'X',
+    }
+    tab_statuses = _add(recipient, 'TabStatuses')
+    for label in REQUIRED_TABS:
+        _add_tab(tab_statuses, label, values[label])
+    for i in range(tabs - len(REQUIRED_TABS)):
+        _add_tab(tab_statuses, f'Question {i}', f'Answer {i}')
+
+    fields = _add(_add(_add(recipient, 'FormData'), 'xfdf'), 'fields')
+    for field_name, value in [
+        ('FullName', name),
+        ('EmailAddress', email),
+        ('Affiliation', affiliation),
+    ]:
+        _add(_add(fields, 'field', name=field_name), 'value', value)
+
+
+def _add_copied(parent, index: int):
+    recipient = _add(parent, 'RecipientStatus')
+    _add(recipient, 'Type', 'CarbonCopy')
+    _add(recipient, 'Email', f'copied-{index}@example.com')
+    _add(recipient, 'UserName', f'Copied Recipient {index}')
+    _add(recipient, 'RoutingOrder', index + 1)
+    _add(recipient, 'Status', 'Completed')
+
+
+def generate_envelope(  # pylint: disable=too-many-arguments,too-many-locals
+    *,
+    recipients: int = 2,
+    tabs: int = 18,
+    pdf_bytes: int = 0,
+    microseconds: bool = True,
+    completed: bool = True,
+    name: str = 'Tim Beaver',
+    email: str = 'tim@mit.edu',
+    affiliation: str = affiliations.NON_AFFILIATE.VALUE,
+    signed: datetime = datetime(2018, 11, 10, 18, 41, 6, 937000),
+    hours_offset: int = -5,
+) -> bytes:
+    """Return a completed waiver (as UTF-8 XML) for the given member.
+
+    `tabs` includes those the waiver view reads (at least 3 are given), and
+    `pdf_bytes` is the (approximate) size of the base64-encoded PDF attached.
+    `signed` is the local time at which the envelope was completed.
+    """
+    # (Tags are left unqualified, so that all are in the default namespace)
+    root = ET.Element('DocuSignEnvelopeInformation', xmlns=DOCU)
+    status = _add(root, 'EnvelopeStatus')
+
+    statuses = _add(status, 'RecipientStatuses')
+    _add_signer(
+        statuses,
+        name=name,
+        email=email,
+        affiliation=affiliation,
+        tabs=max(tabs, len(REQUIRED_TABS)),
+        signed=signed,
+        microseconds=microseconds,
+    )
+    for index in range(1, recipients):
+        _add_copied(statuses, index)
+
+    created = signed - timedelta(minutes=1)
+    _add(status, 'Subject', 'Please sign the MITOC Liability Waiver')
+    _add(status, 'Status', 'Completed' if completed else 'Sent')
+    _add(status, 'Created', timestamp(created, microseconds))
+    if completed:
+        _add(status, 'Completed', timestamp(signed, microseconds))
+
+    if pdf_bytes:
+        pdf = _add(_add(root, 'DocumentPDFs'), 'DocumentPDF')
+        _add(pdf, 'Name', 'MITOC Liability Waiver.pdf')
+        raw = os.urandom(pdf_bytes * 3 // 4)
+        _add(pdf, 'PDFBytes', base64.b64encode(raw).decode('ascii'))
+
+    _add(root, 'TimeZone', 'Eastern Standard Time')
+    _add(root, 'TimeZoneOffset', hours_offset)
+    return ET.tostring(root, encoding='utf-8')
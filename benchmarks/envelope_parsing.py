@@ -0,0 +1,79 @@
+"""Measure the cost of handling one completed waiver, against its tab count.
+
+Each envelope is the completed waiver from the tests, padded with extra tabs
+ahead of those we read (as a longer form would have). Handling an envelope
+means parsing it, then reading every field the waiver view uses.
+
+Envelopes are handled both from a string (as the constructor parses them) and
+from a stream with `ParseLimits` enforced (as the waiver view parses them), to
+measure the overhead of guarding against malicious documents.
+
+Usage:
+
+    python -m benchmarks.envelope_parsing
+"""
+import io
+import timeit
+from pathlib import Path
+
+from member.envelopes import CompletedEnvelope
+
+COMPLETED_WAIVER = Path(__file__).parent.parent / 'tests' / 'completed_waiver.xml'
+TAB_COUNTS = [18, 50, 100, 500, 1000, 5000]
+REPEAT = 20
+
+FILLER_TAB = '''
+    <TabStatus>
+        <TabType>Custom</TabType>
+        <Status>Signed</Status>
+        <TabLabel>Question {i}</TabLabel>
+        <TabValue>Answer {i}</TabValue>
+    </TabStatus>
+'''
+
+
+def envelope_with_tabs(count: int) -> str:
+    """Return the completed waiver, padded to have (at least) `count` tabs."""
+    xml = COMPLETED_WAIVER.read_text()
+    existing = xml.count('<TabStatus>')
+    filler = ''.join(FILLER_TAB.format(i=i) for i in range(count - existing))
+    return xml.replace('<TabStatuses>', '<TabStatuses>' + filler, 1)
+
+
+def handle(env: CompletedEnvelope):
+    """Read every field of the envelope, as the waiver view does."""
+    if env.completed:
+        return (
+            env.releasor_email,
+            env.time_signed,
+            env.first_name,
+            env.last_name,
+            env.affiliation,
+        )
+    return None
+
+
+def per_envelope(func) -> float:
+    return min(timeit.repeat(func, number=REPEAT)) / REPEAT
+
+
+def main():
+    print(
+        f"{'tabs':>5}  {'per envelope (ms)':>17}  {'per tab (us)':>12}  "
+        f"{'streamed (ms)':>13}  {'overhead':>8}"
+    )
+    for count in TAB_COUNTS:
+        xml = envelope_with_tabs(count)
+        data = xml.encode()
+        parsed = per_envelope(lambda xml=xml: handle(CompletedEnvelope(xml)))
+        streamed = per_envelope(
+            lambda data=data: handle(CompletedEnvelope.from_stream(io.BytesIO(data)))
+        )
+        print(
+            f"{count:>5}  {parsed * 1000:>17.3f}  {parsed / count * 1e6:>12.2f}  "
+            f"{streamed * 1000:>13.3f}  {streamed / parsed - 1:>8.0%}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Time (and measure peak memory for) every step of handling an envelope.
+
+For each scenario (see `SCENARIOS`), a synthetic envelope is generated and:
+
+- constructed from a string (`CompletedEnvelope(xml)`)
+- constructed from a stream (`CompletedEnvelope.from_stream`, as in the view)
+- each public property is read from a freshly streamed envelope
+
+Results are written as JSON, so that runs may be compared with `--compare`.
+
+Usage:
+
+    python -m benchmarks.envelope_suite --output after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from benchmarks.envelope_generator import generate_envelope
+from member.envelopes import CompletedEnvelope
+
+PROPERTIES = [
+    'completed',
+    'time_signed',
+    'releasor_name',
+    'releasor_email',
+    'first_name',
+    'last_name',
+    'affiliation',
+]
+
+# Scenario name -> arguments to `generate_envelope`
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'typical': {},
+    'no_microseconds': {'microseconds': False},
+    'tabs_1000': {'tabs': 1000},
+    'recipients_50': {'recipients': 50},
+    'pdf_1mb': {'pdf_bytes': 1024 * 1024},
+    'pdf_10mb': {'pdf_bytes': 10 * 1024 * 1024},
+}
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    """Return the most memory (in bytes) allocated at once by the call."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def per_call(func: Callable[[], Any], number: int) -> float:
+    """Return the fastest time (in seconds) for a single call."""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def property_time(xml: bytes, name: str, number: int) -> float:
+    """Return the time taken to read the property (once) on a new envelope."""
+    best = float('inf')
+    for _ in range(5):
+        envs = [CompletedEnvelope.from_stream(io.BytesIO(xml)) for _ in range(number)]
+        start = time.perf_counter()
+        for env in envs:
+            getattr(env, name)
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def run_scenario(scenario: str, params: Dict[str, Any], number: int) -> List[dict]:
+    xml = generate_envelope(**params)
+    text = xml.decode('utf-8')
+    # Fewer calls for large documents, keeping each scenario to a few seconds
+    number = max(1, number * 100_000 // max(len(xml), 100_000))
+
+    def from_string():
+        return CompletedEnvelope(text)
+
+    def from_stream():
+        return CompletedEnvelope.from_stream(io.BytesIO(xml))
+
+    results = []
+
+    def record(operation: str, seconds: float, peak_bytes: int):
+        results.append(
+            {
+                'scenario': scenario,
+                'params': params,
+                'size_bytes': len(xml),
+                'operation': operation,
+                'seconds': seconds,
+                'peak_bytes': peak_bytes,
+            }
+        )
+
+    for operation, construct in [
+        ('from_string', from_string),
+        ('from_stream', from_stream),
+    ]:
+        record(operation, per_call(construct, number), peak_memory(construct))
+    for name in PROPERTIES:
+        env = from_stream()
+        record(
+            name,
+            property_time(xml, name, number),
+            peak_memory(lambda env=env, name=name: getattr(env, name)),
+        )
+    return results
+
+
+def run(scenarios: Dict[str, Dict[str, Any]], number: int = 50) -> dict:
+    results = []
+    for scenario, params in scenarios.items():
+        results.extend(run_scenario(scenario, params, number))
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(before: dict, after: dict) -> List[str]:
+    """Describe the change in time & memory for each operation run both times."""
+    previous = {(r['scenario'], r['operation']): r for r in before['results']}
+    lines = []
+    for result in after['results']:
+        old = previous.get((result['scenario'], result['operation']))
+        if old is None:
+            continue
+        time_change = result['seconds'] / old['seconds'] - 1
+        memory_change = result['peak_bytes'] / max(old['peak_bytes'], 1) - 1
+        lines.append(
+            f"{result['scenario']:<16}  {result['operation']:<14}  "
+            f"{time_change:>+8.0%}  {memory_change:>+8.0%}"
+        )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--output', help="Write results (as JSON) to this file")
+    parser.add_argument('--compare', help="Compare against earlier results")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS))
+    args = parser.parse_args(argv)
+
+    scenarios = {name: SCENARIOS[name] for name in args.scenario or SCENARIOS}
+    report = run(scenarios)
+
+    print(f"{'scenario':<16}  {'operation':<14}  {'time (us)':>10}  {'peak (KiB)':>10}")
+    for result in report['results']:
+        print(
+            f"{result['scenario']:<16}  {result['operation']:<14}  "
+            f"{result['seconds'] * 1e6:>10.1f}  {result['peak_bytes'] / 1024:>10.1f}"
+        )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as earlier:
+            before = json.load(earlier)
+        print(f"\n{'scenario':<16}  {'operation':<14}  {'time':>8}  {'memory':>8}")
+        print('\n'.join(compare(before, report)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,233 @@
+"""Scratch copies of the gear database tables this service touches.
+
+The gear database schema is managed by a separate Django application. These
+helpers create the tables as it does, then apply our own migrations (just as
+is done by hand), so that queries in `member.db` can be exercised against a
+real MySQL. They're never temporary tables: MySQL can't refer to a temporary
+table twice in one statement, which many of our statements do.
+
+Connection details come from the `TEST_GEAR_DATABASE_*` environment variables,
+which must name a scratch database: its tables are dropped & replaced!
+Also here: the fields of a CyberSource payment, which become rows in those tables.
+"""
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import pymysql
+
+import member
+
+MIGRATIONS = Path(member.__file__).parent / 'migrations'
+
+# As created by the gear database (before `MIGRATIONS`)
+TABLES = [
+    '''
+    create table people (
+      id int not null auto_increment primary key,
+      firstname varchar(255) not null,
+      lastname varchar(255) not null,
+      email varchar(255) null,
+      affiliation varchar(255) null,
+      mitoc_credit decimal(8, 2) not null default 0,
+      date_inserted datetime null
+    )
+    ''',
+    '''
+    create table people_memberships (
+      id int not null auto_increment primary key,
+      person_id int not null,
+      price_paid decimal(8, 2) not null,
+      membership_type varchar(2) null,
+      date_inserted datetime null,
+      expires date null,
+      key people_memberships_person_id (person_id)
+    )
+    ''',
+    '''
+    create table people_waivers (
+      id int not null auto_increment primary key,
+      person_id int not null,
+      date_signed datetime null,
+      expires datetime null,
+      key people_waivers_person_id (person_id)
+    )
+    ''',
+    '''
+    create table geardb_peopleemails (
+      id int not null auto_increment primary key,
+      person_id int not null,
+      alternate_email varchar(255) not null,
+      key geardb_peopleemails_person_id (person_id),
+      key geardb_peopleemails_alternate_email (alternate_email)
+    )
+    ''',
+]
+
+# The original implementation of `person_to_update()`, kept for comparison.
+LEGACY_PERSON_TO_UPDATE = '''
+    select t.id
+      from (select p.id,
+                   nullif(
+                     greatest(coalesce(max(pm.expires), from_unixtime(0)),
+                              coalesce(max(pw.expires), from_unixtime(0))),
+                     from_unixtime(0)
+                   ) as last_update
+              from people p
+                   left join people_memberships  pm on p.id = pm.person_id
+                   left join geardb_peopleemails pe on p.id = pe.person_id
+                   left join people_waivers      pw on p.id = pw.person_id
+             where p.email            in %(all_emails)s
+                or pe.alternate_email in %(all_emails)s
+             group by p.id
+           ) t
+     order by +(t.last_update > date_sub(now(), interval 1 year)) desc,
+              +t.last_update desc;
+'''
+
+
+def settings_from_env() -> Optional[dict]:
+    """Return how to connect to a scratch MySQL database, if one is configured."""
+    host = os.getenv('TEST_GEAR_DATABASE_HOST')
+    if not host:
+        return None
+    return {
+        'host': host,
+        'port': int(os.getenv('TEST_GEAR_DATABASE_PORT', '3306')),
+        'user': os.getenv('TEST_GEAR_DATABASE_USER', 'root'),
+        'password': os.getenv('TEST_GEAR_DATABASE_PASSWORD', ''),
+        'db': os.getenv('TEST_GEAR_DATABASE_NAME', 'test'),
+    }
+
+
+def connect_from_env() -> Optional[pymysql.connections.Connection]:
+    """Connect to a scratch MySQL database, if one is configured."""
+    settings = settings_from_env()
+    if settings is None:
+        return None
+    return pymysql.connect(**settings, charset='utf8')
+
+
+def create_tables(conn):
+    """Replace each table (with an empty, fully migrated copy)."""
+    drop_tables(conn)
+    with conn.cursor() as cursor:
+        for ddl in TABLES:
+            cursor.execute(ddl)
+    migrate(conn)
+
+
+def drop_tables(conn):
+    with conn.cursor() as cursor:
+        for ddl in TABLES:
+            cursor.execute(f'drop table if exists {ddl.split()[2]}')
+
+
+def migrate(conn):
+    """Apply each of our migrations, in order."""
+    with conn.cursor() as cursor:
+        for path in sorted(MIGRATIONS.glob('*.sql')):
+            lines = path.read_text().splitlines()
+            sql = '\n'.join(line for line in lines if not line.startswith('--'))
+            for statement in sql.split(';'):
+                if statement.strip():
+                    cursor.execute(statement)
+
+
+def seed_members(conn, emails, today: date):
+    """Create a current member (with a membership & waiver) for each email."""
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            '''
+            insert into people (firstname, lastname, email, date_inserted)
+            values ('Tim', 'Beaver', %s, now())
+            ''',
+            [[email] for email in emails],
+        )
+        cursor.execute('select id from people where email in %s', [list(emails)])
+        person_ids = [person_id for (person_id,) in cursor.fetchall()]
+
+        expires = today + timedelta(days=180)
+        cursor.executemany(
+            '''
+            insert into people_memberships
+                   (person_id, price_paid, membership_type, expires)
+            values (%s, 15, 'MU', %s)
+            ''',
+            [[person_id, expires] for person_id in person_ids],
+        )
+        cursor.executemany(
+            '''
+            insert into people_waivers (person_id, date_signed, expires)
+            values (%s, %s, %s)
+            ''',
+            [
+                [person_id, expires - timedelta(days=365), expires]
+                for person_id in person_ids
+            ],
+        )
+    conn.commit()
+
+
+def add_person_with_history(conn, email: str, years: int, today: date) -> int:
+    """Create a long-time member: one membership, waiver & alternate email per year.
+
+    Returns the new person's ID.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            '''
+            insert into people (firstname, lastname, email, date_inserted)
+            values ('Tim', 'Beaver', %s, now())
+            ''',
+            [email],
+        )
+        person_id = cursor.lastrowid
+
+        for year in range(years):
+            expires = today - timedelta(days=365 * year)
+            cursor.execute(
+                '''
+                insert into people_memberships
+                       (person_id, price_paid, membership_type, expires)
+                values (%s, 15, 'MU', %s)
+                ''',
+                [person_id, expires],
+            )
+            cursor.execute(
+                '''
+                insert into people_waivers (person_id, date_signed, expires)
+                values (%s, %s, %s)
+                ''',
+                [
+                    person_id,
+                    datetime.combine(expires, datetime.min.time()),
+                    datetime.combine(expires, datetime.min.time()),
+                ],
+            )
+            cursor.execute(
+                '''
+                insert into geardb_peopleemails (person_id, alternate_email)
+                values (%s, %s)
+                ''',
+                [person_id, f'{year}.{email}'],
+            )
+    return person_id
+
+
+def membership_payment(
+    email: str, signed_date_time: str = '2018-05-17T19:20:30Z', **fields
+) -> dict:
+    """Fields CyberSource posts for an accepted membership payment (unsigned)."""
+    return {
+        'decision': 'ACCEPT',
+        'req_merchant_defined_data1': 'membership',
+        'req_merchant_defined_data2': 'MU',
+        'req_merchant_defined_data3': email,
+        'req_bill_to_forename': 'Tim',
+        'req_bill_to_surname': 'Beaver',
+        'signed_date_time': signed_date_time,
+        'req_amount': '15.00',
+        **fields,
+    }
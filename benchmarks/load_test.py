@@ -0,0 +1,348 @@
+"""Replay webhooks at a target rate, against local stand-ins for dependencies.
+
+Signed CyberSource payments (for `/members/membership`) and completed DocuSign
+envelopes (for `/members/waiver`) are sent at a fixed rate, whether or not the
+app keeps up: each request's latency is measured from when it was *due* to be
+sent, so time spent queued behind a saturated server counts against it.
+
+mitoc-trips is always replaced by a local stub (see `benchmarks.trips_stub`),
+with configurable latency & error rate. The gear database is either:
+
+- a scratch MySQL database (from `TEST_GEAR_DATABASE_*`), whose tables are
+  replaced & seeded with `--members` current members (see `benchmarks.gear_db`)
+- otherwise, an in-memory stand-in which takes `--db-latency` per statement
+
+By default, the app is served in this process (by werkzeug, one thread per
+request). To load test a real deployment (e.g. gunicorn) instead, give `--url`
+and configure that app with the stub's URL and the scratch database.
+
+Each request is for a different member, or on a different day, so that
+(until every combination is used) none are rejected as duplicates.
+
+Usage:
+
+    python -m benchmarks.load_test --rate 50 --duration 30
+    TEST_GEAR_DATABASE_HOST=localhost python -m benchmarks.load_test --rate 100
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from unittest import mock
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks import gear_db
+from benchmarks.envelope_generator import generate_envelope
+from benchmarks.trips_stub import TripsStub
+from member.app import create_app
+from member.cybersource import CYBERSOURCE_DT_FORMAT
+from member.errors import AlreadyInserted
+from member.public import views
+from member.signature import SecureAcceptanceSigner
+
+
+class Request(NamedTuple):
+    endpoint: str  # (What results are reported under)
+    path: str
+    body: bytes
+    content_type: str
+
+
+def membership_request(email: str, paid: datetime, signer) -> Request:
+    data = gear_db.membership_payment(
+        email, paid.strftime(CYBERSOURCE_DT_FORMAT), auth_amount='15.00'
+    )
+    data['signed_field_names'] = ','.join([*data, 'signed_field_names'])
+    data['signature'] = signer.sign(data, data['signed_field_names'].split(','))
+    return Request(
+        'membership',
+        '/members/membership',
+        urlencode(data).encode(),
+        'application/x-www-form-urlencoded',
+    )
+
+
+def waiver_request(email: str, signed: datetime) -> Request:
+    body = generate_envelope(email=email, signed=signed, hours_offset=0)
+    return Request('waiver', '/members/waiver', body, 'text/xml')
+
+
+def generate_requests(
+    emails: List[str], waiver_share: float, secret_key: str
+) -> Iterator[Request]:
+    """Yield requests for each member in turn, a day earlier on each pass."""
+    signer = SecureAcceptanceSigner(secret_key)
+    now = datetime.utcnow().replace(microsecond=0)
+    days_back = 0
+    while True:
+        when = now - timedelta(days=days_back)
+        for email in emails:
+            if random.random() < waiver_share:
+                yield waiver_request(email, when)
+            else:
+                yield membership_request(email, when, signer)
+        days_back += 1
+
+
+class StubGearDb:
+    """An in-memory stand-in for `member.db`, taking a fixed time per statement.
+
+    Emails given in `members` are existing members; others are added on first
+    use. Duplicate payments & waivers (for the same day) are rejected as usual.
+    """
+
+    def __init__(self, members: List[str], latency: float):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._people = {email: person_id for person_id, email in enumerate(members)}
+        self._added = set()  # (Kind, person ID, day)
+
+    def _statement(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    @contextmanager
+    def transaction(self):
+        yield
+        self._statement()  # (The commit)
+
+    def person_to_update(self, primary, all_emails):  # pylint: disable=unused-argument
+        self._statement()
+        return self._people.get(primary)
+
+    def add_person(self, first, last, email):  # pylint: disable=unused-argument
+        self._statement()
+        with self._lock:
+            return self._people.setdefault(email, len(self._people))
+
+    def _add(self, kind: str, person_id: int, when: datetime) -> date:
+        self._statement()
+        with self._lock:
+            if (kind, person_id, when.date()) in self._added:
+                raise AlreadyInserted(f"{kind} for {person_id} on {when.date()}")
+            self._added.add((kind, person_id, when.date()))
+        return when.date() + timedelta(days=365)
+
+    def add_membership(self, person_id, price_paid, datetime_paid, code):
+        # pylint: disable=unused-argument
+        return None, self._add('membership', person_id, datetime_paid)
+
+    def add_waiver(self, person_id, datetime_signed):
+        return None, self._add('waiver', person_id, datetime_signed)
+
+    def update_affiliation(self, person_id, affiliation):
+        # pylint: disable=unused-argument
+        self._statement()
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Counter] = {}
+
+    def record(self, endpoint: str, status: str, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.statuses.setdefault(endpoint, Counter())[status] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        summary = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            statuses = self.statuses[endpoint]
+            summary[endpoint] = {
+                'requests': len(latencies),
+                'throughput': len(latencies) / elapsed,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'errors': sum(
+                    count
+                    for status, count in statuses.items()
+                    if not status.isdigit() or int(status) >= 500
+                ),
+                'statuses': dict(sorted(statuses.items())),
+            }
+        return summary
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Return the given percentile of the (sorted) values, by nearest rank."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * pct // 100))  # (Ceiling division)
+    return ordered[int(rank) - 1]
+
+
+class Sender:  # pylint: disable=too-few-public-methods
+    """Send requests, keeping one open connection per thread."""
+
+    def __init__(self, base_url: str, timeout: float):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def send(self, request: Request) -> str:
+        """Return the response status, or the name of the error raised."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, self.timeout)
+            self._local.conn = conn
+        try:
+            conn.request(
+                'POST',
+                request.path,
+                body=request.body,
+                headers={'Content-Type': request.content_type},
+            )
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            self._local.conn = None
+            return type(e).__name__
+        if response.will_close:
+            conn.close()
+        return str(response.status)
+
+
+def run(
+    sender: Sender,
+    requests: Iterator[Request],
+    *,
+    rate: float,
+    duration: float,
+    concurrency: int,
+) -> dict:
+    """Send requests at `rate` per second for `duration` seconds."""
+    results = Results()
+
+    def send(request: Request, due: float):
+        status = sender.send(request)
+        results.record(request.endpoint, status, time.perf_counter() - due)
+
+    total = int(rate * duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, request in zip(range(total), requests):
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, request, due)
+    return results.summary(time.perf_counter() - start)
+
+
+def report(summary: Dict[str, dict]):
+    print(
+        f"{'endpoint':<12}  {'requests':>8}  {'req/s':>7}  {'p50':>8}  "
+        f"{'p95':>8}  {'p99':>8}  {'errors':>6}  statuses"
+    )
+    for endpoint, result in summary.items():
+        statuses = ' '.join(f'{k}:{v}' for k, v in result['statuses'].items())
+        print(
+            f"{endpoint:<12}  {result['requests']:>8}  {result['throughput']:>7.1f}  "
+            + ''.join(f"{result[pct] * 1000:>8.1f}  " for pct in ['p50', 'p95', 'p99'])
+            + f"{result['errors']:>6}  {statuses}"
+        )
+    print("(Latencies in milliseconds)")
+
+
+class _QuietHandler(WSGIRequestHandler):
+    # Headers & body are written separately: without this, each response to a
+    # kept-alive connection could wait on a delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def log_request(self, *args, **kwargs):
+        pass  # (Thousands of requests would otherwise flood stderr)
+
+
+def serve(app) -> str:
+    """Serve the app from a background thread, returning its URL."""
+    server = make_server(
+        '127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def main(argv=None):
+    # pylint: disable=too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--rate', type=float, default=20, help="Requests/second")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds")
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--waiver-share', type=float, default=0.5)
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--trips-latency', type=float, default=0.05)
+    parser.add_argument('--trips-error-rate', type=float, default=0.0)
+    parser.add_argument('--db-latency', type=float, default=0.002)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--url', help="Load test an app that's already running")
+    parser.add_argument('--output', help="Write results (as JSON) to this file")
+    args = parser.parse_args(argv)
+
+    emails = [f'member{i}@example.com' for i in range(args.members)]
+    trips = TripsStub(latency=args.trips_latency, error_rate=args.trips_error_rate)
+    trips.start()
+
+    database = gear_db.settings_from_env()
+    if database:
+        conn = gear_db.connect_from_env()
+        gear_db.create_tables(conn)
+        gear_db.seed_members(conn, emails, date.today())
+
+    app = create_app()
+    stub_db: Optional[StubGearDb] = None
+    if args.url:
+        print(f"mitoc-trips stub at {trips.url} (set TRIPS_API_URL to this)")
+        base_url = args.url
+    else:
+        app.config['TRIPS_API_URL'] = trips.url
+        app.extensions['trips_client'].init_app(app)
+        if database:
+            app.config.update(
+                MYSQL_DATABASE_HOST=database['host'],
+                MYSQL_DATABASE_PORT=database['port'],
+                MYSQL_DATABASE_USER=database['user'],
+                MYSQL_DATABASE_PASSWORD=database['password'],
+                MYSQL_DATABASE_DB=database['db'],
+            )
+        else:
+            stub_db = StubGearDb(emails, args.db_latency)
+        base_url = serve(app)
+
+    requests = generate_requests(
+        emails, args.waiver_share, app.config['CYBERSOURCE_SECRET_KEY']
+    )
+    with mock.patch.object(views, 'db', stub_db) if stub_db else nullcontext():
+        summary = run(
+            Sender(base_url, args.timeout),
+            requests,
+            rate=args.rate,
+            duration=args.duration,
+            concurrency=args.concurrency,
+        )
+    trips.stop()
+
+    report(summary)
+    print(f"mitoc-trips stub: {dict(trips.requests)}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump({'args': vars(args), 'results': summary}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,52 @@
+"""Compare `person_to_update()` against its original fan-out query.
+
+Each member gets one membership, one waiver and one alternate email per year
+of history. The original query joined all three at once, so the rows scanned
+for a single member grew with the cube of their history.
+
+Usage:
+
+    TEST_GEAR_DATABASE_HOST=localhost python -m benchmarks.person_lookup
+"""
+import sys
+import timeit
+from datetime import date
+from unittest import mock
+
+from benchmarks import gear_db
+from member import db
+from member.app import create_app
+
+HISTORY_YEARS = [1, 5, 10, 20, 40]
+REPEAT = 50
+
+
+def main():
+    conn = gear_db.connect_from_env()
+    if conn is None:
+        sys.exit("Set TEST_GEAR_DATABASE_HOST to a scratch MySQL database")
+    gear_db.create_tables(conn)
+    app = create_app()
+
+    print(f"{'years':>5}  {'legacy (ms)':>12}  {'current (ms)':>12}")
+    for years in HISTORY_YEARS:
+        email = f'member-{years}@example.com'
+        gear_db.add_person_with_history(conn, email, years, date.today())
+        all_emails = (email, f'0.{email}')
+
+        def legacy(emails=all_emails):
+            with conn.cursor() as cursor:
+                cursor.execute(gear_db.LEGACY_PERSON_TO_UPDATE, {'all_emails': emails})
+                cursor.fetchone()
+
+        def current(emails=all_emails, primary=email):
+            with app.app_context(), mock.patch.object(db, 'get_db', return_value=conn):
+                db.person_to_update(primary, emails)
+
+        legacy_ms = min(timeit.repeat(legacy, number=REPEAT, repeat=3)) / REPEAT
+        current_ms = min(timeit.repeat(current, number=REPEAT, repeat=3)) / REPEAT
+        print(f"{years:>5}  {legacy_ms * 1000:>12.3f}  {current_ms * 1000:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""A stand-in for the mitoc-trips API, for load tests.
+
+Serves the two routes this service calls, with configurable latency and
+error rates. Every email is its own (only) verified email, and updates to
+memberships are accepted (and counted) but otherwise ignored.
+
+Tokens are decoded but not verified: the stub trusts whatever it's sent.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+
+
+class TripsStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *, latency: float = 0.0, error_rate: float = 0.0, port=0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency  # Seconds before each response
+        self.error_rate = error_rate  # Share of requests answered with a 500
+        self.requests: Counter = Counter()  # (Method, path, status) -> count
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'TripsStub':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, method: str, path: str, status: int):
+        with self._lock:
+            self.requests[method, path, status] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # (So that the client may keep connections open)
+    disable_nagle_algorithm = True  # (Else kept-alive responses wait on ACKs)
+    server: TripsStub
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.split('?')[0] != '/data/verified_emails/':
+            self._respond(404, {})
+            return
+        email = self._claims().get('email', '')
+        self._respond(200, {'primary': email, 'emails': [email]})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path != '/data/membership/':
+            self._respond(404, {})
+            return
+        self._respond(200, {})
+
+    def _claims(self) -> dict:
+        _, _, token = (self.headers.get('Authorization') or '').partition(' ')
+        return jwt.decode(
+            token.strip(), options={'verify_signature': False, 'verify_exp': False}
+        )
+
+    def _respond(self, status: int, body: dict):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if status == 200 and random.random() < self.server.error_rate:
+            status, body = 500, {'error': 'Injected failure'}
+        self.server.count(self.command, self.path.split('?')[0], status)
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass  # (Thousands of requests would otherwise flood stderr)
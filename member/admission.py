@@ -0,0 +1,80 @@
+"""Shed load (with a fast 503) rather than let requests pile up.
+
+When MySQL or mitoc-trips is slow, requests wait on them until the proxy
+times out; CyberSource & DocuSign then retry, adding to the backlog. Instead,
+requests are refused with a 503 & `Retry-After` (so that senders back off)
+when any of these is exhausted:
+
+- Each endpoint may handle only so many requests at once (per process).
+  This matters most under ASGI (or threaded workers), where hundreds of
+  requests may be in flight; a sync worker handles just one at a time.
+- Requests wait only `MYSQL_POOL_TIMEOUT` for a database connection.
+- Requests wait only `TRIPS_API_SLOT_TIMEOUT` to make a request to mitoc-trips
+  (if `TRIPS_API_MAX_CONCURRENT` is set). Telling mitoc-trips about a new
+  membership never fails a webhook, though (see `views._inform_trips`).
+
+Shed requests are counted by endpoint & reason (see `member.metrics`).
+"""
+import threading
+from typing import Dict, Tuple
+
+from flask import _app_ctx_stack, json, request
+
+from member.errors import PoolTimeout, TripsBusy
+
+# Endpoints which are never shed (so that an overloaded worker may be observed)
+EXEMPT_ENDPOINTS = frozenset({'metrics'})
+
+
+class AdmissionControl:
+    def __init__(self):
+        self.max_concurrent = 0  # Per endpoint (0 for no limit)
+        self.retry_after = 5  # Seconds
+
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {}
+        self._shed: Dict[Tuple[str, str], int] = {}
+
+    def init_app(self, app):
+        app.config.setdefault('ADMISSION_MAX_CONCURRENT', self.max_concurrent)
+        app.config.setdefault('ADMISSION_RETRY_AFTER', self.retry_after)
+
+        self.max_concurrent = app.config['ADMISSION_MAX_CONCURRENT']
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+
+        app.extensions['admission'] = self
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+        app.register_error_handler(PoolTimeout, lambda _e: self.shed('db_pool'))
+        app.register_error_handler(TripsBusy, lambda _e: self.shed('trips_api'))
+
+    def _admit(self):
+        endpoint = request.endpoint
+        if not self.max_concurrent or endpoint in EXEMPT_ENDPOINTS or not endpoint:
+            return None
+        with self._lock:
+            in_flight = self._in_flight.get(endpoint, 0)
+            if in_flight < self.max_concurrent:
+                self._in_flight[endpoint] = in_flight + 1
+                _app_ctx_stack.top.admitted = endpoint
+                return None
+        return self.shed('concurrency')
+
+    def _release(self, _exception):
+        endpoint = getattr(_app_ctx_stack.top, 'admitted', None)
+        if endpoint:
+            del _app_ctx_stack.top.admitted
+            with self._lock:
+                self._in_flight[endpoint] -= 1
+
+    def shed(self, reason: str):
+        """Refuse the current request, asking the sender to retry later."""
+        key = (request.endpoint or 'none', reason)
+        with self._lock:
+            self._shed[key] = self._shed.get(key, 0) + 1
+        return json.jsonify(), 503, {'Retry-After': str(self.retry_after)}
+
+    def shed_counts(self) -> Dict[Tuple[str, str], int]:
+        """Return how many requests were shed, by endpoint & reason."""
+        with self._lock:
+            return dict(self._shed)
@@ -1,13 +1,24 @@
+from typing import Optional
+
 from flask import Flask
 
-from member import db, extensions, public
+from member import db, emails, extensions, public
+from member.backfill import backfill_memberships_command, backfill_waivers_command
+from member.envelopes import CompletedEnvelope
+from member.outbox import drain_outbox_command
+from member.spool import drain_spool_command
 
 
-def create_app():
+def create_app(config: Optional[dict] = None):
     app = Flask(__name__)
     app.config.from_object('member.settings')
+    app.config.update(config or {})  # (Overriding any settings)
     app.register_blueprint(public.views.blueprint)
     app.teardown_appcontext(db.close_db)
+    app.cli.add_command(backfill_memberships_command)
+    app.cli.add_command(backfill_waivers_command)
+    app.cli.add_command(drain_outbox_command)
+    app.cli.add_command(drain_spool_command)
 
     _initialize_extensions(app)
 
@@ -16,5 +27,39 @@ def create_app():
 
 def _initialize_extensions(app):
     extensions.mysql.init_app(app)
+    extensions.pool.init_app(app)
+    extensions.replica.init_app(app)
+    extensions.query_log.init_app(app)
+    extensions.outbox.init_app(app)
+    extensions.spool.init_app(app)
+    extensions.coalescer.init_app(app)
+    extensions.trips_client.init_app(app)
+    extensions.metrics.init_app(app)
+    extensions.admission.init_app(app)  # (After metrics, so shed requests count)
+    db.person_cache.configure(
+        app.config['PERSON_CACHE_SIZE'], app.config['PERSON_CACHE_TTL']
+    )
+    db.status_cache.configure(
+        app.config['STATUS_CACHE_SIZE'], app.config['STATUS_CACHE_TTL']
+    )
+    emails.verified_emails_cache.configure(
+        app.config['VERIFIED_EMAILS_CACHE_SIZE'],
+        app.config['VERIFIED_EMAILS_CACHE_TTL'],
+        app.config['VERIFIED_EMAILS_NEGATIVE_TTL'],
+        app.config['VERIFIED_EMAILS_MAX_STALE'],
+    )
     if extensions.sentry:
         extensions.sentry.init_app(app)
+
+
+def warm_up(app):
+    """Prepare a new worker to handle its first request as fast as any other.
+
+    Database connections are opened, envelope XPaths are compiled, and the
+    timezone used for membership dates is loaded. Call this after forking
+    (see `member.gunicorn_config`), or on startup (see `member.asgi`).
+    """
+    with app.app_context():
+        extensions.pool.warm()
+    CompletedEnvelope.warm_up()
+    db.eastern()
@@ -0,0 +1,269 @@
+"""An ASGI entry point, so that one process may handle many webhooks at once.
+
+Sync workers (see `member.wsgi`) handle one request at a time, though they
+spend most of each request waiting on MySQL or mitoc-trips. Under an ASGI server
+(`uvicorn --factory member.asgi:create_application`), up to `ASGI_MAX_IN_FLIGHT`
+requests (200 by default) are handled at once, each on its own thread.
+Any beyond that are refused with a 503 & `Retry-After`, rather than queued.
+Request bodies are streamed to the views as they arrive, and refused with a 413
+once larger than any view accepts (`WAIVER_MAX_BYTES`).
+
+The very same (blocking) views handle each request, so behavior and status
+codes are identical in both modes. This is concurrency from threads, not from
+async I/O (there's no async MySQL driver or HTTP client), which has a cost:
+
+- Each request in flight holds a thread (mostly its stack) while it waits.
+- A request holds a database connection from its first query until it responds.
+  The pool is larger under ASGI (`ASGI_DATABASE_POOL_SIZE`, 20 by default, in
+  place of `GEAR_DATABASE_POOL_SIZE`), but the gear database is shared by every
+  process: requests wait only `MYSQL_POOL_TIMEOUT` for a connection (then get
+  a 503). Waiting on mitoc-trips for verified emails doesn't need one, and with
+  `TRIPS_OUTBOX_PATH` set, neither does informing mitoc-trips.
+
+So hundreds of requests may wait on mitoc-trips at once, but no more than the
+pool's worth may be using the database.
+"""
+import asyncio
+import contextlib
+import functools
+import io
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from werkzeug.exceptions import (
+    ClientDisconnected,
+    RequestEntityTooLarge,
+    ServiceUnavailable,
+)
+
+from member import extensions, settings
+from member.app import create_app, warm_up
+
+
+class BodyStream(io.RawIOBase):
+    """A request body, read by the view (on its thread) as it's received."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: queue.Queue = queue.Queue()
+        self._chunk = b''
+        self._error: Optional[Exception] = None
+        self._ended = False
+
+    def feed(self, chunk: bytes):
+        if chunk:
+            self._chunks.put(chunk)
+
+    def end(self, error: Optional[Exception] = None):
+        """End the body, or have any further reads fail with `error`."""
+        self._chunks.put(error or b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not (self._chunk or self._ended or self._error):
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                self._error = chunk
+            elif chunk:
+                self._chunk = chunk
+            else:
+                self._ended = True
+        if self._error:
+            raise self._error
+
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def wsgi_environ(scope, body: io.RawIOBase) -> dict:
+    """Express an ASGI HTTP request as a WSGI environment (see PEP 3333)."""
+
+    def latin1(text: str) -> str:
+        return text.encode('utf-8').decode('latin-1')
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': latin1(scope.get('root_path', '')),
+        'PATH_INFO': latin1(scope['path']),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BufferedReader(body),
+        'wsgi.input_terminated': True,  # (Even without a `Content-Length`)
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in {'CONTENT_TYPE', 'CONTENT_LENGTH'}:
+            key = f'HTTP_{key}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsgiAdapter:
+    """Serve a Flask app over ASGI, handling each request on its own thread."""
+
+    def __init__(self, app):
+        self.app = app
+        # (Waivers are the largest bodies any view accepts)
+        self.max_body_bytes = app.config['WAIVER_MAX_BYTES']
+        self.max_in_flight = app.config['ASGI_MAX_IN_FLIGHT']
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+        self._in_flight = 0  # (Only changed on the event loop, so needs no lock)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix='asgi'
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await loop.run_in_executor(self._executor, self._startup)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await loop.run_in_executor(None, self._shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _startup(self):
+        """Warm up & resume the outbox & spool (as `post_fork` does)."""
+        warm_up(self.app)
+        if extensions.outbox.enabled:
+            extensions.outbox.start()
+        if extensions.spool.enabled:
+            extensions.spool.start()
+
+    def _shutdown(self):
+        """Stop the outbox & spool (finishing any batch), then wait for requests."""
+        extensions.outbox.stop()
+        extensions.spool.stop()
+        self.close()
+
+    async def _http(self, scope, receive, send):
+        if self._in_flight >= self.max_in_flight:
+            busy = ServiceUnavailable(retry_after=self.retry_after)
+            await self._send(send, *self._refuse(scope, busy))
+            return
+        self._in_flight += 1
+        try:
+            await self._handle(scope, receive, send)
+        finally:
+            self._in_flight -= 1
+
+    async def _handle(self, scope, receive, send):
+        declared = dict(scope['headers']).get(b'content-length', b'')
+        if declared.isdigit() and int(declared) > self.max_body_bytes:
+            await self._send(send, *self._refuse(scope, RequestEntityTooLarge()))
+            return
+
+        body = BodyStream()
+        loop = asyncio.get_running_loop()
+        receiving = asyncio.ensure_future(self._receive_body(receive, body))
+        status, headers, content = await loop.run_in_executor(
+            self._executor, self._respond, wsgi_environ(scope, body)
+        )
+        if not receiving.done():  # (The view didn't need all of the body)
+            receiving.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await receiving
+        elif receiving.result() == 'disconnected':
+            return
+        elif receiving.result() == 'too large':
+            status, headers, content = self._refuse(scope, RequestEntityTooLarge())
+        await self._send(send, status, headers, content)
+
+    async def _receive_body(self, receive, body: BodyStream) -> str:
+        """Feed the body to the view, stopping if it's too large to accept."""
+        received = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.end(ClientDisconnected())
+                return 'disconnected'
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if received > self.max_body_bytes:
+                body.end(RequestEntityTooLarge())
+                return 'too large'
+            body.feed(chunk)
+            if not message.get('more_body', False):
+                body.end()
+                return 'complete'
+
+    def _refuse(self, scope, error):
+        """Respond with an error (without troubling the app)."""
+        return self._respond(wsgi_environ(scope, BodyStream()), error)
+
+    @staticmethod
+    async def _send(send, status, headers, content):
+        await send(
+            {'type': 'http.response.start', 'status': status, 'headers': headers}
+        )
+        await send({'type': 'http.response.body', 'body': content})
+
+    def _respond(self, environ, wsgi_app=None):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            del exc_info  # (Nothing has been sent yet, so we can just start over)
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        iterable = (wsgi_app or self.app)(environ, start_response)
+        try:
+            content = b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return response['status'], response['headers'], content
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def create_application() -> AsgiAdapter:
+    """Create the app to serve over ASGI (with a larger database pool)."""
+    return AsgiAdapter(
+        create_app({'MYSQL_POOL_SIZE': settings.ASGI_DATABASE_POOL_SIZE})
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _application() -> AsgiAdapter:
+    return create_application()
+
+
+def __getattr__(name):
+    """Create `application` on first use (e.g. `uvicorn member.asgi:application`)."""
+    if name == 'application':
+        return _application()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,587 @@
+"""Ingest memberships & waivers that the webhooks missed, in bulk.
+
+When a webhook endpoint was down (or misconfigured), CyberSource and DocuSign
+will eventually give up on retrying. Those payments can be exported from
+CyberSource (one payment per row, with the same fields that are POSTed to
+`/members/membership`) and replayed all at once:
+
+    FLASK_APP=autoapp.py flask backfill-memberships export.csv
+
+Exports may be CSV (with a header row) or JSON Lines, and are read as a stream.
+
+Likewise, a directory of archived DocuSign Connect payloads (the XML that is
+POSTed to `/members/waiver`) can be replayed with:
+
+    FLASK_APP=autoapp.py flask backfill-waivers envelopes/
+
+Envelopes are parsed across a pool of processes.
+
+Either way, records are handled in chunks: each chunk's people are resolved
+with one query, and its new rows are inserted together in a single transaction.
+Anything which was already recorded is skipped, just as the webhooks would.
+"""
+import csv
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+)
+from urllib.error import URLError
+
+import click
+import pymysql
+from flask import current_app
+from flask.cli import with_appcontext
+
+from member import db, extensions
+from member.cybersource import CYBERSOURCE_DT_FORMAT, is_membership_payment
+from member.emails import VerifiedEmails, other_verified_emails, update_membership
+from member.envelopes import CompletedEnvelope
+from member.errors import AlreadyInserted, PoolTimeout
+from member.signature import SignatureVerifier, get_verifier
+
+
+class Payment(NamedTuple):
+    line: int  # Where in the export this payment was found
+    email: str  # As known to mitoc-trips (*not* the billing email)
+    first_name: str
+    last_name: str
+    amount: str
+    datetime_paid: datetime  # UTC
+    affiliation_code: str
+
+    @property
+    def source(self) -> str:
+        return f"Row {self.line}"
+
+
+class Waiver(NamedTuple):
+    path: str  # The envelope this waiver was parsed from
+    email: str
+    first_name: str
+    last_name: str
+    time_signed: datetime  # UTC
+    affiliation: str
+
+    @property
+    def source(self) -> str:
+        return self.path
+
+
+class Progress:
+    """Running totals for a backfill, for reporting throughput."""
+
+    def __init__(self, unit: str = 'rows'):
+        self.unit = unit
+        self.start = time.monotonic()
+        self.rows = 0
+        self.ignored = 0  # Not accepted payments, or incomplete envelopes
+        self.already_inserted = 0
+        self.inserted = 0
+        self.errors: List[str] = []
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / max(time.monotonic() - self.start, 1e-9)
+
+    def __str__(self):
+        return (
+            f"{self.rows} {self.unit} ({self.rows_per_second:.0f} {self.unit}/s): "
+            f"{self.inserted} inserted, {self.already_inserted} already present, "
+            f"{self.ignored} ignored, {len(self.errors)} errors"
+        )
+
+
+def read_export(export: TextIO, fmt: str) -> Iterator[dict]:
+    """Yield each row of a CSV or JSON Lines export, without reading it all."""
+    if fmt == 'csv':
+        yield from csv.DictReader(export)
+    else:
+        for line in export:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_payment(
+    line: int, data: dict, verifier: Optional[SignatureVerifier]
+) -> Optional[Payment]:
+    """Return the membership paid for by a row (if any), as the webhook would.
+
+    Signatures are verified if present (exports may omit them).
+    Raises `ValueError` for rows which the webhook would have rejected.
+    """
+    try:
+        if not is_membership_payment(data):
+            return None
+        if verifier and data.get('signature') and not verifier.verify(data):
+            raise ValueError("Invalid signature")
+
+        payment = Payment(
+            line=line,
+            email=data['req_merchant_defined_data3'],
+            first_name=data.get('req_bill_to_forename') or '',
+            last_name=data.get('req_bill_to_surname') or '',
+            amount=data['req_amount'],
+            datetime_paid=datetime.strptime(
+                data['signed_date_time'], CYBERSOURCE_DT_FORMAT
+            ),
+            affiliation_code=data.get('req_merchant_defined_data2'),
+        )
+    except KeyError as e:
+        raise ValueError(f"Missing {e}") from e
+    db.affiliation_for_payment(payment.affiliation_code, payment.amount)
+    return payment
+
+
+def parse_envelope(path: str) -> Tuple[str, Optional[Waiver], Optional[str]]:
+    """Return the waiver completed in an envelope (if any), or why it's invalid.
+
+    This runs in a worker process, so errors are returned rather than raised
+    (and everything returned must be picklable).
+    """
+    try:
+        with open(path, 'rb') as handle:
+            env = CompletedEnvelope.from_stream(handle)
+        if not env.completed:
+            return path, None, None  # Still awaiting guardian's signature
+        waiver = Waiver(
+            path=path,
+            email=env.releasor_email,
+            first_name=env.first_name,
+            last_name=env.last_name,
+            time_signed=env.time_signed,
+            affiliation=env.affiliation,
+        )
+    except Exception as e:  # pylint: disable=broad-except
+        return path, None, f"{type(e).__name__}: {e}"
+    return path, waiver, None
+
+
+def lookup_verified_emails(
+    emails: Iterable[str], workers: int
+) -> Dict[str, Optional[VerifiedEmails]]:
+    """Ask mitoc-trips for the verified emails of many people concurrently.
+
+    Emails which could not be looked up map to `None`.
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+
+    def lookup(email):
+        with app.app_context():
+            try:
+                return other_verified_emails(email)
+            except URLError:
+                return None
+
+    emails = list(emails)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(emails, executor.map(lookup, emails)))
+
+
+def _people_for(records, verified: Dict[str, VerifiedEmails]) -> List[int]:
+    """Return the person to update for each record, creating any not found."""
+    people = db.people_to_update(
+        [verified[record.email].all_emails for record in records]
+    )
+
+    # As in the webhooks, create anybody not found under their primary email
+    created: Dict[str, int] = {}
+    for i, (record, person_id) in enumerate(zip(records, people)):
+        if person_id is None:
+            primary = verified[record.email].primary
+            if primary not in created:
+                created[primary] = db.add_person(
+                    record.first_name, record.last_name, primary
+                )
+            people[i] = created[primary]
+    return people
+
+
+def _new_records(
+    people: List[int], datetimes: Sequence[datetime], already_inserted: List[bool]
+) -> List[int]:
+    """Return the index of each record that has yet to be inserted."""
+    new, seen = [], set()
+    for i, (person_id, dt) in enumerate(zip(people, datetimes)):
+        # The same record may also be repeated within one backfill
+        key = (person_id, dt.date())
+        if not already_inserted[i] and key not in seen:
+            seen.add(key)
+            new.append(i)
+    return new
+
+
+def ingest_memberships(
+    payments: List[Payment], verified: Dict[str, VerifiedEmails]
+) -> List[Optional[date]]:
+    """Record many payments in one transaction.
+
+    Returns when each membership expires (or `None` if already inserted).
+    """
+    results: List[Optional[date]] = [None] * len(payments)
+    if not payments:
+        return results
+
+    with db.transaction():
+        people = _people_for(payments, verified)
+        datetimes = [payment.datetime_paid for payment in payments]
+        new = _new_records(
+            people, datetimes, db.already_inserted_memberships(zip(people, datetimes))
+        )
+        expirations = db.add_memberships(
+            [
+                (
+                    people[i],
+                    payments[i].amount,
+                    payments[i].datetime_paid,
+                    payments[i].affiliation_code,
+                )
+                for i in new
+            ]
+        )
+    for i, expires in zip(new, expirations):
+        results[i] = expires
+    return results
+
+
+def ingest_waivers(
+    waivers: List[Waiver], verified: Dict[str, VerifiedEmails]
+) -> List[Optional[date]]:
+    """Record many waivers in one transaction.
+
+    Returns when each waiver expires (or `None` if already inserted).
+    """
+    results: List[Optional[date]] = [None] * len(waivers)
+    if not waivers:
+        return results
+
+    with db.transaction():
+        people = _people_for(waivers, verified)
+        datetimes = [waiver.time_signed for waiver in waivers]
+        new = _new_records(
+            people, datetimes, db.already_added_waivers(zip(people, datetimes))
+        )
+        expirations = db.add_waivers([(people[i], datetimes[i]) for i in new])
+
+        # The affiliation stated on the latest waiver is the most recent we know!
+        person_affiliations = {}
+        for i in sorted(new, key=datetimes.__getitem__):
+            person_affiliations[people[i]] = waivers[i].affiliation
+        db.update_affiliations(person_affiliations)
+    for i, expires in zip(new, expirations):
+        results[i] = expires
+    return results
+
+
+# Errors which say nothing about the records (so all may simply be retried later)
+TRANSIENT_ERRORS = (
+    pymysql.err.OperationalError,  # (Including deadlocks & lock wait timeouts)
+    pymysql.err.InterfaceError,
+    PoolTimeout,
+)
+
+
+def ingest_isolating(
+    ingest, records: list, verified: Dict[str, VerifiedEmails]
+) -> Tuple[List[Optional[date]], Dict[int, str]]:
+    """Record records with `ingest` (in as few transactions as possible).
+
+    If a chunk of records can't be recorded, it's split in two and each half
+    is tried on its own, so that a bad record fails alone (not its chunk).
+    Returns when each record expires (as `ingest` does), and why any records
+    failed (by index). Transient errors (e.g. the database is down) are raised.
+    """
+    try:
+        return _ingest_skipping_inserted(ingest, records, verified), {}
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception as e:  # pylint: disable=broad-except
+        if len(records) == 1:
+            return [None], {0: f"{type(e).__name__}: {e}"}
+
+    half = len(records) // 2
+    first, first_errors = ingest_isolating(ingest, records[:half], verified)
+    second, second_errors = ingest_isolating(ingest, records[half:], verified)
+    errors = {**first_errors, **{half + i: e for i, e in second_errors.items()}}
+    return first + second, errors
+
+
+def _ingest_skipping_inserted(ingest, records, verified) -> List[Optional[date]]:
+    """Retry whenever a record is inserted concurrently (e.g. by a webhook).
+
+    Each retry skips whatever was inserted, so a few retries always suffice.
+    """
+    for _ in range(len(records)):
+        try:
+            return ingest(records, verified)
+        except AlreadyInserted:
+            continue
+    return ingest(records, verified)
+
+
+def notify_trips(expirations: Dict[str, date], workers: int, field: str) -> int:
+    """Inform mitoc-trips of new memberships or waivers, returning failures.
+
+    `field` is the keyword argument to `update_membership()` for the dates.
+    With an outbox, updates are just queued (and so never fail here).
+    """
+    if extensions.outbox.enabled:
+        for email, expires in expirations.items():
+            extensions.outbox.append(email, **{field: expires})
+        return 0
+
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+
+    def notify(item):
+        email, expires = item
+        with app.app_context():
+            try:
+                update_membership(email, **{field: expires})
+            except URLError:
+                return False
+            return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(not ok for ok in executor.map(notify, expirations.items()))
+
+
+def _parse_chunk(chunk, verifier, pool, progress: Progress) -> List[Payment]:
+    invalid = set()
+    if verifier:  # Signatures are verified together (perhaps across processes)
+        signed = [
+            (line, data)
+            for line, data in chunk
+            if data.get('signature') and is_membership_payment(data)
+        ]
+        valid = verifier.verify_many([data for _, data in signed], pool)
+        invalid = {line for (line, _), ok in zip(signed, valid) if not ok}
+
+    payments = []
+    for line, data in chunk:
+        if line in invalid:
+            progress.errors.append(f"Row {line}: Invalid signature")
+            continue
+        try:
+            payment = parse_payment(line, data, None)
+        except ValueError as e:
+            progress.errors.append(f"Row {line}: {e}")
+            continue
+        if payment is None:
+            progress.ignored += 1
+        else:
+            payments.append(payment)
+    return payments
+
+
+def _ingest(records, lookup_trips: bool, workers: int, progress: Progress):
+    """Resolve the emails in parsed records, then insert them & notify mitoc-trips."""
+    if lookup_trips:
+        verified = lookup_verified_emails({r.email for r in records}, workers)
+    else:
+        verified = {r.email: VerifiedEmails(r.email, [r.email]) for r in records}
+    for record in records:
+        if verified[record.email] is None:
+            progress.errors.append(f"{record.source}: could not look up {record.email}")
+    records = [record for record in records if verified[record.email]]
+
+    if records and isinstance(records[0], Waiver):
+        ingest, field = ingest_waivers, 'waiver_expires'
+    else:
+        ingest, field = ingest_memberships, 'membership_expires'
+    expirations, errors = ingest_isolating(ingest, records, verified)
+
+    latest: Dict[str, date] = {}
+    for i, (record, expires) in enumerate(zip(records, expirations)):
+        if i in errors:
+            progress.errors.append(f"{record.source}: {errors[i]}")
+            continue
+        if expires is None:
+            progress.already_inserted += 1
+            continue
+        progress.inserted += 1
+        primary = verified[record.email].primary
+        latest[primary] = max(expires, latest.get(primary, expires))
+
+    if lookup_trips and latest:
+        failures = notify_trips(latest, workers, field)
+        if failures:
+            progress.errors.append(f"Failed to notify mitoc-trips {failures}x")
+
+
+def backfill_memberships(
+    rows: Iterable[dict],
+    *,
+    chunk_size: int = 500,
+    lookup_trips: bool = True,
+    workers: int = 8,
+    processes: Optional[int] = 0,
+    on_chunk=None,
+) -> Progress:
+    """Ingest every membership payment in the given rows.
+
+    Signatures are verified across `processes` (by default, in this process;
+    `None` for one per CPU).
+    """
+    # pylint: disable=too-many-arguments
+    progress = Progress()
+
+    verifier = None
+    if current_app.config['VERIFY_CYBERSOURCE_SIGNATURE']:
+        verifier = get_verifier(
+            current_app.config['CYBERSOURCE_SECRET_KEY'],
+            *current_app.config['CYBERSOURCE_PREVIOUS_SECRET_KEYS'],
+        )
+
+    pool = verifier.pool(processes) if verifier and processes != 0 else None
+    try:
+        numbered = enumerate(rows, start=1)
+        while True:
+            chunk = list(itertools.islice(numbered, chunk_size))
+            if not chunk:
+                break
+            progress.rows += len(chunk)
+            payments = _parse_chunk(chunk, verifier, pool, progress)
+            _ingest(payments, lookup_trips, workers, progress)
+            if on_chunk:
+                on_chunk(progress)
+    finally:
+        if pool:
+            pool.shutdown()
+    return progress
+
+
+def backfill_waivers(
+    paths: Iterable[str],
+    *,
+    chunk_size: int = 500,
+    lookup_trips: bool = True,
+    workers: int = 8,
+    processes: Optional[int] = None,
+    on_chunk=None,
+) -> Progress:
+    """Ingest the waiver completed in each envelope.
+
+    Envelopes are parsed in other processes while each chunk is ingested.
+    """
+    # pylint: disable=too-many-arguments
+    progress = Progress(unit='envelopes')
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        parsed = executor.map(parse_envelope, paths, chunksize=16)
+        while True:
+            chunk = list(itertools.islice(parsed, chunk_size))
+            if not chunk:
+                break
+            progress.rows += len(chunk)
+
+            waivers = []
+            for path, waiver, error in chunk:
+                if error:
+                    progress.errors.append(f"{path}: {error}")
+                elif waiver is None:
+                    progress.ignored += 1
+                else:
+                    waivers.append(waiver)
+
+            _ingest(waivers, lookup_trips, workers, progress)
+            if on_chunk:
+                on_chunk(progress)
+    return progress
+
+
+def _report(progress: Progress):
+    for error in progress.errors:
+        click.echo(error, err=True)
+    click.echo(f"Done. {progress}")
+    if progress.errors:
+        sys.exit(1)
+
+
+trips_option = click.option(
+    '--trips/--no-trips',
+    default=True,
+    help="Look up verified emails on (and report new records to) mitoc-trips.",
+)
+workers_option = click.option(
+    '--workers',
+    default=8,
+    show_default=True,
+    help="Concurrent requests to mitoc-trips.",
+)
+
+
+@click.command('backfill-memberships')
+@click.argument('export', type=click.File('r'))
+@click.option(
+    '--format',
+    'fmt',
+    type=click.Choice(['csv', 'jsonl']),
+    help="Format of the export (by default, inferred from the file extension).",
+)
+@click.option('--chunk-size', default=500, show_default=True)
+@trips_option
+@workers_option
+@click.option(
+    '--processes',
+    type=int,
+    default=0,
+    help="Processes verifying signatures (by default, none but this one).",
+)
+@with_appcontext
+def backfill_memberships_command(export, *, fmt, chunk_size, trips, workers, processes):
+    """Ingest membership payments from a CyberSource export."""
+    # pylint: disable=too-many-arguments
+    if fmt is None:
+        fmt = 'jsonl' if export.name.endswith(('.jsonl', '.json')) else 'csv'
+
+    _report(
+        backfill_memberships(
+            read_export(export, fmt),
+            chunk_size=chunk_size,
+            lookup_trips=trips,
+            workers=workers,
+            processes=processes,
+            on_chunk=click.echo,
+        )
+    )
+
+
+@click.command('backfill-waivers')
+@click.argument(
+    'directory', type=click.Path(exists=True, file_okay=False, dir_okay=True)
+)
+@click.option('--chunk-size', default=500, show_default=True)
+@trips_option
+@workers_option
+@click.option(
+    '--processes',
+    type=int,
+    help="Processes parsing envelopes (by default, one per CPU).",
+)
+@with_appcontext
+def backfill_waivers_command(directory, *, chunk_size, trips, workers, processes):
+    """Ingest waivers from a directory of DocuSign envelopes (`*.xml`)."""
+    paths = sorted(str(path) for path in Path(directory).rglob('*.xml'))
+    _report(
+        backfill_waivers(
+            paths,
+            chunk_size=chunk_size,
+            lookup_trips=trips,
+            workers=workers,
+            processes=processes,
+            on_chunk=click.echo,
+        )
+    )
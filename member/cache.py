@@ -0,0 +1,111 @@
+"""A small in-process cache with LRU eviction and a time-to-live.
+
+Each worker process has its own cache. Anything cached here may be up to
+`ttl` seconds out of date with respect to writes made by *other* processes,
+so callers are responsible for invalidating entries after their own writes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, Optional, Tuple
+
+
+class CacheStats(NamedTuple):
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int  # Entries dropped to make room (not expired or invalidated)
+    invalidations: int
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TTLCache:  # pylint: disable=too-many-instance-attributes
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def configure(self, maxsize: int, ttl: float):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value (if present & not expired), else the default."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def get_stale(
+        self, key: Hashable, max_stale: float, default: Any = None
+    ) -> Tuple[Any, bool]:
+        """Return the cached value & whether it's expired (by at most `max_stale`)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is None or entry[0] + max_stale < now:
+                self._misses += 1
+                return default, False
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1], entry[0] < now
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Cache the value (for `ttl` seconds, if given, instead of the default)."""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return  # Caching is disabled
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+        """Drop every entry for which `predicate(key, value)` is true."""
+        with self._lock:
+            stale = [
+                key
+                for key, (_, value) in self._entries.items()
+                if predicate(key, value)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self._invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                size=len(self._entries),
+                maxsize=self.maxsize,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                invalidations=self._invalidations,
+            )
@@ -0,0 +1,141 @@
+"""Coalesce duplicate webhooks which reach different workers at the same time.
+
+CyberSource & DocuSign retry aggressively, so the same payment (or waiver)
+often arrives twice in quick succession, each copy in a different gunicorn
+worker. Each would look up verified emails and the person to update, and
+(with both passing the `already_*` checks) both might try to insert.
+
+With a registry configured, each webhook is first claimed by its identity
+(the CyberSource transaction, or who signed a waiver & when) in a local SQLite
+file shared by every worker on the host. Only the worker holding the claim
+does the work; duplicates wait for its result and respond with that. While
+waiting, duplicates only read the file (backing off as they go), so they don't
+contend for its write lock. If the result doesn't come within a couple of
+seconds, duplicates respond with a cheap 202 (the sender may retry, which is
+always safe). Results are remembered for a while, so that
+later retries are answered without touching the gear database at all.
+
+A claim is released if the work fails (so that a duplicate may retry), and
+lapses if its worker dies.
+"""
+import time
+from contextlib import closing
+from typing import Callable, Optional
+
+from member.sqlite_queue import SqliteFile
+
+SCHEMA = '''
+    create table if not exists webhook_claims (
+      key text primary key,
+      claimed real not null,  -- When the claim was made (or the work finished)
+      status integer null  -- The response to the webhook (once it's finished)
+    )
+'''
+
+
+class Coalescer(SqliteFile):
+    # Losing a claim (on power loss) just means a duplicate does the work
+    synchronous = 'normal'
+
+    def __init__(self):
+        super().__init__()  # (Duplicates are not coalesced without a path)
+        self.wait_seconds = 2.0  # How long duplicates wait (holding their worker)
+        self.ttl = 3600.0  # How long results are remembered
+        self.lease_seconds = 60.0  # (Beyond gunicorn's timeout for a worker)
+        self.poll_interval = 0.02  # (Doubling while waiting, up to the max)
+        self.max_poll_interval = 0.5
+
+    def init_app(self, app):
+        app.config.setdefault('WEBHOOK_COALESCE_PATH', self.path)
+        app.config.setdefault('WEBHOOK_COALESCE_WAIT', self.wait_seconds)
+        app.config.setdefault('WEBHOOK_COALESCE_TTL', self.ttl)
+
+        self.path = app.config['WEBHOOK_COALESCE_PATH']
+        self.wait_seconds = app.config['WEBHOOK_COALESCE_WAIT']
+        self.ttl = app.config['WEBHOOK_COALESCE_TTL']
+
+        app.extensions['webhook_coalescer'] = self
+        if self.path:
+            self._create(SCHEMA)
+
+    def _state(self, row, now: float) -> Optional[int]:
+        """Return the response to a finished webhook, 0 if claimed, else `None`."""
+        if row:
+            claimed, status = row
+            if status is not None and claimed > now - self.ttl:
+                return status
+            if status is None and claimed > now - self.lease_seconds:
+                return 0
+        return None
+
+    def _claim(self, key: str) -> Optional[int]:
+        """Claim the webhook, or return the response to it (if already finished).
+
+        Returns 0 if another worker holds an unexpired claim.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                'select claimed, status from webhook_claims where key = ?', [key]
+            ).fetchone()
+            state = self._state(row, now)
+            if state is not None:
+                return state
+            conn.execute(
+                'insert or replace into webhook_claims (key, claimed) values (?, ?)',
+                [key, now],
+            )
+        return None
+
+    def _peek(self, key: str) -> Optional[int]:
+        """As `_claim()`, but only look (without taking the write lock)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                'select claimed, status from webhook_claims where key = ?', [key]
+            ).fetchone()
+        return self._state(row, time.time())
+
+    def _finish(self, key: str, status: int):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'update webhook_claims set claimed = ?, status = ? where key = ?',
+                [now, status, key],
+            )
+            # (Cheap, since results are forgotten at about the rate they're made)
+            conn.execute(
+                'delete from webhook_claims where claimed < ? and status is not null',
+                [now - self.ttl],
+            )
+
+    def _release(self, key: str):
+        with self._transaction() as conn:
+            conn.execute('delete from webhook_claims where key = ?', [key])
+
+    def run(self, key: str, handle: Callable[[], int]) -> int:
+        """Handle the webhook (returning the status), unless it's a duplicate.
+
+        Duplicates get the status that the original was (or will soon be)
+        given, or 202 if it's still being handled after waiting.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        delay = self.poll_interval
+        status = self._claim(key)
+        while status == 0 and time.monotonic() < deadline:
+            time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 2, self.max_poll_interval)
+            status = self._peek(key)
+            if status is None:  # Released (or lapsed), so we may take it over
+                status = self._claim(key)
+        if status == 0:
+            return 202
+        if status is not None:
+            return status
+
+        try:
+            status = handle()
+        except BaseException:
+            self._release(key)
+            raise
+        self._finish(key, status)
+        return status
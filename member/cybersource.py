@@ -1 +1,8 @@
 CYBERSOURCE_DT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def is_membership_payment(data) -> bool:
+    """Return if the transaction is an accepted payment of membership dues."""
+    if data['decision'] != 'ACCEPT':
+        return False  # Transaction canceled, declined, etc.
+    return data['req_merchant_defined_data1'] == 'membership'
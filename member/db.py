@@ -1,35 +1,98 @@
-from datetime import timedelta
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, FrozenSet, List, NamedTuple, Optional
 
 import pytz
 from flask import _app_ctx_stack
 from mitoc_const import affiliations
 
-from member.errors import IncorrectPayment, InvalidAffiliation
-from member.extensions import mysql
+from member.cache import TTLCache
+from member.errors import AlreadyInserted, IncorrectPayment, InvalidAffiliation
+from member.extensions import pool, query_log, replica
+from member.metrics import phase
 
 # Map from the two-letter codes in MITOC Trips to the affiliation strings in the geardb,
 # as well as the expected price for that membership level
 AFFILIATION_MAPPING = {
     aff.CODE: (aff.VALUE, aff.ANNUAL_DUES) for aff in affiliations.ALL
 }
+# Every affiliation string in the geardb
+AFFILIATION_VALUES = frozenset(value for value, _ in AFFILIATION_MAPPING.values())
 
+# Which person to update for a given set of verified emails (see `person_to_update`)
+person_cache = TTLCache()
+# When the membership & waiver for an email expire (see `expirations_for`)
+status_cache = TTLCache()
 
-EST = pytz.timezone('US/Eastern')  # GMT-4 or GMT-5, depending on DST
+
+def eastern():
+    """Return US/Eastern (GMT-4 or GMT-5, depending on DST).
+
+    pytz reads the zone from disk on first use (then caches it), so this is
+    deferred until needed (or a worker is warmed up) rather than on import.
+    """
+    return pytz.timezone('US/Eastern')
 
 
 def get_db():
-    """Opens a new connection if not already in current app context."""
+    """Checks out a pooled connection if not already in current app context."""
     top = _app_ctx_stack.top
     if not hasattr(top, 'conn'):
-        top.conn = mysql.connect()
+        top.conn = pool.checkout()
     return top.conn
 
 
+def _cursor():
+    """Return a cursor which records each statement (see `member.queries`)."""
+    return query_log.cursor(get_db())
+
+
+def _replica_conn():
+    """Return the replica connection for pure reads, or `None` for the primary.
+
+    Reads within a `transaction()` go to the primary, since what they find
+    decides what's written. So does everything once this unit of work has
+    written (so that it sees its own writes). See `member.replica` for the rest.
+    """
+    top = _app_ctx_stack.top
+    if (
+        not replica.enabled
+        or getattr(top, 'in_transaction', False)
+        or getattr(top, 'db_wrote', False)
+    ):
+        return None
+    if not hasattr(top, 'replica_conn'):
+        top.replica_conn = replica.checkout()
+    return top.replica_conn
+
+
+def _read_cursor():
+    """Return a cursor for a pure read, from the replica if it's suitable."""
+    conn = _replica_conn()
+    return _cursor() if conn is None else query_log.cursor(conn)
+
+
+def _cacheable() -> bool:
+    """Return if what was just read may be cached (until its TTL).
+
+    Our writes invalidate cached lookups, but a replica may not have them yet:
+    what it returns is used, but not cached (or it could outlive invalidation).
+    """
+    return _replica_conn() is None or not replica.may_lack_writes()
+
+
 def close_db(_exception):
-    """Closes the database again at the end of the request."""
+    """Returns the connection(s) to the pool at the end of the request."""
     top = _app_ctx_stack.top
     if hasattr(top, 'conn'):
-        top.conn.close()
+        pool.checkin(top.conn)
+        del top.conn
+    if hasattr(top, 'replica_conn'):
+        if top.replica_conn is not None:
+            replica.checkin(top.replica_conn)
+        del top.replica_conn
+    top.db_wrote = False
 
 
 def commit():
@@ -37,13 +100,142 @@ def commit():
     get_db().commit()
 
 
+class KnownPerson(NamedTuple):
+    """What this unit of work has already read (or written) about a person."""
+
+    affiliation: Optional[str]
+    membership_expires: Optional[date]  # Only if the membership is current
+
+
+def _known_people():
+    top = _app_ctx_stack.top
+    if not hasattr(top, 'known_people'):
+        top.known_people = {}
+    return top.known_people
+
+
+def _known_person(person_id) -> KnownPerson:
+    """Return what's known about the person, querying only if necessary."""
+    return _load_known_people([person_id])[person_id]
+
+
+def _load_known_people(person_ids) -> Dict[int, KnownPerson]:
+    """Return what's known about each person, querying for any not yet known."""
+    known_people = _known_people()
+    unknown = sorted(set(person_ids) - set(known_people))
+    if unknown:
+        cursor = _read_cursor()
+        cursor.execute(
+            '''
+            select p.id,
+                   p.affiliation,
+                   (select max(pm.expires)
+                      from people_memberships pm
+                     where pm.person_id = p.id
+                       and pm.expires > now())
+              from people p
+             where p.id in %(person_ids)s
+            ''',
+            {'person_ids': unknown},
+        )
+        for person_id, affiliation, membership_expires in cursor.fetchall():
+            known_people[person_id] = KnownPerson(affiliation, membership_expires)
+        for person_id in unknown:
+            known_people.setdefault(person_id, KnownPerson(None, None))
+    return known_people
+
+
+def _mark_written():
+    top = _app_ctx_stack.top
+    top.db_written = True
+    top.db_wrote = True  # (Not reset by a commit, see `_replica_conn`)
+    replica.wrote()
+
+
+class PersonResolution(NamedTuple):
+    """The result of `person_to_update()` for one set of emails."""
+
+    person_id: Optional[int]
+    candidate_ids: FrozenSet[int]  # Every account matching any of the emails
+
+
+def _email_key(all_emails) -> FrozenSet[str]:
+    # Comparisons in the gear database are case-insensitive
+    return frozenset(email.strip().lower() for email in all_emails)
+
+
+def _invalidate_people(person_ids=(), emails=()):
+    """Forget cached lookups which a write to these people/emails could change.
+
+    Entries are dropped immediately, and again once the transaction ends
+    (in case a concurrent lookup cached what was read before our commit).
+    """
+    person_ids, emails = set(person_ids), set(_email_key(emails))
+
+    def affected(key, resolution):
+        return bool(person_ids & resolution.candidate_ids or emails & key)
+
+    def affected_status(email, status):
+        return bool(person_ids & status.candidate_ids or email in emails)
+
+    top = _app_ctx_stack.top
+    if not hasattr(top, 'pending_invalidations'):
+        top.pending_invalidations = []
+    for cache, predicate in [(person_cache, affected), (status_cache, affected_status)]:
+        cache.invalidate_where(predicate)
+        top.pending_invalidations.append((cache, predicate))
+
+
+@contextmanager
+def transaction():
+    """Perform all reads & writes for one webhook as a single unit of work.
+
+    Writes made within the block are committed exactly once when it exits
+    (or rolled back upon any exception). Read-only blocks don't commit at all.
+
+    While in the block, what's learned about a person from `person_to_update()`
+    (or from our own writes) is remembered, so that we needn't query for it
+    again (or issue writes that would change nothing).
+    """
+    top = _app_ctx_stack.top
+    top.in_transaction = True
+    try:
+        yield
+    except BaseException:
+        if getattr(top, 'db_written', False):
+            get_db().rollback()
+        raise
+    else:
+        if getattr(top, 'db_written', False):
+            with phase('commit'):
+                get_db().commit()
+    finally:
+        top.in_transaction = top.db_written = False
+        _known_people().clear()
+        for cache, affected in getattr(top, 'pending_invalidations', []):
+            cache.invalidate_where(affected)
+        top.pending_invalidations = []
+
+
+def _one_year_after(day):
+    """Return the same day next year, as MySQL's `date_add(day, interval 1 year)`.
+
+    Works on both dates & datetimes (Feb 29th becomes Feb 28th).
+    """
+    try:
+        return day.replace(year=day.year + 1)
+    except ValueError:
+        return day.replace(year=day.year + 1, day=28)
+
+
 def add_person(first, last, email):
     """Create a new person in the gear database.
 
     This is only to be done when we cannot find an existing membership
-    under any known email addresses.
+    under any known email addresses. If somebody was created with this same
+    email in the meantime (e.g. by a concurrent webhook), they're returned.
     """
-    cursor = get_db().cursor()
+    cursor = _cursor()
     cursor.execute(
         '''
         -- Omitted columns (left `null`):
@@ -52,9 +244,14 @@ def add_person(first, last, email):
         -- * city & state: we've historically not bothered tracking
         insert into people (firstname, lastname, email, mitoc_credit, date_inserted)
         values (%(first)s, %(last)s, %(email)s, 0, now())
+            on duplicate key update id = last_insert_id(id)
         ''',
         {'first': first, 'last': last, 'email': email},
     )
+    _mark_written()
+    _invalidate_people(emails=[email])
+    if cursor.rowcount == 1:  # (Not an existing person)
+        _known_people()[cursor.lastrowid] = KnownPerson(None, None)
     return cursor.lastrowid
 
 
@@ -63,17 +260,7 @@ def current_membership_expires(person_id):
 
     If there's no current membership, `None` is returned.
     """
-    cursor = get_db().cursor()
-    cursor.execute(
-        '''
-        select max(expires)
-          from people_memberships
-         where person_id = %(person_id)s
-           and expires > now()
-        ''',
-        {'person_id': person_id},
-    )
-    return cursor.fetchone()[0]
+    return _known_person(person_id).membership_expires
 
 
 def membership_start(person_id, datetime_paid):
@@ -89,7 +276,7 @@ def membership_start(person_id, datetime_paid):
     First-time members (or already-expired members) will obviously have
     memberships valid one calendar year from the datetime they paid.
     """
-    date_paid = EST.fromutc(datetime_paid).date()
+    date_paid = eastern().fromutc(datetime_paid).date()
 
     future_expiration = current_membership_expires(person_id)
     if not future_expiration:  # New member, or already expired
@@ -105,11 +292,14 @@ def membership_start(person_id, datetime_paid):
 
 def update_affiliation(person_id, affiliation):
     """Update the current affiliation known for the person."""
-    if affiliation not in {aff.VALUE for aff in affiliations.ALL}:
+    if affiliation not in AFFILIATION_VALUES:
         raise ValueError(f"Unknown affiliation! {affiliation}")
 
-    db = get_db()
-    cursor = db.cursor()
+    known = _known_person(person_id)
+    if known.affiliation == affiliation:
+        return  # Nothing would change
+
+    cursor = _cursor()
 
     # We store the member's current affiliation directly on `people`
     cursor.execute(
@@ -120,12 +310,12 @@ def update_affiliation(person_id, affiliation):
         ''',
         {'affiliation': affiliation, 'person_id': person_id},
     )
+    _mark_written()
+    _known_people()[person_id] = known._replace(affiliation=affiliation)
 
 
-def add_membership(person_id, price_paid, datetime_paid, two_letter_affiliation_code):
-    """Add a membership payment for an existing MITOC member."""
-    db = get_db()
-    cursor = db.cursor()
+def affiliation_for_payment(two_letter_affiliation_code, price_paid) -> str:
+    """Return the affiliation a membership payment is for, if paid in full."""
     try:
         affiliation, expected_price = AFFILIATION_MAPPING[two_letter_affiliation_code]
     except KeyError:
@@ -138,141 +328,440 @@ def add_membership(person_id, price_paid, datetime_paid, two_letter_affiliation_
     if expected_price != float(price_paid):
         raise IncorrectPayment(f"Expected {expected_price}, got {price_paid}")
 
+    return affiliation
+
+
+# Multi-row inserts are used when given to `executemany()`.
+# Duplicates (the same person paying on the same day) are ignored, not updated.
+INSERT_MEMBERSHIP = '''
+    insert into people_memberships
+           (person_id, price_paid, membership_type, date_inserted, expires, paid_on)
+    values (%(person_id)s, %(price_paid)s, %(membership_type)s, now(),
+            %(expires)s, %(paid_on)s)
+        on duplicate key update id = id
+'''
+
+
+# As above, but also ignored if it duplicates a membership from before the day
+# of payment was recorded (matched, as in `already_inserted_memberships()`, on
+# when it would expire)
+INSERT_MEMBERSHIP_UNLESS_LEGACY = '''
+    insert into people_memberships
+           (person_id, price_paid, membership_type, date_inserted, expires, paid_on)
+    select %(person_id)s, %(price_paid)s, %(membership_type)s, now(),
+           %(expires)s, %(paid_on)s
+      from dual
+     where not exists (select 1
+                         from people_memberships
+                        where person_id = %(person_id)s
+                          and paid_on is null
+                          and expires in %(legacy_expires)s)
+        on duplicate key update id = id
+'''
+
+
+def add_membership(person_id, price_paid, datetime_paid, two_letter_affiliation_code):
+    """Add a membership payment for an existing MITOC member.
+
+    Raises `AlreadyInserted` if this person already paid on this (UTC) day,
+    including memberships recorded before the day of payment was.
+    """
+    cursor = _cursor()
+    affiliation = affiliation_for_payment(two_letter_affiliation_code, price_paid)
+
+    # Computed here (rather than with `date_add()`) to avoid a second query
+    expires = _one_year_after(membership_start(person_id, datetime_paid))
     cursor.execute(
-        '''
-        insert into people_memberships
-               (person_id, price_paid, membership_type, date_inserted, expires)
-        values (%(person_id)s, %(price_paid)s, %(membership_type)s, now(),
-                date_add(%(membership_start)s, interval 1 year))
-        ''',
+        INSERT_MEMBERSHIP_UNLESS_LEGACY,
         {
             'person_id': person_id,
             'price_paid': price_paid,
             'membership_type': two_letter_affiliation_code,
-            'membership_start': membership_start(person_id, datetime_paid),
+            'expires': expires,
+            'paid_on': datetime_paid.date(),
+            'legacy_expires': sorted({expires, _one_year_after(datetime_paid.date())}),
         },
     )
+    if not cursor.rowcount:
+        raise AlreadyInserted(f"Membership paid {datetime_paid} for {person_id}")
+    _mark_written()
+    _invalidate_people(person_ids=[person_id])
+    _known_people()[person_id] = _known_person(person_id)._replace(
+        membership_expires=expires
+    )
 
     update_affiliation(person_id, affiliation)
-    db.commit()
+    return cursor.lastrowid, expires
 
-    # MySQL doesn't support `returning` :(
-    cursor.execute(
-        '''
-        select id, expires
-          from people_memberships
-         where id = %(membership_id)s
-        ''',
-        {'membership_id': cursor.lastrowid},
-    )
-    membership_id, date_expires = cursor.fetchone()
-    return membership_id, date_expires
+
+def add_memberships(memberships) -> List[date]:
+    """Add many membership payments at once, returning when each expires.
+
+    Each membership is a tuple of the arguments to `add_membership()`.
+    Memberships are applied in the order given (so paying twice extends
+    a membership twice), but all are inserted with a single statement.
+    Raises `AlreadyInserted` if any were (so nothing should be committed).
+    """
+    memberships = list(memberships)
+    if not memberships:
+        return []
+
+    _load_known_people(person_id for person_id, *_ in memberships)
+    known_people = _known_people()
+
+    rows = []
+    person_affiliations = {}
+    for person_id, price_paid, datetime_paid, code in memberships:
+        person_affiliations[person_id] = affiliation_for_payment(code, price_paid)
+        expires = _one_year_after(membership_start(person_id, datetime_paid))
+        known_people[person_id] = known_people[person_id]._replace(
+            membership_expires=expires
+        )
+        rows.append(
+            {
+                'person_id': person_id,
+                'price_paid': price_paid,
+                'membership_type': code,
+                'expires': expires,
+                'paid_on': datetime_paid.date(),
+            }
+        )
+
+    cursor = _cursor()
+    cursor.executemany(INSERT_MEMBERSHIP, rows)
+    _mark_written()
+    if cursor.rowcount < len(rows):
+        raise AlreadyInserted(f"{len(rows) - cursor.rowcount} memberships")
+    _invalidate_people(person_ids=person_affiliations)
+
+    update_affiliations(person_affiliations)
+    return [row['expires'] for row in rows]
+
+
+def update_affiliations(person_affiliations: Dict[int, str]):
+    """Update the current affiliation for many people (see `update_affiliation`)."""
+    for affiliation in person_affiliations.values():
+        if affiliation not in AFFILIATION_VALUES:
+            raise ValueError(f"Unknown affiliation! {affiliation}")
+
+    known_people = _load_known_people(person_affiliations)
+    changed = defaultdict(list)
+    for person_id, affiliation in person_affiliations.items():
+        if known_people[person_id].affiliation != affiliation:
+            changed[affiliation].append(person_id)
+
+    cursor = _cursor()
+    for affiliation, person_ids in changed.items():
+        cursor.execute(
+            '''
+            update people
+               set affiliation = %(affiliation)s
+             where id in %(person_ids)s
+            ''',
+            {'affiliation': affiliation, 'person_ids': person_ids},
+        )
+        for person_id in person_ids:
+            known_people[person_id] = known_people[person_id]._replace(
+                affiliation=affiliation
+            )
+    if changed:
+        _mark_written()
+
+
+# A second waiver signed on the same (UTC) day is ignored
+INSERT_WAIVER = '''
+    insert into people_waivers
+           (person_id, date_signed, expires)
+    values (%(person_id)s, %(datetime_signed)s, %(expires)s)
+        on duplicate key update id = id
+'''
 
 
 def add_waiver(person_id, datetime_signed):
-    db = get_db()
-    cursor = db.cursor()
+    """Add a waiver, raising `AlreadyInserted` if one was signed that day."""
+    expires = _one_year_after(datetime_signed)
+
+    cursor = _cursor()
     cursor.execute(
-        '''
-        insert into people_waivers
-               (person_id, date_signed, expires)
-        values (%(person_id)s, %(datetime_signed)s,
-                date_add(%(datetime_signed)s, interval 1 year))
-        ''',
-        {'person_id': person_id, 'datetime_signed': datetime_signed},
+        INSERT_WAIVER,
+        {
+            'person_id': person_id,
+            'datetime_signed': datetime_signed,
+            'expires': expires,
+        },
     )
+    if not cursor.rowcount:
+        raise AlreadyInserted(f"Waiver signed {datetime_signed} for {person_id}")
+    _mark_written()
+    _invalidate_people(person_ids=[person_id])
+    return cursor.lastrowid, expires.date()
 
-    db.commit()
 
-    # MySQL doesn't support `returning` :(
+def add_waivers(waivers) -> List[date]:
+    """Add many (person ID, datetime signed) waivers, returning when each expires.
+
+    Raises `AlreadyInserted` if any were (so nothing should be committed).
+    """
+    rows = [
+        {
+            'person_id': person_id,
+            'datetime_signed': datetime_signed,
+            'expires': _one_year_after(datetime_signed),
+        }
+        for person_id, datetime_signed in waivers
+    ]
+    if not rows:
+        return []
+
+    cursor = _cursor()
+    cursor.executemany(INSERT_WAIVER, rows)
+    _mark_written()
+    if cursor.rowcount < len(rows):
+        raise AlreadyInserted(f"{len(rows) - cursor.rowcount} waivers")
+    _invalidate_people(person_ids=[row['person_id'] for row in rows])
+    return [row['expires'].date() for row in rows]
+
+
+def already_added_waivers(waivers) -> List[bool]:
+    """Return if each (person ID, datetime signed) already has a waiver that day.
+
+    Waivers are inserted regardless (duplicates are ignored by a unique key),
+    but checking a batch first lets us skip them without aborting the batch.
+    """
+    waivers = [(person_id, date_signed.date()) for person_id, date_signed in waivers]
+    if not waivers:
+        return []
+
+    cursor = _read_cursor()
     cursor.execute(
         '''
-        select id, date(expires)
+        select person_id, signed_on
           from people_waivers
-         where id = %(waiver_id)s
+         where person_id in %(person_ids)s
+           and signed_on in %(dates_signed)s
         ''',
-        {'waiver_id': cursor.lastrowid},
+        {
+            'person_ids': sorted({person_id for person_id, _ in waivers}),
+            'dates_signed': sorted({date_signed for _, date_signed in waivers}),
+        },
     )
-    waiver_id, date_expires = cursor.fetchone()
-    return waiver_id, date_expires
+    existing = set(cursor.fetchall())
+    return [waiver in existing for waiver in waivers]
 
 
-def already_added_waiver(person_id, date_signed):
-    """Return if this person already has a waiver on this date.
+def already_inserted_memberships(memberships) -> List[bool]:
+    """Return if each (person ID, datetime paid) was already inserted.
 
-    We want to avoid processing the same waiver twice. Even if the participant
-    signs the waiver twico in one day, it doesn't matter if we insert another
-    record.
+    Memberships from before the day of payment was recorded are instead
+    matched on when they'd expire (if not renewing an existing membership).
     """
-    cursor = get_db().cursor()
+    memberships = [
+        (person_id, datetime_paid.date()) for person_id, datetime_paid in memberships
+    ]
+    if not memberships:
+        return []
+
+    cursor = _read_cursor()
     cursor.execute(
         '''
-        select exists(
-          select 1
-            from people_waivers
-           -- date_signed is actually a timestamp
-           where person_id = %(person_id)s
-             and date(date_signed) = date(%(date_signed)s)
-        ) as already_inserted
+        select person_id, paid_on, expires
+          from people_memberships
+         where person_id in %(person_ids)s
+           and (paid_on in %(dates_paid)s
+                or (paid_on is null and expires in %(expires)s))
         ''',
-        {'person_id': person_id, 'date_signed': date_signed},
+        {
+            'person_ids': sorted({person_id for person_id, _ in memberships}),
+            'dates_paid': sorted({paid_on for _, paid_on in memberships}),
+            'expires': sorted({_one_year_after(paid_on) for _, paid_on in memberships}),
+        },
     )
-    return bool(cursor.fetchone()[0])
+    paid, expiring = set(), set()
+    for person_id, paid_on, expires in cursor.fetchall():
+        if paid_on:
+            paid.add((person_id, paid_on))
+        else:
+            expiring.add((person_id, expires))
+    return [
+        (person_id, paid_on) in paid
+        or (person_id, _one_year_after(paid_on)) in expiring
+        for person_id, paid_on in memberships
+    ]
+
+
+def person_to_update(primary_email, all_emails):  # pylint: disable=unused-argument
+    """Return the person which was most recently updated.
+
+    In the future, we should employ automatic merging of accounts so
+    that this logic isn't very necessary.
+    """
+    return people_to_update([all_emails])[0]
 
 
-def already_inserted_membership(person_id, date_effective):
-    """Return if a membership was already created for this day.
+def people_to_update(email_sets) -> List[Optional[int]]:
+    """Return the person to update for each set of verified emails.
 
-    We don't use date_inserted since we could have manually added in a
-    membership with a different date.
+    All sets are resolved with a single query (see `person_to_update()`).
+    Results are cached by the set of emails (the mapping rarely changes);
+    our own writes invalidate any affected lookups.
     """
-    cursor = get_db().cursor()
+    return [resolution.person_id for resolution in _resolutions(email_sets)]
+
+
+def _resolutions(email_sets) -> List[PersonResolution]:
+    keys = [_email_key(all_emails) for all_emails in email_sets]
+    resolved = {key: person_cache.get(key) for key in set(keys)}
+
+    missing = [key for key, resolution in resolved.items() if resolution is None]
+    if missing:
+        resolutions = _resolve_people(missing)
+        # Cached resolutions are used for writes, so only the primary's are kept
+        cacheable = _replica_conn() is None
+        for key, resolution in resolutions.items():
+            if cacheable:
+                person_cache.set(key, resolution)
+            resolved[key] = resolution
+
+    return [resolved[key] for key in keys]
+
+
+class Expirations(NamedTuple):
+    """When the membership & waiver of the person to update for an email expire."""
+
+    person_id: Optional[int]
+    candidate_ids: FrozenSet[int]  # (For invalidation, as in `PersonResolution`)
+    membership_expires: Optional[date]  # Possibly in the past
+    waiver_expires: Optional[date]
+
+
+def expirations_for(emails) -> List[Expirations]:
+    """Report when the membership & waiver for each email expire.
+
+    Each email is resolved on its own (as if it were the only verified email),
+    and all emails not already cached are resolved & read with two queries.
+    """
+    keys = [email.strip().lower() for email in emails]
+    statuses = {key: status_cache.get(key) for key in set(keys)}
+    missing = [key for key, status in statuses.items() if status is None]
+    if missing:
+        resolutions = _resolutions([email] for email in missing)
+        person_ids = {res.person_id for res in resolutions if res.person_id}
+        expires = _latest_expirations(person_ids) if person_ids else {}
+        cacheable = _cacheable()
+        for email, res in zip(missing, resolutions):
+            membership_expires, waiver_expires = expires.get(
+                res.person_id, (None, None)
+            )
+            statuses[email] = Expirations(
+                res.person_id,
+                res.candidate_ids,
+                membership_expires,
+                waiver_expires,
+            )
+            if cacheable:
+                status_cache.set(email, statuses[email])
+    return [statuses[key] for key in keys]
+
+
+def _latest_expirations(person_ids):
+    """Return when each person's last membership & waiver expire(d)."""
+    cursor = _read_cursor()
     cursor.execute(
         '''
-        select exists(
-          select 1
-            from people_memberships
-           where person_id = %(person_id)s
-             and expires = date(date_add(%(date_effective)s, interval 1 year))
-        ) as already_inserted
+        select p.id,
+               (select max(pm.expires)
+                  from people_memberships pm
+                 where pm.person_id = p.id),
+               (select date(max(pw.expires))
+                  from people_waivers pw
+                 where pw.person_id = p.id)
+          from people p
+         where p.id in %(person_ids)s
         ''',
-        {'person_id': person_id, 'date_effective': date_effective},
+        {'person_ids': sorted(person_ids)},
     )
-    return bool(cursor.fetchone()[0])
+    return {
+        person_id: (membership_expires, waiver_expires)
+        for person_id, membership_expires, waiver_expires in cursor.fetchall()
+    }
 
 
-def person_to_update(primary_email, all_emails):
-    """Return the person which was most recently updated.
+def _resolve_people(keys) -> Dict[FrozenSet[str], PersonResolution]:
+    """Rank every account matching any of the emails, for each set of emails.
 
-    In the future, we should employ automatic merging of accounts so
-    that this logic isn't very necessary.
+    Candidate accounts are resolved from the emails alone before looking at
+    any history. Joining memberships, alternate emails & waivers all at once
+    would build their cross product for every candidate (which grows quickly
+    for long-time members), only to collapse it again with `max()`.
     """
-    cursor = get_db().cursor()
+    # pylint: disable=too-many-locals
+    all_emails = sorted(set().union(*keys))
+    if not all_emails:
+        return {key: PersonResolution(None, frozenset()) for key in keys}
+
+    cursor = _read_cursor()
     cursor.execute(
         '''
-        select t.id
-          from (select p.id,
+        select t.email,
+               t.id,
+               t.affiliation,
+               if(t.membership_expires > now(), t.membership_expires, null)
+                 as current_membership_expires,
+               +(t.last_update > date_sub(now(), interval 1 year)) as active,
+               t.last_update
+          from (select m.*,
                        nullif(
-                         greatest(coalesce(max(pm.expires), from_unixtime(0)),
-                                  coalesce(max(pw.expires), from_unixtime(0))),
+                         greatest(coalesce(m.membership_expires, from_unixtime(0)),
+                                  coalesce(m.waiver_expires, from_unixtime(0))),
                          from_unixtime(0)
                        ) as last_update
-                  from people p
-                       left join people_memberships  pm on p.id = pm.person_id
-                       left join geardb_peopleemails pe on p.id = pe.person_id
-                       left join people_waivers      pw on p.id = pw.person_id
-                 where p.email            in %(all_emails)s
-                    or pe.alternate_email in %(all_emails)s
-                 group by p.id
+                  from (select matches.email,
+                               p.id,
+                               p.affiliation,
+                               (select max(pm.expires)
+                                  from people_memberships pm
+                                 where pm.person_id = p.id) as membership_expires,
+                               (select max(pw.expires)
+                                  from people_waivers pw
+                                 where pw.person_id = p.id) as waiver_expires
+                          from (select email, id as person_id
+                                  from people
+                                 where email in %(all_emails)s
+                                union
+                                select alternate_email, person_id
+                                  from geardb_peopleemails
+                                 where alternate_email in %(all_emails)s
+                               ) matches
+                               join people p on p.id = matches.person_id
+                       ) m
                ) t
-        -- Return accounts in the following order:
-        -- 1. Any accounts that have an active membership/waiver
-        -- 2. The most recent account matching any verified email
-        -- (The plus symbol is how we express 'nulls last')
-         order by +(t.last_update > date_sub(now(), interval 1 year)) desc,
-                  +t.last_update desc;
         ''',
-        {'primary_email': primary_email, 'all_emails': all_emails},
+        {'all_emails': all_emails},
     )
-    person = cursor.fetchone()
-    return person and person[0]
+
+    matched_emails = defaultdict(set)
+    rankings = {}
+    known_people = _known_people()
+    for row in cursor.fetchall():
+        email, person_id, affiliation, membership_expires, active, last_update = row
+        matched_emails[person_id].add(email.strip().lower())
+        known_people[person_id] = KnownPerson(affiliation, membership_expires)
+        # Return accounts in the following order:
+        # 1. Any accounts that have an active membership/waiver
+        # 2. The most recent account matching any verified email
+        # (With no membership or waiver, both values are null & sort last)
+        rankings[person_id] = (
+            -1 if active is None else active,
+            last_update is not None,
+            last_update,
+        )
+
+    resolutions = {}
+    for key in keys:
+        candidates = [pid for pid, emails in matched_emails.items() if emails & key]
+        candidates.sort(key=rankings.__getitem__, reverse=True)
+        resolutions[key] = PersonResolution(
+            person_id=candidates[0] if candidates else None,
+            candidate_ids=frozenset(candidates),
+        )
+    return resolutions
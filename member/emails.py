@@ -1,17 +1,158 @@
 import json
+import threading
+import time
 from datetime import datetime
-from typing import List, NamedTuple
-from urllib.request import Request, urlopen
+from typing import Callable, List, NamedTuple, Union
+from urllib.error import HTTPError
 
+from flask import current_app
+
+from member.cache import CacheStats, TTLCache
 from member.trips_api import bearer_jwt
 
 
+def _trips_api(method: str, path: str, **claims):
+    """Make a signed request to mitoc-trips, returning the decoded response."""
+    client = current_app.extensions['trips_client']
+    body = client.request(method, path, {'Authorization': bearer_jwt(**claims)})
+    return json.loads(body)
+
+
 class VerifiedEmails(NamedTuple):
     primary: str
     # Is expected to contain the primary email.
     all_emails: List[str]
 
 
+class FailedLookup(NamedTuple):
+    """mitoc-trips refused to look up an email (e.g. no account has it)."""
+
+    url: str
+    code: int
+    reason: str
+
+
+class LookupStats(NamedTuple):
+    cache: CacheStats
+    lookups: int  # Requests made to mitoc-trips
+    lookup_seconds: float
+    refreshes: int  # Stale entries refreshed in the background
+
+    @property
+    def saved_seconds(self) -> float:
+        """Estimate the time saved by cache hits (at the mean lookup latency)."""
+        if not self.lookups:
+            return 0.0
+        return self.cache.hits * self.lookup_seconds / self.lookups
+
+
+class VerifiedEmailsCache:  # pylint: disable=too-many-instance-attributes
+    """Cache the verified emails for each (normalized) email address.
+
+    A person's verified emails change perhaps once a year, but are needed for
+    every webhook - often several within minutes (e.g. paying, then signing a
+    waiver). Failed lookups are cached too, but only briefly.
+
+    mitoc-trips never tells us when someone's verified emails change, so a
+    change goes unnoticed for up to `VERIFIED_EMAILS_CACHE_TTL` (plus any
+    `max_stale`), or `VERIFIED_EMAILS_NEGATIVE_TTL` for an email it didn't know.
+    Meanwhile, a webhook is recorded under the person found for the old emails.
+
+    Optionally, an expired entry may still be used for up to `max_stale` seconds
+    while it's refreshed in the background.
+    """
+
+    def __init__(self):
+        self.cache = TTLCache()
+        self.negative_ttl = 60.0
+        self.max_stale = 0.0
+
+        self._lock = threading.Lock()
+        self._refreshing: set = set()
+        self._lookups = 0
+        self._lookup_seconds = 0.0
+        self._refreshes = 0
+
+    def configure(
+        self, maxsize: int, ttl: float, negative_ttl: float, max_stale: float
+    ):
+        self.cache.configure(maxsize, ttl)
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        with self._lock:
+            self._lookups = 0
+            self._lookup_seconds = 0.0
+            self._refreshes = 0
+
+    @staticmethod
+    def _key(email: str) -> str:
+        return email.strip().lower()
+
+    def get(self, email: str, fetch: Callable[[str], VerifiedEmails]) -> VerifiedEmails:
+        key = self._key(email)
+        result, stale = self.cache.get_stale(key, self.max_stale)
+        if result is None:
+            result = self._fetch(key, email, fetch)
+        elif stale:
+            self._refresh_later(key, email, fetch)
+
+        if isinstance(result, FailedLookup):
+            raise HTTPError(result.url, result.code, result.reason, None, None)
+        return result
+
+    def _fetch(self, key, email, fetch) -> Union[VerifiedEmails, FailedLookup]:
+        start = time.monotonic()
+        try:
+            result = fetch(email)
+        except HTTPError as e:
+            if not 400 <= e.code < 500:
+                raise  # (Server errors are not cached)
+            failure = FailedLookup(e.filename, e.code, e.reason)
+            self.cache.set(key, failure, ttl=self.negative_ttl)
+            return failure
+        finally:
+            with self._lock:
+                self._lookups += 1
+                self._lookup_seconds += time.monotonic() - start
+
+        # Any of this person's emails will give the same result
+        for other_key in {key, *map(self._key, result.all_emails)}:
+            self.cache.set(other_key, result)
+        return result
+
+    def _refresh_later(self, key, email, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._refreshes += 1
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+
+        def refresh():
+            try:
+                with app.app_context():
+                    self._fetch(key, email, fetch)
+            except Exception:  # pylint: disable=broad-except
+                pass  # The stale entry will do (until it's too stale)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def stats(self) -> LookupStats:
+        with self._lock:
+            return LookupStats(
+                cache=self.cache.stats(),
+                lookups=self._lookups,
+                lookup_seconds=self._lookup_seconds,
+                refreshes=self._refreshes,
+            )
+
+
+verified_emails_cache = VerifiedEmailsCache()
+
+
 def other_verified_emails(email_address: str) -> VerifiedEmails:
     """Return other email addresses known to be owned by the same person.
 
@@ -31,12 +172,14 @@ def other_verified_emails(email_address: str) -> VerifiedEmails:
     Since we don't want to give away members' email information freely, we sign
     each request with a secret key. The API endpoint will reject our request
     without a valid signature.
+
+    Results are cached (see `VerifiedEmailsCache`).
     """
-    request = Request('https://mitoc-trips.mit.edu/data/verified_emails/', method='GET')
-    request.add_header('Authorization', bearer_jwt(email=email_address))
-    with urlopen(request) as response:
-        data = json.loads(response.read())
+    return verified_emails_cache.get(email_address, _fetch_verified_emails)
 
+
+def _fetch_verified_emails(email_address: str) -> VerifiedEmails:
+    data = _trips_api('GET', '/data/verified_emails/', email=email_address)
     return VerifiedEmails(data['primary'], data['emails'])
 
 
@@ -49,8 +192,6 @@ def update_membership(email_address, membership_expires=None, waiver_expires=Non
     a new waiver or membership, we should inform the system that the cache is now
     invalid, and that it should be updated.
     """
-    request = Request('https://mitoc-trips.mit.edu/data/membership/', method='POST')
-
     payload = {'email': email_address}
 
     def format_date(dt):
@@ -62,6 +203,4 @@ def update_membership(email_address, membership_expires=None, waiver_expires=Non
     if waiver_expires:
         payload['waiver_expires'] = format_date(waiver_expires)
 
-    request.add_header('Authorization', bearer_jwt(**payload))
-    with urlopen(request) as response:
-        return json.loads(response.read())
+    return _trips_api('POST', '/data/membership/', **payload)
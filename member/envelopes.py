@@ -5,10 +5,197 @@ this utility module parses out the MITOC member's information.
 """
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta, timezone
-from typing import Tuple, Union
+from functools import cached_property
+from typing import BinaryIO, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, Union
+from xml.parsers import expat
 
 from mitoc_const import affiliations
 
+from member.errors import DocumentTooLarge, UnsafeDocument
+
+CHUNK_SIZE = 64 * 1024
+
+# DocuSign seems to perhaps be transitioning over datetime formats?
+# It sometimes gives datetimes with microseconds, sometimes without...
+# (First observed datetimes without microseconds in September of 2018)
+DATETIME_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f")
+
+KNOWN_AFFILIATIONS = frozenset(aff.VALUE for aff in affiliations.ALL)
+
+
+class ParseLimits(NamedTuple):
+    """Limits which reject malicious documents before they cost much to parse.
+
+    DocuSign never declares entities, so any declaration (as used by the
+    'billion laughs' & quadratic blowup attacks) is rejected by default.
+    """
+
+    max_bytes: int = 16 * 1024 * 1024  # (Envelopes may include PDFs)
+    max_depth: int = 32
+    max_entities: int = 0  # Entity declarations
+    max_expansion: float = 10.0  # Characters parsed per byte of the document
+
+
+class PrunedTreeBuilder:  # pylint: disable=too-many-instance-attributes
+    """Build a tree of only the elements at the given paths (from the root).
+
+    Everything else - notably, the base64-encoded PDFs that DocuSign may
+    include - is discarded as it's parsed, without its text ever being joined.
+    Once each top-level element containing a path has ended, the tree is
+    `complete` and the rest of the document needn't be read.
+    """
+
+    def __init__(self, paths: FrozenSet[Tuple[str, ...]]):
+        self.leaves = paths
+        self.prefixes = frozenset(
+            path[:i] for path in paths for i in range(1, len(path))
+        )
+        self.remaining = {path[0] for path in paths}
+
+        self.root: Optional[ET.Element] = None
+        self._path: List[str] = []  # Local names of kept elements (below the root)
+        self._open: List[ET.Element] = []
+        self._skipped = 0  # Depth within an element that isn't kept
+        self._text: Optional[List[str]] = None  # Only collected within a leaf
+
+    @property
+    def complete(self) -> bool:
+        return self.root is not None and not self.remaining
+
+    def start(self, tag: str, attrib: Dict[str, str]):
+        if self._skipped:
+            self._skipped += 1
+            return
+        if self.root is None:
+            self.root = ET.Element(tag, attrib)
+            self._open.append(self.root)
+            return
+
+        self._path.append(tag.rpartition('}')[2])
+        path = tuple(self._path)
+        if path in self.prefixes or path in self.leaves:
+            self._open.append(ET.SubElement(self._open[-1], tag, attrib))
+            self._text = [] if path in self.leaves else None
+        else:
+            self._path.pop()
+            self._skipped = 1
+
+    def data(self, data: str):
+        if self._text is not None and not self._skipped:
+            self._text.append(data)
+
+    def end(self, _tag: str):
+        if self._skipped:
+            self._skipped -= 1
+            return
+        element = self._open.pop()
+        if not self._path:
+            return  # (The root element)
+
+        if self._text is not None:
+            element.text = ''.join(self._text) or None
+            self._text = None
+        if len(self._path) == 1:
+            self.remaining.discard(self._path[0])
+        self._path.pop()
+
+    def close(self) -> Optional[ET.Element]:
+        return self.root
+
+
+class GuardedParser:
+    """Feed a document to expat, enforcing limits as it's parsed.
+
+    Unlike `xml.etree`, entity declarations are refused as soon as they're
+    read (and never expanded), so a malicious document costs next to nothing.
+    """
+
+    # Only large documents are checked for expansion (small ones are cheap)
+    min_expansion_checked = 64 * 1024
+
+    def __init__(self, target: PrunedTreeBuilder, limits: ParseLimits):
+        self.target = target
+        self.limits = limits
+
+        self.bytes_read = 0
+        self.chars_parsed = 0
+        self.depth = 0
+        self.entities = 0
+
+        # Namespaced tags are given as 'uri}tag' (ElementTree uses '{uri}tag')
+        self._parser = expat.ParserCreate(namespace_separator='}')
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+        self._parser.EntityDeclHandler = self._entity_declared
+
+    @staticmethod
+    def _qualified(name: str) -> str:
+        return '{' + name if '}' in name else name
+
+    def _parsed(self, chars: int):
+        self.chars_parsed += chars
+        if (
+            self.chars_parsed > self.min_expansion_checked
+            and self.chars_parsed > self.limits.max_expansion * self.bytes_read
+        ):
+            raise UnsafeDocument("Entities expand beyond the maximum ratio")
+
+    def _start(self, name, attrib):
+        self.depth += 1
+        if self.depth > self.limits.max_depth:
+            raise UnsafeDocument(f"Elements nested over {self.limits.max_depth} deep")
+        if attrib:
+            self._parsed(sum(len(value) for value in attrib.values()))
+            attrib = {self._qualified(key): value for key, value in attrib.items()}
+        self.target.start(self._qualified(name), attrib)
+
+    def _end(self, name):
+        self.depth -= 1
+        self.target.end(self._qualified(name))
+
+    def _data(self, data):
+        self._parsed(len(data))
+        self.target.data(data)
+
+    def _entity_declared(self, *_args):
+        self.entities += 1
+        if self.entities > self.limits.max_entities:
+            raise UnsafeDocument(f"Over {self.limits.max_entities} entities declared")
+
+    def feed(self, data: bytes, final: bool = False):
+        self.bytes_read += len(data)
+        if self.bytes_read > self.limits.max_bytes:
+            raise DocumentTooLarge(f"Document exceeds {self.limits.max_bytes} bytes")
+        try:
+            self._parser.Parse(data, final)
+        except expat.ExpatError as e:
+            # Raise what `xml.etree` would for a malformed document
+            error = ET.ParseError(str(e))
+            error.code, error.position = e.code, (e.lineno, e.offset)
+            raise error from None
+
+    def close(self) -> Optional[ET.Element]:
+        self.feed(b'', final=True)
+        return self.target.close()
+
+
+def parse_stream(
+    stream: BinaryIO,
+    paths: FrozenSet[Tuple[str, ...]],
+    chunk_size: int = CHUNK_SIZE,
+    limits: ParseLimits = ParseLimits(),
+) -> ET.Element:
+    """Parse just the elements at the given paths, reading no more than needed."""
+    builder = PrunedTreeBuilder(paths)
+    parser = GuardedParser(builder, limits)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        parser.feed(chunk)
+        if builder.complete:
+            return builder.root
+    return parser.close()  # (Raises if the document was incomplete)
+
 
 class DocuSignDocumentHelpers:
     """Generic helpers for use in parsing any DocuSign XML document."""
@@ -16,13 +203,58 @@ class DocuSignDocumentHelpers:
     ns = {'docu': "http://www.docusign.net/API/3.0"}
     recipient_status = ['EnvelopeStatus', 'RecipientStatuses', 'RecipientStatus']
 
+    # Paths (of local names) to every element read, for parsing from a stream
+    streamed_paths: FrozenSet[Tuple[str, ...]] = frozenset()
+    # Every hierarchy given to `get_element()` (see `warm_up()`)
+    selectors: List[List[str]] = [['TimeZoneOffset']]
+
     def __init__(self, xml_contents: str):
         self.root = ET.fromstring(xml_contents)
+        self._validate()
+
+    @classmethod
+    def from_stream(
+        cls,
+        stream: BinaryIO,
+        chunk_size: int = CHUNK_SIZE,
+        limits: ParseLimits = ParseLimits(),
+    ):
+        """Parse from a file-like object, keeping only the elements we read.
+
+        Memory use is flat, regardless of document size (e.g. embedded PDFs).
+        Documents exceeding the limits raise `UnsafeDocument`, so this is safe
+        to use on untrusted input (unlike the constructor).
+        """
+        document = cls.__new__(cls)
+        document.root = parse_stream(stream, cls.streamed_paths, chunk_size, limits)
+        document._validate()  # pylint: disable=protected-access
+        return document
+
+    @classmethod
+    def warm_up(cls):
+        """Compile every XPath & datetime format used to read a document.
+
+        ElementTree and `strptime` cache these once compiled, so warming them
+        up (e.g. after forking) saves time on the first document read.
+        """
+        element = ET.Element('warm-up')
+        for hierarchy in cls.selectors:
+            element.findall(cls.xpath(hierarchy), cls.ns)
+        example = datetime(2018, 11, 10, 18, 41, 6, 937000)
+        for datetime_format in DATETIME_FORMATS:
+            datetime.strptime(example.strftime(datetime_format), datetime_format)
+
+    def _validate(self):
+        """Raise `ValueError` if this isn't the expected type of document."""
+
+    @staticmethod
+    def xpath(hierarchy) -> str:
+        # (This method exists to ease the pain of namespaces with ElementTree)
+        return '/'.join(f'docu:{tag}' for tag in hierarchy)
 
     def get_element(self, hierarchy, findall: bool = False):
         """Return a single element from an array of XPath selectors."""
-        # (This method exists to ease the pain of namespaces with ElementTree)
-        xpath = '/'.join(f'docu:{tag}' for tag in hierarchy)
+        xpath = self.xpath(hierarchy)
         if findall:
             return self.root.findall(xpath, self.ns)
         return self.root.find(xpath, self.ns)
@@ -37,50 +269,78 @@ class DocuSignDocumentHelpers:
     def _to_utc(self, datetime_string) -> datetime:
         """Convert datetimes from the document to UTC based on the supplied TZ."""
         hours_offset = int(self._get_hours_offset())
-        # DocuSign seems to perhaps be transitioning over datetime formats?
-        # It sometimes gives datetimes with microseconds, sometimes without...
-        # (First observed datetimes without microseconds in September of 2018)
         try:
-            ts = datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%S")
+            ts = datetime.strptime(datetime_string, DATETIME_FORMATS[0])
         except ValueError:
-            ts = datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%S.%f")
+            ts = datetime.strptime(datetime_string, DATETIME_FORMATS[1])
 
         utc_datetime = ts - timedelta(hours=hours_offset)
         return utc_datetime.replace(tzinfo=timezone.utc)
 
 
 class CompletedEnvelope(DocuSignDocumentHelpers):
-    """Navigate a DocuSignEnvelopeInformation resource (completed waiver)."""
+    """Navigate a DocuSignEnvelopeInformation resource (completed waiver).
+
+    Each field is read from the document only once: tab statuses are indexed
+    by label in a single pass, and derived fields are cached.
+    """
 
-    def __init__(self, xml_contents):
+    _recipient = tuple(DocuSignDocumentHelpers.recipient_status)
+    streamed_paths = frozenset(
+        [
+            ('EnvelopeStatus', 'Status'),
+            ('EnvelopeStatus', 'Completed'),
+            (*_recipient, 'TabStatuses', 'TabStatus', 'TabLabel'),
+            (*_recipient, 'TabStatuses', 'TabStatus', 'TabValue'),
+            (*_recipient, 'FormData', 'xfdf', 'fields', 'field', 'value'),
+            ('TimeZoneOffset',),
+        ]
+    )
+    selectors = DocuSignDocumentHelpers.selectors + [
+        ['EnvelopeStatus', 'Status'],
+        ['EnvelopeStatus', 'Completed'],
+        [*_recipient, 'TabStatuses', 'TabStatus'],
+        ['TabLabel'],  # (Within each tab status)
+        ['TabValue'],
+        [
+            *_recipient,
+            'FormData',
+            'xfdf',
+            'fields',
+            "field[@name='Affiliation']",
+            'value',
+        ],
+    ]
+
+    def _validate(self):
         """Error out early if it's the unexpected document type."""
-        super().__init__(xml_contents)
         tag = '{%s}DocuSignEnvelopeInformation' % self.ns['docu']
         if self.root.tag != tag:
             raise ValueError(f"Expected {tag} as root element")
 
+    @cached_property
     def _first_and_last(self) -> Union[Tuple[str], Tuple[str, str]]:
         """A tuple that always contains the last name, and sometimes the last.
 
         If there's no spacing given in the name, we just assume that the user
         only reported their first name, and no last name.
         """
-        return self.releasor_name.split(None, 1)
+        return tuple(self.releasor_name.split(None, 1))
 
     @property
     def first_name(self) -> str:
         """First name of the MITOC member this waiver is for."""
-        return self._first_and_last()[0]
+        return self._first_and_last[0]
 
     @property
     def last_name(self) -> str:
         """Last name of the MITOC member this waiver is for."""
         try:
-            return self._first_and_last()[1]
+            return self._first_and_last[1]
         except IndexError:  # No space given, we don't know the last name
             return ''
 
-    @property
+    @cached_property
     def completed(self) -> bool:
         """Return if all recipients have completed this envelope.
 
@@ -89,7 +349,7 @@ class CompletedEnvelope(DocuSignDocumentHelpers):
         """
         return self.get_val(['EnvelopeStatus', 'Status']) == 'Completed'
 
-    @property
+    @cached_property
     def time_signed(self) -> datetime:
         """Return the timestamp when the document was signed."""
         if not self.completed:
@@ -97,6 +357,17 @@ class CompletedEnvelope(DocuSignDocumentHelpers):
         time_signed = self.get_val(['EnvelopeStatus', 'Completed'])
         return self._to_utc(time_signed)
 
+    @cached_property
+    def _tab_statuses(self) -> Dict[str, Optional[str]]:
+        """Index the value of every tab status by its label.
+
+        If a label is repeated, the first value is used.
+        """
+        index: Dict[str, Optional[str]] = {}
+        for label, value in self._all_tab_statuses():
+            index.setdefault(label, value)
+        return index
+
     def _all_tab_statuses(self):
         """Yield the label and value for all tab statuses in the document.
 
@@ -114,13 +385,13 @@ class CompletedEnvelope(DocuSignDocumentHelpers):
     def tab_status(self, desired_label):
         """Return the value for a specific tab status.
 
-        ElementTree has rudimentary support for XPath, so we use a simple
-        iterable instead.
+        ElementTree has rudimentary support for XPath, so we use an index
+        (built from a simple iterable) instead.
         """
-        for label, value in self._all_tab_statuses():
-            if label == desired_label:
-                return value
-        raise ValueError(f"Missing {desired_label}!")
+        try:
+            return self._tab_statuses[desired_label]
+        except KeyError:
+            raise ValueError(f"Missing {desired_label}!") from None
 
     @property
     def releasor_email(self) -> str:
@@ -132,7 +403,7 @@ class CompletedEnvelope(DocuSignDocumentHelpers):
         """The name of the person who signed the release."""
         return self.tab_status("Releasor's Name")
 
-    @property
+    @cached_property
     def affiliation(self) -> str:
         """The member's stated affiliation to MIT."""
         selector = self.recipient_status + [
@@ -143,5 +414,5 @@ class CompletedEnvelope(DocuSignDocumentHelpers):
             'value',
         ]
         stated_affiliation = self.get_element(selector).text
-        assert stated_affiliation in {aff.VALUE for aff in affiliations.ALL}
+        assert stated_affiliation in KNOWN_AFFILIATIONS
         return stated_affiliation
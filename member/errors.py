@@ -1,6 +1,29 @@
+from urllib.error import URLError
+
+
 class InvalidAffiliation(ValueError):
     """The affiliation supplied is not recognized in our system."""
 
 
 class IncorrectPayment(ValueError):
     """The payment value does not match what the affiliation type demands."""
+
+
+class PoolTimeout(RuntimeError):
+    """No connection to the gear database became available in time."""
+
+
+class TripsBusy(URLError):
+    """Too many requests to mitoc-trips are in flight to make another in time."""
+
+
+class AlreadyInserted(Exception):
+    """The row already exists (most likely, the webhook was delivered twice)."""
+
+
+class UnsafeDocument(ValueError):
+    """A document was rejected as (potentially) malicious, before parsing it fully."""
+
+
+class DocumentTooLarge(UnsafeDocument):
+    """A document exceeded the maximum size."""
@@ -1,9 +1,31 @@
 import os
 
 from flaskext.mysql import MySQL
-from raven.contrib.flask import Sentry
+
+from member.admission import AdmissionControl
+from member.coalesce import Coalescer
+from member.metrics import Metrics
+from member.outbox import Outbox
+from member.pool import ConnectionPool
+from member.queries import QueryLog
+from member.replica import Replica
+from member.spool import Spool
+from member.trips_client import TripsClient
 
 mysql = MySQL()
+pool = ConnectionPool(mysql.connect)
+replica = Replica()
+outbox = Outbox()
+query_log = QueryLog()
+spool = Spool()
+coalescer = Coalescer()
+trips_client = TripsClient()
+metrics = Metrics()
+admission = AdmissionControl()
 
 RAVEN_DSN = os.getenv('RAVEN_DSN')
-sentry = Sentry(dsn=RAVEN_DSN) if RAVEN_DSN else None
+sentry = None
+if RAVEN_DSN:  # (raven is slow to import, so it's only imported if needed)
+    from raven.contrib.flask import Sentry
+
+    sentry = Sentry(dsn=RAVEN_DSN)
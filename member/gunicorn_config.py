@@ -0,0 +1,22 @@
+"""Server hooks for gunicorn.
+
+Usage: `gunicorn -c python:member.gunicorn_config member.wsgi`
+"""
+
+
+def post_fork(_server, _worker):
+    """Warm up the worker before it accepts its first request (see `warm_up`).
+
+    Also resume delivering any updates left in the outbox (and processing any
+    webhooks left in the spool).
+    """
+    # pylint: disable=import-outside-toplevel
+    from member.app import warm_up
+    from member.extensions import outbox, spool
+    from member.wsgi import application
+
+    warm_up(application)
+    if outbox.enabled:
+        outbox.start()
+    if spool.enabled:
+        spool.start()
@@ -0,0 +1,262 @@
+"""Request metrics for Prometheus, and a `Server-Timing` header on responses.
+
+Every request is counted (by endpoint & status code) and timed. Views may also
+time each phase of their work (see `phase()`), such as parsing a document or a
+single database query. Phases are reported in a histogram per endpoint, and in
+the `Server-Timing` header of the response itself. Statements sent to the gear
+database are counted per request, too (see `member.queries`).
+
+Metrics are kept in memory by each worker process, and exposed (along with
+database pool & mitoc-trips client stats) at `/metrics` in the Prometheus text
+format. Each gunicorn worker reports only what it handled, so Prometheus should
+scrape workers individually (or run the app under ASGI, in a single process).
+
+Recording costs tens of microseconds per request (far less than any database
+query), so it's left on by default.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Tuple
+
+from flask import Response, _app_ctx_stack, _request_ctx_stack, current_app
+
+# Upper bounds (in seconds) of histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the number of database statements per request
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+class Histogram:
+    """A count of observations in each bucket (not thread-safe on its own)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # (The last is +Inf)
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """Yield each bucket's upper bound & the observations within it."""
+        total = 0
+        for bound, count in zip([*map(str, self.buckets), '+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class phase:  # pylint: disable=invalid-name
+    """Time a phase of handling the current request (if in one).
+
+    Phases of the same name (e.g. retries) are added together.
+    """
+
+    __slots__ = ('name', 'timings', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+        # (The context stack is much quicker to read than `flask.g`)
+        self.timings = getattr(_app_ctx_stack.top, 'phase_seconds', None)
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_exc_info):
+        if self.timings is not None:
+            elapsed = time.perf_counter() - self.start
+            self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+
+
+def _labels(**labels: str) -> str:
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class Metrics:
+    def __init__(self):
+        self.server_timing = True
+
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        self._latency: Dict[str, Histogram] = {}
+        self._phases: Dict[Tuple[str, str], Histogram] = {}
+        self._queries: Dict[str, Histogram] = {}  # Statements per request
+        self._query_totals: Dict[str, Tuple[float, int]] = {}  # Seconds, rows
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('SERVER_TIMING', self.server_timing)
+
+        self.server_timing = app.config['SERVER_TIMING']
+        app.extensions['metrics'] = self
+        if app.config['METRICS_ENABLED']:
+            app.before_request(self._start)
+            app.after_request(self._finish)
+            app.add_url_rule('/metrics', 'metrics', self.view)
+
+    @staticmethod
+    def _start():
+        top = _app_ctx_stack.top
+        top.request_start = time.perf_counter()
+        top.phase_seconds = {}
+
+    def _finish(self, response):
+        top = _app_ctx_stack.top
+        if not hasattr(top, 'request_start'):
+            return response  # (A `before_request` function aborted first)
+        elapsed = time.perf_counter() - top.request_start
+        req = _request_ctx_stack.top.request
+        endpoint = req.endpoint or 'none'
+        phases = top.phase_seconds
+        queries = getattr(top, 'query_stats', None)
+
+        with self._lock:
+            key = (endpoint, req.method, response.status_code)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if endpoint not in self._latency:
+                self._latency[endpoint] = Histogram()
+            self._latency[endpoint].observe(elapsed)
+            for name, seconds in phases.items():
+                if (endpoint, name) not in self._phases:
+                    self._phases[endpoint, name] = Histogram()
+                self._phases[endpoint, name].observe(seconds)
+            if endpoint not in self._queries:
+                self._queries[endpoint] = Histogram(QUERY_BUCKETS)
+            self._queries[endpoint].observe(queries.count if queries else 0)
+            if queries:
+                seconds, rows = self._query_totals.get(endpoint, (0.0, 0))
+                self._query_totals[endpoint] = (
+                    seconds + queries.seconds,
+                    rows + queries.rows,
+                )
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = ', '.join(
+                f'{name};dur={seconds * 1000:.2f}'
+                for name, seconds in [*phases.items(), ('total', elapsed)]
+            )
+        return response
+
+    def view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self) -> str:
+        """Report every metric in the Prometheus text format."""
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, description: str, samples):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(
+                    f'{name}{{{labels}}} {value}' if labels else f'{name} {value}'
+                )
+
+        def histogram(name, description, histograms):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            # Buckets, then the sum & count for each set of labels
+            for labels, hist in histograms:
+                for bound, count in hist.cumulative():
+                    lines.append(
+                        f'{name}_bucket{{{_labels(**labels, le=bound)}}} {count}'
+                    )
+                lines.append(f'{name}_sum{{{_labels(**labels)}}} {hist.sum}')
+                lines.append(f'{name}_count{{{_labels(**labels)}}} {sum(hist.counts)}')
+
+        with self._lock:
+            metric(
+                'member_requests_total',
+                'counter',
+                'Requests handled, by endpoint & status code.',
+                [
+                    (_labels(endpoint=endpoint, method=method, status=status), count)
+                    for (endpoint, method, status), count in sorted(
+                        self._requests.items()
+                    )
+                ],
+            )
+            histogram(
+                'member_request_duration_seconds',
+                'Time taken to handle each request.',
+                [({'endpoint': e}, h) for e, h in sorted(self._latency.items())],
+            )
+            histogram(
+                'member_phase_duration_seconds',
+                'Time taken by each phase of handling a request.',
+                [
+                    ({'endpoint': e, 'phase': p}, h)
+                    for (e, p), h in sorted(self._phases.items())
+                ],
+            )
+            histogram(
+                'member_db_queries_per_request',
+                'Statements sent to the gear database by each request.',
+                [({'endpoint': e}, h) for e, h in sorted(self._queries.items())],
+            )
+            totals = sorted(self._query_totals.items())
+            metric(
+                'member_db_query_seconds_total',
+                'counter',
+                'Time spent executing statements, by endpoint.',
+                [(_labels(endpoint=e), seconds) for e, (seconds, _) in totals],
+            )
+            metric(
+                'member_db_rows_total',
+                'counter',
+                'Rows read or written by statements, by endpoint.',
+                [(_labels(endpoint=e), rows) for e, (_, rows) in totals],
+            )
+
+        lines.extend(_dependency_metrics())
+        return '\n'.join(lines) + '\n'
+
+
+def _dependency_metrics() -> List[str]:
+    """Report the stats kept by the database pool(s) & the mitoc-trips client.
+
+    Requests shed for want of either (or of capacity) are also reported.
+    """
+    extensions = current_app.extensions
+    pool = extensions['db_pool'].stats()
+    client = extensions['trips_client'].stats()
+    replica = extensions['db_replica'].stats()
+    admission = extensions.get('admission')
+    shed = sorted(admission.shed_counts().items()) if admission else []
+    return [
+        '# TYPE member_db_pool_size gauge',
+        f'member_db_pool_size {pool.size}',
+        '# TYPE member_db_pool_connections gauge',
+        f'member_db_pool_connections{{state="open"}} {pool.open}',
+        f'member_db_pool_connections{{state="in_use"}} {pool.in_use}',
+        '# TYPE member_db_pool_checkouts_total counter',
+        f'member_db_pool_checkouts_total {pool.checkouts}',
+        '# TYPE member_db_pool_waits_total counter',
+        f'member_db_pool_waits_total {pool.waits}',
+        '# TYPE member_db_pool_wait_seconds_total counter',
+        f'member_db_pool_wait_seconds_total {pool.wait_seconds}',
+        '# TYPE member_db_pool_reconnects_total counter',
+        f'member_db_pool_reconnects_total {pool.reconnects}',
+        '# TYPE member_db_replica_routing_total counter',
+        f'member_db_replica_routing_total{{route="replica"}} {replica.reads}',
+        f'member_db_replica_routing_total{{route="lagging"}} {replica.lagging}',
+        f'member_db_replica_routing_total{{route="down"}} {replica.unavailable}',
+        '# TYPE member_trips_requests_total counter',
+        f'member_trips_requests_total {client.requests}',
+        '# TYPE member_trips_failures_total counter',
+        f'member_trips_failures_total {client.failures}',
+        '# TYPE member_trips_connections_total counter',
+        f'member_trips_connections_total {client.connections}',
+        '# TYPE member_trips_request_seconds_total counter',
+        f'member_trips_request_seconds_total {client.total_seconds}',
+        '# TYPE member_trips_busy_total counter',
+        f'member_trips_busy_total {client.busy}',
+        '# HELP member_requests_shed_total Requests refused with a 503, by reason.',
+        '# TYPE member_requests_shed_total counter',
+        *(
+            f'member_requests_shed_total{{{_labels(endpoint=e, reason=r)}}} {count}'
+            for (e, r), count in shed
+        ),
+    ]
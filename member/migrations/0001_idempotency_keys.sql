@@ -0,0 +1,32 @@
+-- Enforce idempotency of the webhooks with unique keys.
+--
+-- CyberSource & DocuSign retry deliveries, sometimes concurrently. Rather than
+-- first querying for an existing row (which can't use an index, and races with
+-- other deliveries), inserts rely on these keys to ignore duplicates.
+--
+-- The gear database schema is managed elsewhere; apply this by hand.
+-- Any existing duplicates must be merged first. Each of these should be empty:
+--
+--   select email from people
+--    where email is not null group by email having count(*) > 1;
+--
+--   select person_id, date(date_signed) from people_waivers
+--    group by person_id, date(date_signed) having count(*) > 1;
+
+-- At most one account is created per email
+alter table people
+  add unique key people_email_unique (email);
+
+-- At most one waiver per person per (UTC) day.
+-- Signing twice in one day changes nothing, so the second waiver is ignored.
+alter table people_waivers
+  add column signed_on date as (date(date_signed)) stored,
+  add unique key people_waivers_person_signed_on (person_id, signed_on);
+
+-- At most one membership per person per (UTC) day of payment.
+-- The day of payment was never recorded, so older memberships are left null
+-- (and are never considered duplicates by the key). Instead, inserts check for
+-- a null-`paid_on` membership expiring when the new one would.
+alter table people_memberships
+  add column paid_on date null,
+  add unique key people_memberships_person_paid_on (person_id, paid_on);
@@ -0,0 +1,190 @@
+"""A durable outbox of updates for mitoc-trips.
+
+Informing mitoc-trips of a new membership or waiver is not essential to
+processing a webhook, so it shouldn't make the webhook wait (or lose the update
+when mitoc-trips is down). Instead, the views append updates to an outbox kept
+in a local SQLite file, and a background thread in each worker delivers them.
+
+- Updates for the same email are coalesced into one POST (keeping the latest
+  expiration dates) if they arrive within a short window of each other.
+- Due updates are claimed in batches. A claim is a lease, so updates are never
+  delivered concurrently by two workers (but *are* retried if a worker dies).
+- Failed deliveries are retried with exponential backoff, indefinitely.
+
+Updates may also be delivered with `flask drain-outbox` (e.g. from cron).
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import List, NamedTuple, Optional, Tuple
+from urllib.error import URLError
+
+from member.emails import update_membership
+from member.sqlite_queue import LeaseQueue, drain_command
+
+SCHEMA = '''
+    create table if not exists trips_outbox (
+      email text primary key,
+      membership_expires text null,  -- ISO 8601 dates
+      waiver_expires text null,
+      version integer not null default 0,  -- Incremented on each coalesced update
+      attempts integer not null default 0,
+      due real not null  -- When to (re)try delivery (or when a lease ends)
+    )
+'''
+
+
+class Update(NamedTuple):
+    email: str
+    membership_expires: Optional[date]
+    waiver_expires: Optional[date]
+    version: int
+    attempts: int
+
+
+class Outbox(LeaseQueue):  # pylint: disable=too-many-instance-attributes
+    table = 'trips_outbox'
+    key = 'email'
+
+    def __init__(self):
+        super().__init__()  # (Updates are delivered synchronously without a path)
+        self.coalesce_seconds = 2.0
+        self.batch_size = 50
+        self.concurrency = 4
+
+    def init_app(self, app):
+        app.config.setdefault('TRIPS_OUTBOX_PATH', self.path)
+        app.config.setdefault('TRIPS_OUTBOX_COALESCE_SECONDS', self.coalesce_seconds)
+        app.config.setdefault('TRIPS_OUTBOX_BATCH_SIZE', self.batch_size)
+        app.config.setdefault('TRIPS_OUTBOX_CONCURRENCY', self.concurrency)
+        app.config.setdefault('TRIPS_OUTBOX_POLL_INTERVAL', self.poll_interval)
+        app.config.setdefault('TRIPS_OUTBOX_MAX_BACKOFF', self.max_backoff)
+
+        self.path = app.config['TRIPS_OUTBOX_PATH']
+        self.coalesce_seconds = app.config['TRIPS_OUTBOX_COALESCE_SECONDS']
+        self.batch_size = app.config['TRIPS_OUTBOX_BATCH_SIZE']
+        self.concurrency = app.config['TRIPS_OUTBOX_CONCURRENCY']
+        self.poll_interval = app.config['TRIPS_OUTBOX_POLL_INTERVAL']
+        self.max_backoff = app.config['TRIPS_OUTBOX_MAX_BACKOFF']
+        # Wait a little longer than the coalescing window after a wakeup
+        self.settle_seconds = self.coalesce_seconds
+
+        self._app = app
+        app.extensions['trips_outbox'] = self
+        if self.path:
+            self._create(SCHEMA)
+
+    def append(self, email, membership_expires=None, waiver_expires=None):
+        """Queue an update for mitoc-trips, coalescing with any pending for them."""
+
+        def iso(day):
+            return day and day.isoformat()
+
+        with self._transaction() as conn:
+            conn.execute(
+                '''
+                insert into trips_outbox (email, membership_expires, waiver_expires, due)
+                values (?, ?, ?, ?)
+                    on conflict (email) do update
+                   set membership_expires = nullif(max(
+                         coalesce(excluded.membership_expires, ''),
+                         coalesce(membership_expires, '')
+                       ), ''),
+                       waiver_expires = nullif(max(
+                         coalesce(excluded.waiver_expires, ''),
+                         coalesce(waiver_expires, '')
+                       ), ''),
+                       version = version + 1
+                ''',
+                [
+                    email,
+                    iso(membership_expires),
+                    iso(waiver_expires),
+                    time.time() + self.coalesce_seconds,
+                ],
+            )
+        self._appended()
+
+    def claim(self, limit: int) -> List[Update]:
+        """Lease up to `limit` due updates, so that no other worker delivers them."""
+        rows = self._claim(
+            '''
+            select email, membership_expires, waiver_expires, version, attempts
+              from trips_outbox
+             where due <= ?
+             order by due
+             limit ?
+            ''',
+            limit,
+        )
+
+        def parse(day):
+            return day and date.fromisoformat(day)
+
+        return [
+            Update(email, parse(membership), parse(waiver), version, attempts)
+            for email, membership, waiver, version, attempts in rows
+        ]
+
+    def _complete(self, delivered: List[Update], failed: List[Update]):
+        now = time.time()
+        with self._transaction() as conn:
+            # Anything updated since it was claimed must still be delivered
+            conn.executemany(
+                'delete from trips_outbox where email = ? and version = ?',
+                [(update.email, update.version) for update in delivered],
+            )
+            conn.executemany(
+                'update trips_outbox set due = ? where email = ?',
+                [(now + self.coalesce_seconds, update.email) for update in delivered],
+            )
+            self._retry(
+                conn, [(update.email, update.attempts) for update in failed], now
+            )
+
+    def _deliver(self, update: Update) -> bool:
+        with self._app.app_context():
+            try:
+                update_membership(
+                    update.email,
+                    membership_expires=update.membership_expires,
+                    waiver_expires=update.waiver_expires,
+                )
+            except URLError:
+                return False
+        return True
+
+    def deliver_due(self) -> Tuple[int, int]:
+        """Deliver one batch of due updates, returning (delivered, failed)."""
+        updates = self.claim(self.batch_size)
+        if not updates:
+            return 0, 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(self._deliver, updates))
+        delivered = [update for update, ok in zip(updates, results) if ok]
+        failed = [update for update, ok in zip(updates, results) if not ok]
+        self._complete(delivered, failed)
+
+        for update in failed:
+            self._alert_if_repeated(
+                update.attempts, 'update mitoc-trips', email=update.email
+            )
+        return len(delivered), len(failed)
+
+    process_due = deliver_due
+
+    def pending(self) -> int:
+        with self._transaction() as conn:
+            return conn.execute('select count(*) from trips_outbox').fetchone()[0]
+
+
+drain_outbox_command = drain_command(
+    'drain-outbox',
+    'trips_outbox',
+    'TRIPS_OUTBOX_PATH',
+    "Deliver all due updates to mitoc-trips.",
+    lambda delivered, failed, pending: (
+        f"Delivered {delivered} updates ({failed} failed), {pending} pending"
+    ),
+)
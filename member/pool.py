@@ -0,0 +1,214 @@
+"""A small pool of connections to the gear database.
+
+Opening a MySQL connection costs a TCP handshake plus authentication, which
+is a large share of the time spent handling a webhook. Instead, each worker
+process keeps a handful of connections open and lends them out per request.
+
+The pool is fork-aware: gunicorn may import the app (and create this pool)
+in the master process before forking workers. Sockets must never be shared
+across processes, so a pool that finds itself in a new process simply forgets
+any connections it inherited and starts fresh.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+from member.errors import PoolTimeout
+
+
+class PoolStats(NamedTuple):
+    size: int  # Maximum number of connections this process may open
+    open: int  # Connections currently open (idle or in use)
+    in_use: int
+    checkouts: int
+    waits: int  # Checkouts which had to wait for a connection to be returned
+    wait_seconds: float  # Total time spent waiting on checkout
+    max_wait_seconds: float
+    reconnects: int  # Connections replaced after failing a health check
+
+
+class ConnectionPool:  # pylint: disable=too-many-instance-attributes
+    """Lend out open connections, reconnecting any that have gone away."""
+
+    def __init__(
+        self,
+        connect: Callable[[], pymysql.connections.Connection],
+        extension: str = 'db_pool',
+    ):
+        self._connect = connect
+        self.extension = extension  # (As registered in `app.extensions`)
+
+        self.size = 5
+        self.timeout = 5.0
+        self.recycle = 3600.0
+        self.ping_interval = 0.0
+        self.warm_size = 1
+
+        self._reset()
+
+    def init_app(self, app):
+        app.config.setdefault('MYSQL_POOL_SIZE', self.size)
+        app.config.setdefault('MYSQL_POOL_TIMEOUT', self.timeout)
+        app.config.setdefault('MYSQL_POOL_RECYCLE', self.recycle)
+        app.config.setdefault('MYSQL_POOL_PING_INTERVAL', self.ping_interval)
+        app.config.setdefault('MYSQL_POOL_WARM_SIZE', self.warm_size)
+
+        self.size = app.config['MYSQL_POOL_SIZE']
+        self.timeout = app.config['MYSQL_POOL_TIMEOUT']
+        self.recycle = app.config['MYSQL_POOL_RECYCLE']
+        self.ping_interval = app.config['MYSQL_POOL_PING_INTERVAL']
+        self.warm_size = min(app.config['MYSQL_POOL_WARM_SIZE'], self.size)
+        self._reset()
+        app.extensions[self.extension] = self
+
+    def _reset(self):
+        """Start over with an empty pool, owned by the current process.
+
+        Connections inherited from a parent process are dropped, *not* closed:
+        closing would send `COM_QUIT` over a socket the parent still uses.
+        """
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+        # Every slot is either an idle connection or `None` (may be opened).
+        # LIFO order keeps the most recently used connections warm.
+        self._slots: queue.LifoQueue = queue.LifoQueue()
+        for _ in range(self.size):
+            self._slots.put(None)
+
+        self._last_used = {}  # Connection id -> (opened at, last returned at)
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._reconnects = 0
+
+    def _ensure_process(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def warm(self, count: Optional[int] = None):
+        """Open connections ahead of the first request (e.g. after forking)."""
+        self._ensure_process()
+        count = self.warm_size if count is None else min(count, self.size)
+        conns = [self.checkout() for _ in range(count)]
+        for conn in conns:
+            self.checkin(conn)
+
+    def checkout(self) -> pymysql.connections.Connection:
+        """Return a healthy connection, waiting for one if all are in use."""
+        self._ensure_process()
+
+        start = time.monotonic()
+        try:
+            conn = self._slots.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._slots.get(timeout=self.timeout)
+            except queue.Empty:
+                # pylint: disable=raise-missing-from
+                raise PoolTimeout(
+                    f"No database connection available after {self.timeout}s"
+                )
+            finally:
+                waited = time.monotonic() - start
+                with self._lock:
+                    self._waits += 1
+                    self._wait_seconds += waited
+                    self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+        try:
+            conn = self._healthy(conn)
+        except Exception:
+            self._slots.put(None)  # Give the slot back, so it's not leaked
+            raise
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        return conn
+
+    def checkin(self, conn: pymysql.connections.Connection):
+        """Return a connection so that it may be used by the next request."""
+        if self._pid != os.getpid():
+            return  # Borrowed before a fork; that pool no longer exists.
+
+        with self._lock:
+            self._in_use -= 1
+
+        try:
+            # Never hand the next request an open transaction.
+            if conn.open and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                conn.rollback()
+        except pymysql.err.Error:
+            pass
+
+        if not conn.open:
+            self._discard(conn)
+            self._slots.put(None)
+            return
+
+        opened_at, _ = self._last_used[id(conn)]
+        self._last_used[id(conn)] = (opened_at, time.monotonic())
+        self._slots.put(conn)
+
+    def stats(self) -> PoolStats:
+        self._ensure_process()
+        with self._lock:
+            return PoolStats(
+                size=self.size,
+                open=self._open,
+                in_use=self._in_use,
+                checkouts=self._checkouts,
+                waits=self._waits,
+                wait_seconds=self._wait_seconds,
+                max_wait_seconds=self._max_wait_seconds,
+                reconnects=self._reconnects,
+            )
+
+    def _healthy(self, conn) -> pymysql.connections.Connection:
+        """Return the given connection if usable, else a replacement."""
+        if conn is None:
+            return self._new_connection()
+
+        now = time.monotonic()
+        opened_at, last_used = self._last_used[id(conn)]
+        if now - opened_at > self.recycle:
+            self._discard(conn, close=True)
+            return self._new_connection()
+        if now - last_used < self.ping_interval:
+            return conn
+
+        try:
+            conn.ping(reconnect=False)
+        except pymysql.err.Error:  # "MySQL server has gone away" and the like
+            self._discard(conn, close=True)
+            with self._lock:
+                self._reconnects += 1
+            return self._new_connection()
+        return conn
+
+    def _new_connection(self) -> pymysql.connections.Connection:
+        conn = self._connect()
+        now = time.monotonic()
+        with self._lock:
+            self._open += 1
+            self._last_used[id(conn)] = (now, now)
+        return conn
+
+    def _discard(self, conn, close: bool = False):
+        if close:
+            try:
+                conn.close()
+            except pymysql.err.Error:
+                pass  # Already closed by the server, most likely.
+        with self._lock:
+            self._open -= 1
+            self._last_used.pop(id(conn), None)
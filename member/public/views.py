@@ -1,103 +1,234 @@
 from datetime import datetime
+from typing import Callable
 from urllib.error import URLError
 
+import jwt
 from flask import Blueprint, current_app, json, request
 
 from member import db, extensions
-from member.cybersource import CYBERSOURCE_DT_FORMAT
+from member.cybersource import CYBERSOURCE_DT_FORMAT, is_membership_payment
 from member.emails import other_verified_emails, update_membership
-from member.envelopes import CompletedEnvelope
+from member.envelopes import CompletedEnvelope, ParseLimits
+from member.errors import AlreadyInserted, DocumentTooLarge, UnsafeDocument
+from member.metrics import phase
 from member.signature import signature_valid
+from member.trips_api import verified_bearer_jwt
 
 blueprint = Blueprint('public', __name__)
 
 
+def _inform_trips(primary, **expirations):
+    """Tell mitoc-trips about a new membership or waiver (but don't fail if down)."""
+    if extensions.outbox.enabled:
+        extensions.outbox.append(primary, **expirations)
+        return
+    try:
+        update_membership(primary, **expirations)
+    except URLError:
+        if extensions.sentry:
+            extensions.sentry.captureException()
+
+
+def _coalesced(key: str, handle: Callable[[], int]) -> int:
+    """Handle a webhook, unless it duplicates another (see `member.coalesce`)."""
+    if not extensions.coalescer.enabled:
+        return handle()
+    return extensions.coalescer.run(key, handle)
+
+
 @blueprint.route("/members/membership", methods=["POST"])
 def add_membership():
     """Process a CyberSource transaction & create/update membership."""
     data = request.form
-    if data['decision'] != 'ACCEPT':
-        return json.jsonify(), 204  # Transaction canceled, declined, etc.
-    if data['req_merchant_defined_data1'] != 'membership':
-        return json.jsonify(), 204  # Some other payment, we don't care
+    if not is_membership_payment(data):
+        # Declined, or some other payment we don't care about
+        return json.jsonify(), 204
 
     # If we lack the secret key to verify signatures, we can rely on the web
     # server itself to provide access control (and skip signature verification)
     if current_app.config['VERIFY_CYBERSOURCE_SIGNATURE']:
         secret_key = current_app.config['CYBERSOURCE_SECRET_KEY']
-        if not signature_valid(data, secret_key):
+        previous_keys = current_app.config['CYBERSOURCE_PREVIOUS_SECRET_KEYS']
+        with phase('signature'):
+            valid = signature_valid(data, secret_key, *previous_keys)
+        if not valid:
             return json.jsonify(), 401
 
+    if extensions.spool.enabled:  # Record it later (see `member.spool`)
+        with phase('spool'):
+            extensions.spool.append('membership', data.to_dict())
+        return json.jsonify(), 202
+
+    status = _coalesced(_membership_key(data), lambda: _record_membership(data))
+    return json.jsonify(), status
+
+
+def _membership_key(data) -> str:
+    """Identify the payment, however many times CyberSource delivers it."""
+    transaction = data.get('transaction_id') or ':'.join(
+        [data['req_merchant_defined_data3'].lower(), data['signed_date_time']]
+    )
+    return f'membership:{transaction}'
+
+
+def _record_membership(data) -> int:
+    """Record a verified payment, returning the status to respond with."""
     # From the given email, ask the trips database for all their verified emails
     email = data['req_merchant_defined_data3']  # NOT req_bill_to_email
-    primary, all_emails = other_verified_emails(email)
+    with phase('verified_emails'):
+        primary, all_emails = other_verified_emails(email)
 
     # Identify datetime (in UTC) when the transaction was completed
     dt_paid = datetime.strptime(data['signed_date_time'], CYBERSOURCE_DT_FORMAT)
 
-    # Fetch membership, ideally for primary email, but otherwise most recent
-    person_id = db.person_to_update(primary, all_emails)
-    if person_id and db.already_inserted_membership(person_id, dt_paid):
-        return json.jsonify(), 202  # Most likely already processed
+    # Everything is written in one transaction, committed before informing trips
+    try:
+        with db.transaction():
+            # Fetch membership, ideally for primary email, but otherwise most recent
+            with phase('person_to_update'):
+                person_id = db.person_to_update(primary, all_emails)
 
-    # If no membership exists, create one under the primary email
-    if not person_id:
-        first_name = data['req_bill_to_forename']
-        last_name = data['req_bill_to_surname']
-        person_id = db.add_person(first_name, last_name, primary)
+            # If no membership exists, create one under the primary email
+            if not person_id:
+                first_name = data['req_bill_to_forename']
+                last_name = data['req_bill_to_surname']
+                with phase('add_person'):
+                    person_id = db.add_person(first_name, last_name, primary)
 
-    two_letter_affiliation_code = data.get('req_merchant_defined_data2')
-    _, expires = db.add_membership(
-        person_id, data['req_amount'], dt_paid, two_letter_affiliation_code
-    )
-    db.commit()
+            two_letter_affiliation_code = data.get('req_merchant_defined_data2')
+            with phase('add_membership'):
+                _, expires = db.add_membership(
+                    person_id, data['req_amount'], dt_paid, two_letter_affiliation_code
+                )
+    except AlreadyInserted:
+        return 202  # Most likely already processed
 
-    try:
-        update_membership(primary, membership_expires=expires)
-    except URLError:
-        if extensions.sentry:
-            extensions.sentry.captureException()
+    with phase('trips'):
+        _inform_trips(primary, membership_expires=expires)
 
-    return json.jsonify(), 201
+    return 201
 
 
 @blueprint.route("/members/waiver", methods=["POST"])
-def add_waiver():
+def add_waiver():  # pylint: disable=too-many-return-statements
     """Process a DocuSign waiver completion.
 
     NOTE: It's extremely important that there be some access control behind
-    this route. It parses XML directly, so it must come from a trusted source
-    (the xml library is vulnerable to the 'billion laughs' and quadratic blowup
-    vulnerabilities). Obviously, this route also inserts rows into a database,
-    so we should only be doing that based on verified information.
+    this route. The XML is parsed with limits on size, nesting & entities (so
+    'billion laughs' and quadratic blowup documents are rejected with a 4xx),
+    but this route also inserts rows into a database, so we should only be
+    doing that based on verified information.
 
     DocuSign event notifications are signed with their X.509 certificate, which
     should be verified with NGINX, Apache, or similar before being forwarded to
     this route.
     """
-    env = CompletedEnvelope(request.data)
+    limits = ParseLimits(
+        max_bytes=current_app.config['WAIVER_MAX_BYTES'],
+        max_depth=current_app.config['WAIVER_MAX_DEPTH'],
+        max_entities=current_app.config['WAIVER_MAX_ENTITIES'],
+        max_expansion=current_app.config['WAIVER_MAX_EXPANSION'],
+    )
+    if (request.content_length or 0) > limits.max_bytes:
+        return json.jsonify(), 413  # (Without reading the body at all)
+    try:
+        with phase('parse'):
+            env = CompletedEnvelope.from_stream(request.stream, limits=limits)
+    except DocumentTooLarge:
+        return json.jsonify(), 413
+    except UnsafeDocument:
+        return json.jsonify(), 400
     if not env.completed:
         return json.jsonify(), 204  # Still awaiting guardian's signature
 
     email, time_signed = env.releasor_email, env.time_signed
 
-    primary, all_emails = other_verified_emails(email)
-    person_id = db.person_to_update(primary, all_emails)
-    if not person_id:
-        person_id = db.add_person(env.first_name, env.last_name, primary)
-
-    if db.already_added_waiver(person_id, time_signed):
-        return json.jsonify(), 204  # Nothing more to do
-
-    _, expires = db.add_waiver(person_id, time_signed)
-    # The affiliation stated on the waiver is the most recent we know!
-    db.update_affiliation(person_id, env.affiliation)
-    db.commit()
-
+    if extensions.spool.enabled:
+        # Just what's read from the envelope (which may embed a large PDF)
+        with phase('spool'):
+            extensions.spool.append(
+                'waiver',
+                {
+                    'email': email,
+                    'first_name': env.first_name,
+                    'last_name': env.last_name,
+                    'time_signed': time_signed.isoformat(),
+                    'affiliation': env.affiliation,
+                },
+            )
+        return json.jsonify(), 202
+
+    key = f'waiver:{email.lower()}:{time_signed.isoformat()}'
+    status = _coalesced(key, lambda: _record_waiver(env))
+    return json.jsonify(), status
+
+
+def _record_waiver(env: CompletedEnvelope) -> int:
+    """Record a completed waiver, returning the status to respond with."""
+    email, time_signed = env.releasor_email, env.time_signed
+    with phase('verified_emails'):
+        primary, all_emails = other_verified_emails(email)
     try:
-        update_membership(primary, waiver_expires=expires)
-    except URLError:
-        if extensions.sentry:
-            extensions.sentry.captureException()
-
-    return json.jsonify(), 201
+        with db.transaction():
+            with phase('person_to_update'):
+                person_id = db.person_to_update(primary, all_emails)
+            if not person_id:
+                with phase('add_person'):
+                    person_id = db.add_person(env.first_name, env.last_name, primary)
+
+            with phase('add_waiver'):
+                _, expires = db.add_waiver(person_id, time_signed)
+            # The affiliation stated on the waiver is the most recent we know!
+            with phase('update_affiliation'):
+                db.update_affiliation(person_id, env.affiliation)
+    except AlreadyInserted:
+        return 204  # Nothing more to do
+
+    with phase('trips'):
+        _inform_trips(primary, waiver_expires=expires)
+
+    return 201
+
+
+@blueprint.route("/members/status", methods=["GET"])
+def membership_status():
+    """Report when memberships & waivers expire, for one or many emails.
+
+    Give `email` once, or repeat it (`?email=a@example.com&email=b@example.com`).
+    Requests must bear a JWT signed with the key shared with mitoc-trips, for
+    the `STATUS_TOKEN_AUDIENCE` audience.
+
+    Results are cached, so polling with `If-None-Match` can often be answered
+    with a 304 without querying the database. (There's no `Last-Modified`:
+    the gear database doesn't record when memberships or waivers change.)
+    """
+    try:
+        verified_bearer_jwt(
+            request.headers.get('Authorization'),
+            current_app.config['STATUS_TOKEN_AUDIENCE'],
+        )
+    except jwt.InvalidTokenError:
+        return json.jsonify(), 401
+
+    emails = request.args.getlist('email')
+    if not emails or len(emails) > current_app.config['STATUS_MAX_EMAILS']:
+        return json.jsonify(), 400
+
+    def format_date(day):
+        return day and day.isoformat()
+
+    statuses = db.expirations_for(emails)
+    response = json.jsonify(
+        results=[
+            {
+                'email': email,
+                'membership_expires': format_date(status.membership_expires),
+                'waiver_expires': format_date(status.waiver_expires),
+            }
+            for email, status in zip(emails, statuses)
+        ]
+    )
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # Always revalidate
+    return response.make_conditional(request)
@@ -0,0 +1,135 @@
+"""Time & count every statement sent to the gear database.
+
+Cursors from `QueryLog.cursor()` record each statement's duration and row
+count. Totals are kept for the current app context (i.e. each request), and
+reported by `member.metrics`. Statements slower than `SLOW_QUERY_SECONDS` are
+logged, naming (but never including) their parameters: they're often emails.
+
+Tests may use `capture()` to see exactly which statements were executed
+(see `tests.utils.assert_max_queries`).
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, NamedTuple
+
+from flask import _app_ctx_stack
+
+logger = logging.getLogger(__name__)
+
+
+class Query(NamedTuple):
+    statement: str
+    params: Any  # (For `executemany()`, the sequence of all parameters)
+    seconds: float
+    rows: int
+
+
+class QueryStats:  # pylint: disable=too-few-public-methods
+    """Totals for every statement executed in one app context."""
+
+    __slots__ = ('count', 'seconds', 'rows')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+# Each list is appended to by every statement executed (see `capture()`)
+_captures: List[List[Query]] = []
+
+
+@contextmanager
+def capture() -> Iterator[List[Query]]:
+    """Collect every statement executed within the block (in any thread)."""
+    captured: List[Query] = []
+    _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        _captures.remove(captured)
+
+
+def stats() -> QueryStats:
+    """Return totals for the current app context (started if need be)."""
+    top = _app_ctx_stack.top
+    if not hasattr(top, 'query_stats'):
+        top.query_stats = QueryStats()
+    return top.query_stats
+
+
+def _redacted(params) -> str:
+    """Describe parameters by name alone (e.g. `person_id=?, email=?`)."""
+    if isinstance(params, dict):
+        return ', '.join(f'{name}=?' for name in params)
+    if isinstance(params, list) and params and isinstance(params[0], dict):
+        return f'{len(params)} rows of {_redacted(params[0])}'  # `executemany()`
+    return f'{len(params)} parameters' if params else 'no parameters'
+
+
+class InstrumentedCursor:
+    """Wrap a cursor, recording each statement executed."""
+
+    __slots__ = ('_cursor', '_log')
+
+    def __init__(self, cursor, log: 'QueryLog'):
+        self._cursor = cursor
+        self._log = log
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query: str, args=None):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(query, args)
+        finally:
+            self._log.record(query, args, time.perf_counter() - start, self._cursor)
+
+    def executemany(self, query: str, args):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(query, args)
+        finally:
+            self._log.record(query, args, time.perf_counter() - start, self._cursor)
+
+
+class QueryLog:
+    def __init__(self):
+        self.slow_seconds = 0.25
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_SECONDS', self.slow_seconds)
+
+        self.slow_seconds = app.config['SLOW_QUERY_SECONDS']
+        app.extensions['query_log'] = self
+
+    def cursor(self, conn) -> InstrumentedCursor:
+        return InstrumentedCursor(conn.cursor(), self)
+
+    def record(self, statement: str, params, seconds: float, cursor):
+        # (`rowcount` is -1 when unknown, as after a failed statement)
+        rows = cursor.rowcount if isinstance(cursor.rowcount, int) else 0
+        rows = max(rows, 0)
+
+        top = _app_ctx_stack.top
+        if top is not None:
+            totals = getattr(top, 'query_stats', None) or stats()
+            totals.count += 1
+            totals.seconds += seconds
+            totals.rows += rows
+
+        if seconds >= self.slow_seconds:
+            logger.warning(
+                "Slow query (%.3fs, %d rows): %s [%s]",
+                seconds,
+                rows,
+                ' '.join(statement.split()),
+                _redacted(params),
+            )
+
+        if _captures:
+            query = Query(statement, params, seconds, rows)
+            for captured in _captures:
+                captured.append(query)
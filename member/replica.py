@@ -0,0 +1,173 @@
+"""Send pure reads to a replica of the gear database (if one is configured).
+
+The gear desk runs heavy reports against the primary, so lookups that write
+nothing (such as reporting expiration dates) are better sent to a replica.
+`member.db` decides which statements are reads; this module decides whether
+the replica may take them:
+
+- Reads in a unit of work which may write (`db.transaction()`, e.g. finding
+  the person to update & their current membership) go to the primary, since
+  what's read decides what's written. Once a unit of work has written
+  anything, it too reads only from the primary (to see its own writes).
+- If the replica has fallen more than `MYSQL_REPLICA_MAX_LAG` seconds behind
+  (as measured at most once per `lag_check_interval`), reads go to the primary.
+- If the replica can't be reached, reads go to the primary for a while
+  (`MYSQL_REPLICA_RETRY_INTERVAL`) before the replica is tried again.
+- Shortly after this process writes, the replica may not yet have the write,
+  so what's read from it then is not cached (see `db._cacheable`). Which
+  person to update is only ever cached from the primary.
+"""
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import pymysql
+
+from member.errors import PoolTimeout
+from member.pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Reported by `show replica status` (MySQL 8.0.22+) or `show slave status`
+LAG_COLUMNS = ('Seconds_Behind_Source', 'Seconds_Behind_Master')
+
+
+class ReplicaStats(NamedTuple):
+    # Units of work (e.g. requests) which read from the replica, or instead
+    # from the primary because the replica lagged or was down
+    reads: int
+    lagging: int
+    unavailable: int
+    lag_seconds: Optional[float]  # As last measured (`None` if unknown)
+
+
+class Replica:  # pylint: disable=too-many-instance-attributes
+    def __init__(self):
+        self.host = ''  # Everything is read from the primary without a host
+        self.port = 3306
+        self.max_lag = 5.0
+        self.retry_interval = 30.0
+        self.lag_check_interval = 1.0
+        self.lag_query = 'show slave status'
+        self.connect_timeout = 2.0
+
+        self.pool = ConnectionPool(self._connect, extension='db_replica_pool')
+        self._config = {}
+        self._lock = threading.Lock()
+        self._lag: Optional[float] = None
+        self._lag_checked = float('-inf')
+        self._down_until = float('-inf')
+        self._last_write = float('-inf')
+        self._reads = 0
+        self._lagging = 0
+        self._unavailable = 0
+
+    def init_app(self, app):
+        app.config.setdefault('MYSQL_REPLICA_HOST', self.host)
+        app.config.setdefault('MYSQL_REPLICA_PORT', self.port)
+        app.config.setdefault('MYSQL_REPLICA_MAX_LAG', self.max_lag)
+        app.config.setdefault('MYSQL_REPLICA_RETRY_INTERVAL', self.retry_interval)
+        app.config.setdefault('MYSQL_REPLICA_LAG_QUERY', self.lag_query)
+
+        self.host = app.config['MYSQL_REPLICA_HOST']
+        self.port = app.config['MYSQL_REPLICA_PORT']
+        self.max_lag = app.config['MYSQL_REPLICA_MAX_LAG']
+        self.retry_interval = app.config['MYSQL_REPLICA_RETRY_INTERVAL']
+        self.lag_query = app.config['MYSQL_REPLICA_LAG_QUERY']
+        # The same credentials & database as the primary
+        self._config = {
+            'user': app.config.get('MYSQL_DATABASE_USER'),
+            'password': app.config.get('MYSQL_DATABASE_PASSWORD') or '',
+            'db': app.config.get('MYSQL_DATABASE_DB'),
+        }
+
+        self.pool.init_app(app)
+        app.extensions['db_replica'] = self
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.host)
+
+    def _connect(self) -> pymysql.connections.Connection:
+        return pymysql.connect(
+            host=self.host,
+            port=self.port,
+            charset='utf8',
+            connect_timeout=self.connect_timeout,
+            **self._config,
+        )
+
+    def checkout(self) -> Optional[pymysql.connections.Connection]:
+        """Return a connection to the replica, or `None` to read from the primary."""
+        now = time.monotonic()
+        if now < self._down_until:
+            self._count('_unavailable')
+            return None
+        try:
+            conn = self.pool.checkout()
+        except pymysql.err.OperationalError:
+            logger.warning("Replica unavailable; reading from the primary")
+            self._down_until = now + self.retry_interval
+            self._count('_unavailable')
+            return None
+        except PoolTimeout:
+            self._count('_unavailable')
+            return None
+
+        if self._lagging_behind(conn, now):
+            self.pool.checkin(conn)
+            self._count('_lagging')
+            return None
+        self._count('_reads')
+        return conn
+
+    def checkin(self, conn: pymysql.connections.Connection):
+        self.pool.checkin(conn)
+
+    def wrote(self):
+        """Note that this process just wrote to the primary."""
+        self._last_write = time.monotonic()
+
+    def may_lack_writes(self) -> bool:
+        """Return if the replica may not yet have this process's last write.
+
+        (Lag is only measured periodically, so it may have grown since.)
+        """
+        since_write = time.monotonic() - self._last_write
+        return since_write <= self.max_lag + self.lag_check_interval
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _lagging_behind(self, conn, now: float) -> bool:
+        if now - self._lag_checked >= self.lag_check_interval:
+            self._lag_checked = now
+            self._lag = self._measure_lag(conn)
+        return self._lag is None or self._lag > self.max_lag
+
+    def _measure_lag(self, conn) -> Optional[float]:
+        """Return how many seconds the replica is behind (`None` if not replicating)."""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(self.lag_query)
+                row = cursor.fetchone()
+                columns = [column[0] for column in cursor.description or []]
+        except pymysql.err.Error:
+            logger.exception("Failed to measure replica lag")
+            return None
+        if row is None:
+            return 0.0  # (Not a replica at all, so never behind)
+        status = dict(zip(columns, row))
+        lag = next((status[c] for c in LAG_COLUMNS if c in status), None)
+        return None if lag is None else float(lag)
+
+    def stats(self) -> ReplicaStats:
+        with self._lock:
+            return ReplicaStats(
+                reads=self._reads,
+                lagging=self._lagging,
+                unavailable=self._unavailable,
+                lag_seconds=self._lag,
+            )
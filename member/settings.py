@@ -7,6 +7,10 @@ VERIFY_CYBERSOURCE_SIGNATURE = (
 CYBERSOURCE_SECRET_KEY = os.getenv(
     'CYBERSOURCE_SECRET_KEY', 'Secret key used to sign CyberSource'
 )
+# While rotating keys, signatures from previous keys (comma-separated) are valid
+CYBERSOURCE_PREVIOUS_SECRET_KEYS = [
+    key for key in os.getenv('CYBERSOURCE_PREVIOUS_SECRET_KEYS', '').split(',') if key
+]
 
 MEMBERSHIP_SECRET_KEY = os.getenv(
     'MEMBERSHIP_SECRET_KEY', 'secret shared with mitoc-trips'
@@ -18,6 +22,120 @@ MYSQL_DATABASE_PASSWORD = os.getenv('GEAR_DATABASE_PASSWORD', 'password')
 MYSQL_DATABASE_HOST = os.getenv('GEAR_DATABASE_HOST', 'localhost')
 MYSQL_DATABASE_PORT = int(os.getenv('GEAR_DATABASE_PORT', '3306'))
 
+# Each worker process keeps a pool of open connections to the gear database
+MYSQL_POOL_SIZE = int(os.getenv('GEAR_DATABASE_POOL_SIZE', '5'))
+MYSQL_POOL_WARM_SIZE = int(os.getenv('GEAR_DATABASE_POOL_WARM_SIZE', '1'))
+# Seconds to wait for a connection when all are in use (requests then get a 503)
+MYSQL_POOL_TIMEOUT = float(os.getenv('GEAR_DATABASE_POOL_TIMEOUT', '5'))
+# Connections are replaced after this many seconds (should be < `wait_timeout`)
+MYSQL_POOL_RECYCLE = float(os.getenv('GEAR_DATABASE_POOL_RECYCLE', '3600'))
+# Connections used more recently than this are not pinged on checkout
+MYSQL_POOL_PING_INTERVAL = float(os.getenv('GEAR_DATABASE_POOL_PING_INTERVAL', '0'))
+# If set, pure reads (such as finding the person to update) go to this replica,
+# using the same credentials & database (and pool settings) as the primary
+MYSQL_REPLICA_HOST = os.getenv('GEAR_DATABASE_REPLICA_HOST', '')
+MYSQL_REPLICA_PORT = int(os.getenv('GEAR_DATABASE_REPLICA_PORT', '3306'))
+# Reads go to the primary while the replica is further behind than this (seconds)
+MYSQL_REPLICA_MAX_LAG = float(os.getenv('GEAR_DATABASE_REPLICA_MAX_LAG', '5'))
+# How lag is measured: any query reporting `Seconds_Behind_Source` (or `_Master`)
+MYSQL_REPLICA_LAG_QUERY = os.getenv(
+    'GEAR_DATABASE_REPLICA_LAG_QUERY', 'show slave status'
+)
+# After failing to connect, reads go to the primary for this many seconds
+MYSQL_REPLICA_RETRY_INTERVAL = float(
+    os.getenv('GEAR_DATABASE_REPLICA_RETRY_INTERVAL', '30')
+)
+# Statements slower than this are logged (with their parameters redacted)
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', '0.25'))
+
+# Which account to update for a set of verified emails is cached in each worker
+PERSON_CACHE_SIZE = int(os.getenv('PERSON_CACHE_SIZE', '1024'))
+PERSON_CACHE_TTL = float(os.getenv('PERSON_CACHE_TTL', '300'))  # 0 disables
+
+# Expiration dates reported by `/members/status` are also cached in each worker
+STATUS_CACHE_SIZE = int(os.getenv('STATUS_CACHE_SIZE', '4096'))
+STATUS_CACHE_TTL = float(os.getenv('STATUS_CACHE_TTL', '60'))  # 0 disables
+# How many emails may be looked up in a single request
+STATUS_MAX_EMAILS = int(os.getenv('STATUS_MAX_EMAILS', '100'))
+# Tokens for `/members/status` must have this `aud` claim (which tokens that
+# we issue to mitoc-trips, with the same key, never have)
+STATUS_TOKEN_AUDIENCE = os.getenv('STATUS_TOKEN_AUDIENCE', 'mitoc-member:status')
+
+# Each worker keeps connections to mitoc-trips open between requests
+TRIPS_API_URL = os.getenv('TRIPS_API_URL', 'https://mitoc-trips.mit.edu')
+TRIPS_API_POOL_SIZE = int(os.getenv('TRIPS_API_POOL_SIZE', '4'))
+TRIPS_API_CONNECT_TIMEOUT = float(os.getenv('TRIPS_API_CONNECT_TIMEOUT', '3'))
+TRIPS_API_READ_TIMEOUT = float(os.getenv('TRIPS_API_READ_TIMEOUT', '10'))
+# Idle connections are closed after this many seconds (before the server does)
+TRIPS_API_IDLE_TIMEOUT = float(os.getenv('TRIPS_API_IDLE_TIMEOUT', '60'))
+# Requests to mitoc-trips in flight at once (0 for no limit); others wait for a
+# slot only this many seconds (if looking up emails for a webhook, it gets a 503)
+TRIPS_API_MAX_CONCURRENT = int(os.getenv('TRIPS_API_MAX_CONCURRENT', '0'))
+TRIPS_API_SLOT_TIMEOUT = float(os.getenv('TRIPS_API_SLOT_TIMEOUT', '1'))
+
+# Verified emails (from mitoc-trips) are cached in each worker, by email
+VERIFIED_EMAILS_CACHE_SIZE = int(os.getenv('VERIFIED_EMAILS_CACHE_SIZE', '4096'))
+VERIFIED_EMAILS_CACHE_TTL = float(os.getenv('VERIFIED_EMAILS_CACHE_TTL', '3600'))
+# Lookups which mitoc-trips refuses (e.g. for an unknown email) are cached briefly
+VERIFIED_EMAILS_NEGATIVE_TTL = float(os.getenv('VERIFIED_EMAILS_NEGATIVE_TTL', '60'))
+# If nonzero, expired entries are used for this long while refreshed in the background
+VERIFIED_EMAILS_MAX_STALE = float(os.getenv('VERIFIED_EMAILS_MAX_STALE', '0'))
+
+# If set, updates for mitoc-trips are queued in this SQLite file & sent in the
+# background (otherwise, each webhook waits to inform mitoc-trips itself)
+TRIPS_OUTBOX_PATH = os.getenv('TRIPS_OUTBOX_PATH', '')
+# Updates for the same email within this many seconds are sent as one
+TRIPS_OUTBOX_COALESCE_SECONDS = float(os.getenv('TRIPS_OUTBOX_COALESCE_SECONDS', '2'))
+TRIPS_OUTBOX_BATCH_SIZE = int(os.getenv('TRIPS_OUTBOX_BATCH_SIZE', '50'))
+TRIPS_OUTBOX_CONCURRENCY = int(os.getenv('TRIPS_OUTBOX_CONCURRENCY', '4'))
+TRIPS_OUTBOX_POLL_INTERVAL = float(os.getenv('TRIPS_OUTBOX_POLL_INTERVAL', '5'))
+# Failed deliveries are retried with exponential backoff, up to this many seconds
+TRIPS_OUTBOX_MAX_BACKOFF = float(os.getenv('TRIPS_OUTBOX_MAX_BACKOFF', '3600'))
+
+# If set, webhooks are stored in this SQLite file (answered with a 202), then
+# recorded in the background in batches (otherwise, each is recorded inline)
+WEBHOOK_SPOOL_PATH = os.getenv('WEBHOOK_SPOOL_PATH', '')
+WEBHOOK_SPOOL_BATCH_SIZE = int(os.getenv('WEBHOOK_SPOOL_BATCH_SIZE', '100'))
+# Seconds to let a batch gather after a webhook arrives
+WEBHOOK_SPOOL_BATCH_WAIT = float(os.getenv('WEBHOOK_SPOOL_BATCH_WAIT', '0.05'))
+WEBHOOK_SPOOL_POLL_INTERVAL = float(os.getenv('WEBHOOK_SPOOL_POLL_INTERVAL', '5'))
+# Failed webhooks are retried with exponential backoff, up to this many seconds
+WEBHOOK_SPOOL_MAX_BACKOFF = float(os.getenv('WEBHOOK_SPOOL_MAX_BACKOFF', '3600'))
+
+# If set, duplicate webhooks (handled at once by different workers) are coalesced
+# with claims in this SQLite file: one does the work, the others wait for it
+WEBHOOK_COALESCE_PATH = os.getenv('WEBHOOK_COALESCE_PATH', '')
+# Seconds a duplicate waits for the original's result (before responding with 202)
+# A waiting duplicate holds its worker, so this is kept short
+WEBHOOK_COALESCE_WAIT = float(os.getenv('WEBHOOK_COALESCE_WAIT', '2'))
+# Seconds to remember results (so later duplicates needn't touch the database)
+WEBHOOK_COALESCE_TTL = float(os.getenv('WEBHOOK_COALESCE_TTL', '3600'))
+
+# Waivers are rejected (before being parsed in full) if they exceed these limits
+WAIVER_MAX_BYTES = int(os.getenv('WAIVER_MAX_BYTES', str(16 * 1024 * 1024)))
+WAIVER_MAX_DEPTH = int(os.getenv('WAIVER_MAX_DEPTH', '32'))
+WAIVER_MAX_ENTITIES = int(os.getenv('WAIVER_MAX_ENTITIES', '0'))  # Declarations
+# Characters parsed per byte of the document (entities can expand enormously)
+WAIVER_MAX_EXPANSION = float(os.getenv('WAIVER_MAX_EXPANSION', '10'))
+
+# Requests handled at once (each on a thread) by each process when served with
+# `member.asgi`; any more get a 503. Those using the database share a pool of
+# this size (in place of `MYSQL_POOL_SIZE`), so mind MySQL's `max_connections`.
+ASGI_MAX_IN_FLIGHT = int(os.getenv('ASGI_MAX_IN_FLIGHT', '200'))
+ASGI_DATABASE_POOL_SIZE = int(os.getenv('ASGI_DATABASE_POOL_SIZE', '20'))
+
+# Requests beyond this many at once (per endpoint, per process) get a 503.
+# Requests which can't get a database connection or mitoc-trips slot in time
+# (see `MYSQL_POOL_TIMEOUT` & `TRIPS_API_SLOT_TIMEOUT`) also get a 503.
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '0'))
+# Seconds that senders are asked to wait before retrying a 503
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '5'))
+
+# Expose request counts & latencies at `/metrics` (for Prometheus)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true') == 'true'
+# Report the time taken by each phase of a request in a `Server-Timing` header
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true') == 'true'
+
 # Silences Werkzeug XHR deprecation warnings. Can be removed once we're on Flask 1.x
 # See: https://github.com/pallets/flask/issues/2549
 JSONIFY_PRETTYPRINT_REGULAR = False
@@ -2,17 +2,36 @@
 Based off of cybersource.signature from django-oscar-cybersource
 """
 import base64
+import functools
 import hashlib
 import hmac
-from typing import Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterable, List, Mapping, Optional, Sequence
 
+# The verifier used by each process in a pool (see `SignatureVerifier.pool()`)
+_worker_verifier: Optional['SignatureVerifier'] = None
 
-def signature_valid(data, secret_key: str) -> bool:
-    signature_check = SecureAcceptanceSigner(secret_key)
-    try:
-        return signature_check.verify_request(data)
-    except ValueError:
-        return False
+
+def signature_valid(data, secret_key: str, *previous_keys: str) -> bool:
+    """Return if the data was signed by the secret key (or a previous key)."""
+    return get_verifier(secret_key, *previous_keys).verify(data)
+
+
+@functools.lru_cache(maxsize=8)
+def get_verifier(*secret_keys: str) -> 'SignatureVerifier':
+    """Return a verifier for the keys, reused so long as keys are unchanged."""
+    return SignatureVerifier(secret_keys)
+
+
+def _build_message(data, signed_fields: Iterable[str]) -> bytes:
+    return ','.join(f"{f}={data.get(f, '')}" for f in signed_fields).encode('utf-8')
+
+
+def _sign(keyed_hmac, message: bytes) -> bytes:
+    """Sign with a copy of the HMAC, whose key schedule was computed once."""
+    msg_hmac = keyed_hmac.copy()
+    msg_hmac.update(message)
+    return base64.b64encode(msg_hmac.digest())
 
 
 class SecureAcceptanceSigner:
@@ -20,12 +39,10 @@ class SecureAcceptanceSigner:
 
     def __init__(self, secret_key: str):
         self.secret_key = secret_key
+        self._hmac = hmac.new(secret_key.encode('utf-8'), digestmod=hashlib.sha256)
 
     def sign(self, data, signed_fields: Iterable[str]):
-        key = self.secret_key.encode('utf-8')
-        msg_raw = self._build_message(data, signed_fields).encode('utf-8')
-        msg_hmac = hmac.new(key, msg_raw, hashlib.sha256)
-        return base64.b64encode(msg_hmac.digest())
+        return _sign(self._hmac, _build_message(data, signed_fields))
 
     def verify_request(self, post_data) -> bool:
         """Ensure the signature is valid so this request can be trusted."""
@@ -35,8 +52,66 @@ class SecureAcceptanceSigner:
         signed_field_names = signed_field_names.split(',')
         signature_given = post_data['signature'].encode('utf-8')
         signature_calc = self.sign(post_data, signed_field_names)
-        return signature_given == signature_calc
+        return hmac.compare_digest(signature_given, signature_calc)
+
+
+class SignatureVerifier:
+    """Verify signatures made with any of several keys (e.g. during rotation).
+
+    The first key is the current one; others are accepted until retired.
+    """
+
+    def __init__(self, secret_keys: Sequence[str]):
+        if not secret_keys:
+            raise ValueError("At least one secret key is required")
+        self.secret_keys = tuple(secret_keys)
+        self._hmacs = [
+            hmac.new(key.encode('utf-8'), digestmod=hashlib.sha256)
+            for key in self.secret_keys
+        ]
+
+    def verify(self, post_data: Mapping[str, str]) -> bool:
+        """Return if the data was signed by any of the keys."""
+        signed_field_names = post_data.get('signed_field_names')
+        signature = post_data.get('signature')
+        if not (signed_field_names and signature):
+            return False
+
+        signature_given = signature.encode('utf-8')
+        message = _build_message(post_data, signed_field_names.split(','))
+        return any(
+            hmac.compare_digest(signature_given, _sign(keyed_hmac, message))
+            for keyed_hmac in self._hmacs
+        )
+
+    def pool(self, processes: Optional[int] = None) -> ProcessPoolExecutor:
+        """Return a pool of processes, each ready to verify with these keys."""
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(self.secret_keys,),
+        )
+
+    def verify_many(
+        self,
+        payloads: Iterable[Mapping[str, str]],
+        pool: Optional[Executor] = None,
+        chunksize: int = 256,
+    ) -> List[bool]:
+        """Verify each payload, in order, spread across the pool (if given).
+
+        The pool must come from `pool()`, so that each process has the keys.
+        """
+        if pool is None:
+            return [self.verify(data) for data in payloads]
+        return list(pool.map(_verify_in_worker, payloads, chunksize=chunksize))
+
+
+def _init_worker(secret_keys: Sequence[str]):
+    global _worker_verifier  # pylint: disable=global-statement
+    _worker_verifier = SignatureVerifier(secret_keys)
+
 
-    @staticmethod
-    def _build_message(data, signed_fields) -> str:
-        return ','.join(f"{f}={data.get(f, '')}" for f in signed_fields)
+def _verify_in_worker(post_data: Mapping[str, str]) -> bool:
+    assert _worker_verifier is not None, "Pool was not made by the verifier"
+    return _worker_verifier.verify(post_data)
@@ -0,0 +1,275 @@
+"""A durable spool of webhooks, to be processed in the background.
+
+Handling a webhook inline means CyberSource & DocuSign wait on the gear
+database and mitoc-trips (and that an outage of either fails the webhook).
+Instead, with a spool configured, the views only verify the signature (or
+parse the envelope), append what they received to a local SQLite file, and
+respond with a 202 as soon as it's safely on disk.
+
+A background thread in each worker then processes spooled webhooks in
+micro-batches, much like a backfill (see `member.backfill`): the people in
+a batch are resolved with set-based queries, and all of its memberships (or
+waivers) are inserted in a single transaction. If that fails, the batch is
+split until the webhooks at fault are found (so only they are kept back).
+
+- Batches are claimed with a lease, so that webhooks are never processed
+  concurrently by two workers (but *are* retried if a worker dies).
+- Webhooks which fail for reasons that may pass (e.g. the gear database is
+  down) are retried with exponential backoff, indefinitely.
+- Webhooks which can never succeed (e.g. an unexpected price) are kept, with
+  the error, for a human to look at.
+
+Webhooks may also be processed with `flask drain-spool` (e.g. from cron).
+"""
+import json
+import logging
+import time
+from datetime import date, datetime
+from typing import Dict, List, NamedTuple, Tuple
+
+from member.sqlite_queue import LeaseQueue, drain_command
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+    create table if not exists webhook_spool (
+      id integer primary key,
+      kind text not null,  -- 'membership' or 'waiver'
+      payload text not null,  -- JSON
+      received real not null,
+      attempts integer not null default 0,
+      due real not null,  -- When to (re)try processing (or when a lease ends)
+      error text null  -- Why processing can never succeed (if so)
+    )
+'''
+
+
+class Webhook(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+
+
+class Outcome(NamedTuple):
+    done: List[int]
+    retry: List[int]
+    errors: Dict[int, str]
+
+
+class Spool(LeaseQueue):  # pylint: disable=too-many-instance-attributes
+    table = 'webhook_spool'
+    key = 'id'
+
+    def __init__(self):
+        super().__init__()  # (Webhooks are processed inline without a path)
+        self.batch_wait = 0.05  # After a webhook arrives, wait for others
+        self.workers = 8  # Concurrent requests to mitoc-trips
+        self.lease_seconds = 300.0
+
+    def init_app(self, app):
+        app.config.setdefault('WEBHOOK_SPOOL_PATH', self.path)
+        app.config.setdefault('WEBHOOK_SPOOL_BATCH_SIZE', self.batch_size)
+        app.config.setdefault('WEBHOOK_SPOOL_BATCH_WAIT', self.batch_wait)
+        app.config.setdefault('WEBHOOK_SPOOL_POLL_INTERVAL', self.poll_interval)
+        app.config.setdefault('WEBHOOK_SPOOL_MAX_BACKOFF', self.max_backoff)
+
+        self.path = app.config['WEBHOOK_SPOOL_PATH']
+        self.batch_size = app.config['WEBHOOK_SPOOL_BATCH_SIZE']
+        self.batch_wait = app.config['WEBHOOK_SPOOL_BATCH_WAIT']
+        self.poll_interval = app.config['WEBHOOK_SPOOL_POLL_INTERVAL']
+        self.max_backoff = app.config['WEBHOOK_SPOOL_MAX_BACKOFF']
+        # Let a batch gather, rather than taking one webhook at a time
+        self.settle_seconds = self.batch_wait
+
+        self._app = app
+        app.extensions['webhook_spool'] = self
+        if self.path:
+            self._create(SCHEMA)
+
+    def append(self, kind: str, payload: dict) -> int:
+        """Durably store a webhook for processing, returning its ID."""
+        now = time.time()
+        # (Every commit is fsynced: a 202 promises the webhook won't be lost)
+        with self._transaction() as conn:
+            webhook_id = conn.execute(
+                '''
+                insert into webhook_spool (kind, payload, received, due)
+                values (?, ?, ?, ?)
+                ''',
+                [kind, json.dumps(payload), now, now],
+            ).lastrowid
+        self._appended()
+        return webhook_id
+
+    def claim(self, limit: int) -> List[Webhook]:
+        """Lease up to `limit` due webhooks, so that no other worker takes them."""
+        rows = self._claim(
+            '''
+            select id, kind, payload, attempts
+              from webhook_spool
+             where due <= ?
+               and error is null
+             order by id
+             limit ?
+            ''',
+            limit,
+        )
+        return [
+            Webhook(webhook_id, kind, json.loads(payload), attempts)
+            for webhook_id, kind, payload, attempts in rows
+        ]
+
+    def _complete(self, webhooks: List[Webhook], outcome: Outcome):
+        attempts = {webhook.id: webhook.attempts for webhook in webhooks}
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                'delete from webhook_spool where id = ?',
+                [(webhook_id,) for webhook_id in outcome.done],
+            )
+            self._retry(
+                conn,
+                [(webhook_id, attempts[webhook_id]) for webhook_id in outcome.retry],
+                now,
+            )
+            conn.executemany(
+                'update webhook_spool set error = ? where id = ?',
+                [(error, webhook_id) for webhook_id, error in outcome.errors.items()],
+            )
+
+    def process_due(self) -> Tuple[int, int, int]:
+        """Process one batch of due webhooks, returning (done, retried, errors)."""
+        webhooks = self.claim(self.batch_size)
+        if not webhooks:
+            return 0, 0, 0
+
+        with self._app.app_context():
+            try:
+                outcome = process(webhooks, self.workers)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to process %d webhooks", len(webhooks))
+                outcome = Outcome([], [webhook.id for webhook in webhooks], {})
+        self._complete(webhooks, outcome)
+
+        retried = set(outcome.retry)
+        for webhook in webhooks:
+            if webhook.id in outcome.errors:
+                self._alert(
+                    f"Spooled {webhook.kind} can't be processed",
+                    id=webhook.id,
+                    error=outcome.errors[webhook.id],
+                )
+            elif webhook.id in retried:
+                self._alert_if_repeated(
+                    webhook.attempts, f"process spooled {webhook.kind}", id=webhook.id
+                )
+        return len(outcome.done), len(outcome.retry), len(outcome.errors)
+
+    def pending(self) -> int:
+        with self._transaction() as conn:
+            return conn.execute(
+                'select count(*) from webhook_spool where error is null'
+            ).fetchone()[0]
+
+
+def process(webhooks: List[Webhook], workers: int) -> Outcome:
+    """Record a batch of webhooks, as the views would have (but set-based)."""
+    # pylint: disable=import-outside-toplevel,cyclic-import,too-many-locals
+    # (`member.backfill` uses the database, which needs the extensions)
+    from member import backfill
+
+    done: List[int] = []
+    retry: List[int] = []
+    errors: Dict[int, str] = {}
+
+    records: Dict[str, list] = {'membership': [], 'waiver': []}
+    for webhook in webhooks:
+        try:
+            record = _parse(webhook, backfill)
+        except (KeyError, TypeError, ValueError) as e:
+            errors[webhook.id] = f"{type(e).__name__}: {e}"
+            continue
+        if record is None:
+            done.append(webhook.id)  # (Not a membership payment after all)
+        else:
+            records[webhook.kind].append((webhook.id, record))
+
+    emails = {record.email for pairs in records.values() for _, record in pairs}
+    verified = backfill.lookup_verified_emails(emails, workers)
+
+    for kind, ingest, field in [
+        ('membership', backfill.ingest_memberships, 'membership_expires'),
+        ('waiver', backfill.ingest_waivers, 'waiver_expires'),
+    ]:
+        # Webhooks are retried if mitoc-trips couldn't tell us who they're for
+        pairs = [pair for pair in records[kind] if verified[pair[1].email]]
+        retry.extend(i for i, record in records[kind] if not verified[record.email])
+        if not pairs:
+            continue
+
+        ids = [webhook_id for webhook_id, _ in pairs]
+        try:
+            failures = _record(
+                ingest, field, [record for _, record in pairs], verified, workers
+            )
+        except backfill.TRANSIENT_ERRORS:
+            logger.exception("Failed to record %d spooled %ss", len(pairs), kind)
+            retry.extend(ids)
+            continue
+        for i, webhook_id in enumerate(ids):
+            if i in failures:  # (Only the bad webhooks, not the rest of the batch)
+                errors[webhook_id] = failures[i]
+            else:
+                done.append(webhook_id)
+
+    return Outcome(done, retry, errors)
+
+
+def _record(ingest, field: str, records, verified, workers: int) -> Dict[int, str]:
+    """Record the payments (or waivers), then tell mitoc-trips.
+
+    Returns why any records couldn't be recorded (by index); see
+    `backfill.ingest_isolating`. Transient errors are raised.
+    """
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from member.backfill import ingest_isolating, notify_trips
+
+    expirations, failures = ingest_isolating(ingest, records, verified)
+
+    latest: Dict[str, date] = {}
+    for record, expires in zip(records, expirations):
+        if expires is not None:
+            primary = verified[record.email].primary
+            latest[primary] = max(expires, latest.get(primary, expires))
+    if latest:  # (Failures here are no reason to record the webhooks again)
+        notify_trips(latest, workers, field)
+    return failures
+
+
+def _parse(webhook: Webhook, backfill):
+    """Return the payment or waiver a spooled webhook is for (if any)."""
+    if webhook.kind == 'membership':
+        # (The signature was verified before the webhook was spooled)
+        return backfill.parse_payment(webhook.id, webhook.payload, None)
+    payload = webhook.payload
+    return backfill.Waiver(
+        path=f"Spooled waiver {webhook.id}",
+        email=payload['email'],
+        first_name=payload['first_name'],
+        last_name=payload['last_name'],
+        time_signed=datetime.fromisoformat(payload['time_signed']),
+        affiliation=payload['affiliation'],
+    )
+
+
+drain_spool_command = drain_command(
+    'drain-spool',
+    'webhook_spool',
+    'WEBHOOK_SPOOL_PATH',
+    "Process all due webhooks in the spool.",
+    lambda done, retried, errors, pending: (
+        f"Processed {done} webhooks ({retried} to retry, {errors} failed), "
+        f"{pending} pending"
+    ),
+)
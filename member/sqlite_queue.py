@@ -0,0 +1,197 @@
+"""Work queues (and other state) kept in a local SQLite file, shared by workers.
+
+SQLite is used wherever state must survive a restart, or be shared by every
+worker on a host, without another server to run: the outbox of updates for
+mitoc-trips (`member.outbox`), the spool of webhooks (`member.spool`), and the
+claims on webhooks being handled (`member.coalesce`).
+
+`LeaseQueue` holds what the queues have in common:
+
+- Due rows are claimed in batches. A claim is a lease (the row isn't due again
+  until it ends), so rows are never handled concurrently by two workers, but
+  *are* retried if a worker dies.
+- Failed rows are retried with exponential backoff (with jitter), indefinitely.
+- A background thread in each worker drains the queue, woken on each append.
+- The queue may also be drained by hand (see `drain_command`).
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+
+class SqliteFile:  # pylint: disable=too-few-public-methods
+    """A SQLite file, opened anew by each thread (connections are cheap)."""
+
+    # Every commit is fsynced by default (nothing committed is ever lost)
+    synchronous = 'full'
+
+    def __init__(self):
+        self.path = ''  # Disabled without a path
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _create(self, schema: str):
+        with closing(self._connect()) as conn:
+            conn.execute('pragma journal_mode = wal')  # (Persists in the file)
+            conn.execute(schema)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections must not be shared between threads
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute(f'pragma synchronous = {self.synchronous}')
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        with closing(self._connect()) as conn:
+            conn.execute('begin immediate')  # Lock now, not upon the first write
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('rollback')
+                raise
+            conn.execute('commit')
+
+
+class LeaseQueue(SqliteFile):  # pylint: disable=too-many-instance-attributes
+    """Rows in `table` (keyed by `key`, with `attempts` & `due` columns)."""
+
+    table = ''
+    key = ''
+
+    def __init__(self):
+        super().__init__()
+        self.batch_size = 100
+        self.lease_seconds = 60.0
+        self.poll_interval = 5.0
+        self.max_backoff = 3600.0
+        self.alert_attempts = 5
+        self.settle_seconds = 0.0  # After a wakeup, let others arrive too
+
+        self._app = None
+        self._pid: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def process_due(self) -> Tuple[int, ...]:
+        """Handle one batch of due rows, returning counts of each outcome."""
+        raise NotImplementedError
+
+    def _claim(self, select: str, limit: int) -> List[tuple]:
+        """Lease up to `limit` rows given by `select` (of the key, then any).
+
+        `select` takes the current time & the limit as parameters.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(select, [now, limit]).fetchall()
+            conn.executemany(
+                f'update {self.table} set due = ? where {self.key} = ?',
+                [(now + self.lease_seconds, row[0]) for row in rows],
+            )
+        return rows
+
+    def _backoff(self, attempts: int) -> float:
+        # Jitter, so that many failures don't all retry at once
+        delay = min(self.max_backoff, 2**attempts)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _retry(self, conn, failed: Iterable[Tuple[object, int]], now: float):
+        """Retry each (key, attempts so far) after a backoff."""
+        conn.executemany(
+            f'''
+            update {self.table}
+               set attempts = attempts + 1,
+                   due = ?
+             where {self.key} = ?
+            ''',
+            [(now + self._backoff(attempts + 1), key) for key, attempts in failed],
+        )
+
+    def _alert(self, message: str, **extra):
+        sentry = self._app.extensions.get('sentry')
+        if sentry:
+            sentry.captureMessage(message, extra=extra)
+
+    def _alert_if_repeated(self, attempts: int, message: str, **extra):
+        """Alert on the `alert_attempts`-th failure (only)."""
+        if attempts + 1 == self.alert_attempts:
+            self._alert(f"Failed {self.alert_attempts}x to {message}", **extra)
+
+    def _appended(self):
+        self.start()
+        self._wakeup.set()
+
+    def drain(self):
+        """Handle every due row, then wait for more (until stopped)."""
+        while not self._stopping.is_set():
+            if sum(self.process_due()) < self.batch_size:
+                woken = self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                if woken and not self._stopping.is_set():
+                    time.sleep(self.settle_seconds)
+
+    def start(self):
+        """Start draining in the background (once per process)."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._drain_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop draining, after finishing any batch in progress."""
+        thread = self._thread
+        if self._pid != os.getpid() or thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join(timeout)
+        self._pid = self._thread = None
+
+    def _drain_forever(self):
+        while not self._stopping.is_set():
+            try:
+                self.drain()
+            except Exception:  # pylint: disable=broad-except
+                # (e.g. the file is locked for too long). Just try again later.
+                self._stopping.wait(self.poll_interval)
+
+
+def drain_command(
+    name: str, extension: str, setting: str, help_text: str, summary: Callable
+) -> click.Command:
+    """Make a command which drains a queue (e.g. from cron).
+
+    `summary` is given the total of each count from `process_due()`, then the
+    number of rows still pending.
+    """
+
+    @click.command(name, help=help_text)
+    @with_appcontext
+    def command():
+        queue = current_app.extensions[extension]
+        if not queue.enabled:
+            raise click.UsageError(f"{setting} is not configured")
+
+        totals: Tuple[int, ...] = ()
+        while True:
+            counts = queue.process_due()
+            totals = tuple(map(sum, zip(totals, counts))) if totals else counts
+            if sum(counts) < queue.batch_size:
+                break
+        click.echo(summary(*totals, queue.pending()))
+
+    return command
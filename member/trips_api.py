@@ -3,6 +3,15 @@ from datetime import datetime, timedelta
 import jwt
 from flask import current_app
 
+from member.cache import TTLCache
+
+TOKEN_LIFETIME = timedelta(minutes=15)
+
+# Signed tokens are reused until shortly before they expire
+token_cache = TTLCache(
+    maxsize=1024, ttl=(TOKEN_LIFETIME - timedelta(minutes=1)).total_seconds()
+)
+
 
 def bearer_jwt(**kwargs) -> str:
     """Express a JWT for use on mitoc-trips.mit.edu as a bearer token.
@@ -11,8 +20,38 @@ def bearer_jwt(**kwargs) -> str:
     authorized routes will be denied access.
     """
     secret = current_app.config['MEMBERSHIP_SECRET_KEY']
-    expires = datetime.utcnow() + timedelta(minutes=15)
+    key = (secret, tuple(sorted(kwargs.items())))
+    authorization = token_cache.get(key)
+    if authorization:
+        return authorization
+
+    expires = datetime.utcnow() + TOKEN_LIFETIME
     token: str = jwt.encode({**kwargs, 'exp': expires}, secret, algorithm='HS512')
     assert isinstance(token, str), "Unexpected token type. Install PyJWT 2?"
 
-    return 'Bearer: ' + token  # Concatenate, since f-strings would tolerate `bytes`
+    # Concatenate, since f-strings would tolerate `bytes`
+    authorization = 'Bearer: ' + token
+    token_cache.set(key, authorization)
+    return authorization
+
+
+def verified_bearer_jwt(authorization: str, audience: str) -> dict:
+    """Return the claims in a bearer token issued by mitoc-trips for `audience`.
+
+    Tokens are signed with the same shared key as those we issue (and likewise
+    must expire), but must also name the audience: tokens we issue never do, so
+    can't be replayed to us. Raises `jwt.InvalidTokenError` if the token can't
+    be trusted.
+    """
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme not in {'Bearer', 'Bearer:'}:  # (We've historically sent the colon)
+        raise jwt.InvalidTokenError("Expected a bearer token")
+
+    secret = current_app.config['MEMBERSHIP_SECRET_KEY']
+    return jwt.decode(
+        token.strip(),
+        secret,
+        algorithms=['HS512'],
+        audience=audience,
+        options={'require': ['exp', 'aud']},
+    )
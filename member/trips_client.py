@@ -0,0 +1,205 @@
+"""A keep-alive HTTP client for the mitoc-trips API.
+
+`urlopen()` opens (and closes) a new connection for every request, which means
+a TCP & TLS handshake for each of the (usually two) calls per webhook. Instead,
+each worker process keeps a few connections to mitoc-trips open between calls.
+
+Like `urlopen()`, failures raise `URLError` (or `HTTPError` for an error status),
+so callers need not know how requests are made.
+
+The client is fork-aware, just like the database pool: connections inherited
+from a parent process are forgotten, never used.
+"""
+import http.client
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+from member.errors import TripsBusy
+
+
+class ClientStats(NamedTuple):
+    requests: int
+    failures: int  # Requests which raised (including for an error status)
+    connections: int  # Connections opened (each costing a handshake)
+    reconnects: int  # Requests retried after a kept-alive connection was closed
+    busy: int  # Requests never made, for want of a slot (see `max_concurrent`)
+    total_seconds: float
+    max_seconds: float
+
+
+# Errors indicating that the server closed an idle connection; safe to retry
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class TripsClient:  # pylint: disable=too-many-instance-attributes
+    def __init__(self):
+        self.base_url = 'https://mitoc-trips.mit.edu'
+        self.pool_size = 4  # Idle connections kept open (more may be in use)
+        self.connect_timeout = 3.0
+        self.read_timeout = 10.0
+        self.idle_timeout = 60.0  # Should be less than the server's keep-alive
+        # At most this many requests are in flight at once (0 for no limit).
+        # When mitoc-trips is slow, others wait for a slot, but not for long.
+        self.max_concurrent = 0
+        self.slot_timeout = 1.0
+
+        self._reset()
+
+    def init_app(self, app):
+        app.config.setdefault('TRIPS_API_URL', self.base_url)
+        app.config.setdefault('TRIPS_API_POOL_SIZE', self.pool_size)
+        app.config.setdefault('TRIPS_API_CONNECT_TIMEOUT', self.connect_timeout)
+        app.config.setdefault('TRIPS_API_READ_TIMEOUT', self.read_timeout)
+        app.config.setdefault('TRIPS_API_IDLE_TIMEOUT', self.idle_timeout)
+        app.config.setdefault('TRIPS_API_MAX_CONCURRENT', self.max_concurrent)
+        app.config.setdefault('TRIPS_API_SLOT_TIMEOUT', self.slot_timeout)
+
+        self.base_url = app.config['TRIPS_API_URL']
+        self.pool_size = app.config['TRIPS_API_POOL_SIZE']
+        self.connect_timeout = app.config['TRIPS_API_CONNECT_TIMEOUT']
+        self.read_timeout = app.config['TRIPS_API_READ_TIMEOUT']
+        self.idle_timeout = app.config['TRIPS_API_IDLE_TIMEOUT']
+        self.max_concurrent = app.config['TRIPS_API_MAX_CONCURRENT']
+        self.slot_timeout = app.config['TRIPS_API_SLOT_TIMEOUT']
+
+        app.extensions['trips_client'] = self
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle: List[Tuple[http.client.HTTPConnection, float]] = []
+        self._slots = (
+            threading.BoundedSemaphore(self.max_concurrent)
+            if self.max_concurrent
+            else None
+        )
+
+        self._requests = 0
+        self._failures = 0
+        self._connections = 0
+        self._reconnects = 0
+        self._busy = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+
+    def _ensure_process(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def request(self, method: str, path: str, headers: Dict[str, str]) -> bytes:
+        """Make a request to mitoc-trips, returning the response body."""
+        self._ensure_process()
+        slots = self._slots  # (Released once the request is done)
+        # pylint: disable-next=consider-using-with
+        if slots is not None and not slots.acquire(timeout=self.slot_timeout):
+            with self._lock:
+                self._busy += 1
+            raise TripsBusy(f"No slot for a request after {self.slot_timeout}s")
+
+        start = time.monotonic()
+        try:
+            return self._request(method, path, headers)
+        except URLError:
+            with self._lock:
+                self._failures += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._requests += 1
+                self._total_seconds += elapsed
+                self._max_seconds = max(self._max_seconds, elapsed)
+            if slots is not None:
+                slots.release()
+
+    def _request(self, method, path, headers) -> bytes:
+        conn, reused = self._checkout()
+        try:
+            response, body = self._send(conn, method, path, headers)
+        except STALE_CONNECTION_ERRORS as e:
+            conn.close()
+            if not reused:
+                raise URLError(e) from e
+            with self._lock:
+                self._reconnects += 1
+            conn = self._new_connection()
+            try:
+                response, body = self._send(conn, method, path, headers)
+            except (http.client.HTTPException, OSError) as retry_error:
+                conn.close()
+                raise URLError(retry_error) from retry_error
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            raise URLError(e) from e
+
+        self._checkin(conn, keep_alive=not response.will_close)
+        if response.status >= 400:
+            url = self.base_url + path
+            raise HTTPError(url, response.status, response.reason, response.msg, None)
+        return body
+
+    def _send(self, conn, method, path, headers):
+        if conn.sock is None:
+            conn.connect()  # (Within `connect_timeout`)
+            conn.sock.settimeout(self.read_timeout)
+        conn.request(method, urlsplit(self.base_url).path + path, headers=headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def _checkout(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """Return a connection, and whether it has been used before."""
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return conn, True
+                conn.close()  # The server has likely closed it anyway
+        return self._new_connection(), False
+
+    def _checkin(self, conn, keep_alive: bool):
+        with self._lock:
+            if keep_alive and len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        url = urlsplit(self.base_url)
+        connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        with self._lock:
+            self._connections += 1
+        return connection_class(url.hostname, url.port, timeout=self.connect_timeout)
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self) -> ClientStats:
+        self._ensure_process()
+        with self._lock:
+            return ClientStats(
+                requests=self._requests,
+                failures=self._failures,
+                connections=self._connections,
+                reconnects=self._reconnects,
+                busy=self._busy,
+                total_seconds=self._total_seconds,
+                max_seconds=self._max_seconds,
+            )
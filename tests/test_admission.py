@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+from urllib.error import URLError
+
+from member import admission, extensions, metrics
+from member.app import create_app
+from member.errors import PoolTimeout, TripsBusy
+from member.public import views
+
+PAYMENT = {
+    'decision': 'ACCEPT',
+    'req_merchant_defined_data1': 'membership',
+    'req_merchant_defined_data3': 'tim@mit.edu',
+    'signed_date_time': '2018-05-17T19:20:30Z',
+}
+
+
+class AdmissionTests(unittest.TestCase):
+    # pylint: disable=protected-access
+    def setUp(self):
+        self.admission = admission.AdmissionControl()
+        self.metrics = metrics.Metrics()
+        with mock.patch.multiple(
+            extensions, admission=self.admission, metrics=self.metrics
+        ):
+            self.app = create_app()
+        self.admission.max_concurrent = 1
+        self.client = self.app.test_client()
+
+        patcher = mock.patch.object(views, 'other_verified_emails')
+        self.other_verified_emails = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def status(self):
+        return self.client.get('/members/status', query_string={'email': 'x'})
+
+    def test_concurrency(self):
+        """Requests beyond the limit for an endpoint are shed at once."""
+        self.admission._in_flight['public.membership_status'] = 1
+        response = self.status()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+        # Other endpoints are unaffected
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_released(self):
+        """Each request frees its place once finished."""
+        for _ in range(3):
+            self.assertEqual(self.status().status_code, 401)  # (No JWT)
+
+    @mock.patch.object(views, 'db')
+    def test_pool_timeout(self, db):
+        db.transaction.side_effect = PoolTimeout('No connection')
+        self.other_verified_emails.return_value = ('tim@mit.edu', ['tim@mit.edu'])
+        self.app.config['VERIFY_CYBERSOURCE_SIGNATURE'] = False
+        response = self.client.post('/members/membership', data=PAYMENT)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+    def test_trips_busy(self):
+        """Webhooks are shed if mitoc-trips can't be asked about emails in time."""
+        self.other_verified_emails.side_effect = TripsBusy('No slot')
+        self.app.config['VERIFY_CYBERSOURCE_SIGNATURE'] = False
+        response = self.client.post('/members/membership', data=PAYMENT)
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(issubclass(TripsBusy, URLError))  # (Retried like others)
+
+        self.assertEqual(
+            self.admission.shed_counts(), {('public.add_membership', 'trips_api'): 1}
+        )
+        body = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn(
+            'member_requests_shed_total'
+            '{endpoint="public.add_membership",reason="trips_api"} 1',
+            body,
+        )
+        self.assertIn(
+            'member_requests_total'
+            '{endpoint="public.add_membership",method="POST",status="503"} 1',
+            body,
+        )
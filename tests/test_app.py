@@ -41,3 +41,14 @@ class AppInitializationTests(unittest.TestCase):
         with mock.patch.object(Sentry, '__init__') as sentry_class:
             app.create_app()
         sentry_class.assert_not_called()
+
+
+class WarmUpTests(unittest.TestCase):
+    def test_warm_up(self):
+        """Warming up opens connections & prepares to read envelopes."""
+        created_app = app.create_app()
+        with mock.patch.object(extensions.pool, 'warm') as warm:
+            with mock.patch.object(app.CompletedEnvelope, 'warm_up') as warm_up:
+                app.warm_up(created_app)
+        warm.assert_called_once_with()
+        warm_up.assert_called_once_with()
@@ -0,0 +1,314 @@
+import csv
+import io
+import json
+import unittest
+from datetime import date, datetime, timezone
+from pathlib import Path
+from unittest import mock
+from urllib.error import URLError
+
+import pymysql
+
+from benchmarks.gear_db import membership_payment as payment
+from member import backfill, db, errors
+from member.app import create_app
+from member.emails import VerifiedEmails
+from member.signature import SecureAcceptanceSigner
+
+from .utils import start_patchers, temporary_directory
+
+COMPLETED_WAIVER = (Path(__file__).parent / 'completed_waiver.xml').read_text()
+
+
+def as_csv(rows):
+    export = io.StringIO()
+    writer = csv.DictWriter(export, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return export.getvalue()
+
+
+class BackfillMembershipsTests(unittest.TestCase):
+    # pylint: disable=too-many-instance-attributes
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['VERIFY_CYBERSOURCE_SIGNATURE'] = True
+        self.app.config['CYBERSOURCE_SECRET_KEY'] = 'secret-key'
+        self.runner = self.app.test_cli_runner()
+
+        self.conn = mock.Mock()
+        patchers = [
+            mock.patch.object(db, 'get_db', return_value=self.conn),
+            mock.patch.object(db, 'people_to_update'),
+            mock.patch.object(db, 'add_person', return_value=512),
+            mock.patch.object(db, 'already_inserted_memberships'),
+            mock.patch.object(db, 'add_memberships'),
+            mock.patch.object(backfill, 'other_verified_emails'),
+            mock.patch.object(backfill, 'update_membership'),
+        ]
+        (
+            _,
+            self.people_to_update,
+            self.add_person,
+            self.already_inserted_memberships,
+            self.add_memberships,
+            self.other_verified_emails,
+            self.update_membership,
+        ) = start_patchers(self, *patchers)
+
+        self.other_verified_emails.side_effect = lambda email: VerifiedEmails(
+            email, [email]
+        )
+        self.people_to_update.side_effect = lambda email_sets: [
+            37 if 'tim@mit.edu' in emails else None for emails in email_sets
+        ]
+        self.already_inserted_memberships.side_effect = lambda rows: [
+            False for _ in rows
+        ]
+        self.add_memberships.side_effect = lambda rows: [
+            date(2019, 5, 17) for _ in rows
+        ]
+
+    def backfill(self, export, *args):
+        return self.runner.invoke(
+            args=['backfill-memberships', '-', *args],
+            input=export,
+            catch_exceptions=False,
+        )
+
+    def test_backfill(self):
+        rows = [
+            payment('tim@mit.edu'),
+            payment('tim@mit.edu', decision='CANCEL'),  # Ignored
+            payment('new@example.com'),
+            payment('tim@mit.edu', req_amount='1.00'),  # Invalid payment
+            payment('tim@mit.edu'),  # Same payment, repeated in the export
+        ]
+        result = self.backfill(as_csv(rows))
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Row 4: Expected 15, got 1.00', result.output)
+        self.assertIn(
+            '2 inserted, 1 already present, 1 ignored, 1 errors', result.output
+        )
+
+        # People were resolved at once, and new members were created
+        self.people_to_update.assert_called_once_with(
+            [['tim@mit.edu'], ['new@example.com'], ['tim@mit.edu']]
+        )
+        self.add_person.assert_called_once_with('Tim', 'Beaver', 'new@example.com')
+        paid = datetime(2018, 5, 17, 19, 20, 30)
+        self.add_memberships.assert_called_once()
+        self.assertEqual(
+            self.add_memberships.call_args[0][0],
+            [(37, '15.00', paid, 'MU'), (512, '15.00', paid, 'MU')],
+        )
+        self.assertEqual(self.update_membership.call_count, 2)
+        self.conn.commit.assert_not_called()  # The database calls were mocked
+
+    def test_already_inserted(self):
+        """Payments already recorded by the webhook are not inserted again."""
+        self.already_inserted_memberships.side_effect = lambda rows: [
+            True for _ in rows
+        ]
+        result = self.backfill(as_csv([payment('tim@mit.edu')]))
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('0 inserted, 1 already present', result.output)
+        self.update_membership.assert_not_called()
+
+    def test_chunks(self):
+        """Each chunk of rows is resolved (and inserted) together."""
+        rows = [
+            payment('tim@mit.edu', signed_date_time=f'2018-05-{day:02d}T19:20:30Z')
+            for day in range(1, 6)
+        ]
+        export = '\n'.join(json.dumps(row) for row in rows)
+        result = self.backfill(export, '--format=jsonl', '--chunk-size=2')
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.people_to_update.call_count, 3)
+        self.assertEqual(self.add_memberships.call_count, 3)
+        self.assertIn('5 inserted', result.output)
+
+    def test_invalid_signature(self):
+        """Signatures are verified when the export includes them."""
+        row = payment(
+            'tim@mit.edu',
+            signed_field_names='decision,req_amount',
+            signature='bogus',
+        )
+        result = self.backfill(as_csv([row]))
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Row 1: Invalid signature', result.output)
+        self.add_memberships.assert_not_called()
+
+    def test_signatures_across_processes(self):
+        """Signatures from any active key are verified, across many processes."""
+        self.app.config['CYBERSOURCE_PREVIOUS_SECRET_KEYS'] = ['old-key']
+        fields = 'decision,req_merchant_defined_data3,req_amount'
+        rows = []
+        for key, email in [('secret-key', 'tim@mit.edu'), ('old-key', 'old@mit.edu')]:
+            row = payment(email, signed_field_names=fields)
+            signature = SecureAcceptanceSigner(key).sign(row, fields.split(','))
+            rows.append({**row, 'signature': signature.decode()})
+        rows.append({**rows[0], 'req_merchant_defined_data3': 'eve@example.com'})
+
+        result = self.backfill(as_csv(rows), '--processes=2')
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Row 3: Invalid signature', result.output)
+        self.assertIn('2 inserted', result.output)
+
+    def test_trips_lookup_failed(self):
+        self.other_verified_emails.side_effect = URLError('Oh no')
+        result = self.backfill(as_csv([payment('tim@mit.edu')]))
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Row 1: could not look up tim@mit.edu', result.output)
+
+    def test_without_trips(self):
+        result = self.backfill(as_csv([payment('tim@mit.edu')]), '--no-trips')
+        self.assertEqual(result.exit_code, 0)
+        self.other_verified_emails.assert_not_called()
+        self.update_membership.assert_not_called()
+        self.assertIn('1 inserted', result.output)
+
+    def test_raced_with_webhook(self):
+        """If a webhook inserts a membership mid-chunk, the chunk is retried."""
+        self.add_memberships.side_effect = [
+            errors.AlreadyInserted,
+            [date(2019, 5, 17)],
+        ]
+        self.already_inserted_memberships.side_effect = [[False, False], [True, False]]
+        rows = [
+            payment('tim@mit.edu'),
+            payment('tim@mit.edu', signed_date_time='2018-05-18T19:20:30Z'),
+        ]
+        result = self.backfill(as_csv(rows))
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('1 inserted, 1 already present', result.output)
+        self.assertEqual(self.add_memberships.call_count, 2)
+
+    def test_raced_repeatedly(self):
+        """The chunk is retried for as long as webhooks keep racing with it."""
+        self.add_memberships.side_effect = [
+            errors.AlreadyInserted,
+            errors.AlreadyInserted,
+            [],
+        ]
+        self.already_inserted_memberships.side_effect = [
+            [False, False],
+            [True, False],
+            [True, True],
+        ]
+        rows = [
+            payment('tim@mit.edu'),
+            payment('tim@mit.edu', signed_date_time='2018-05-18T19:20:30Z'),
+        ]
+        result = self.backfill(as_csv(rows))
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('0 inserted, 2 already present', result.output)
+
+    def test_bad_row_isolated(self):
+        """A row which can't be inserted fails alone, not with its chunk."""
+
+        def add_memberships(rows):
+            if any(datetime_paid.day == 18 for _, _, datetime_paid, _ in rows):
+                raise pymysql.err.DataError(1292, "Incorrect datetime value")
+            return [date(2019, 5, 17) for _ in rows]
+
+        self.add_memberships.side_effect = add_memberships
+        rows = [
+            payment('tim@mit.edu', signed_date_time=f'2018-05-{day}T19:20:30Z')
+            for day in [16, 17, 18, 19]
+        ]
+        result = self.backfill(as_csv(rows))
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Row 3: DataError: (1292', result.output)
+        self.assertIn('3 inserted', result.output)
+
+
+class BackfillWaiversTests(unittest.TestCase):
+    # pylint: disable=too-many-instance-attributes
+    def setUp(self):
+        self.app = create_app()
+        self.runner = self.app.test_cli_runner()
+
+        self.directory = temporary_directory(self)
+
+        patchers = [
+            mock.patch.object(db, 'get_db'),
+            mock.patch.object(db, 'people_to_update'),
+            mock.patch.object(db, 'add_person', return_value=512),
+            mock.patch.object(db, 'already_added_waivers'),
+            mock.patch.object(db, 'add_waivers'),
+            mock.patch.object(db, 'update_affiliations'),
+            mock.patch.object(backfill, 'other_verified_emails'),
+            mock.patch.object(backfill, 'update_membership'),
+        ]
+        (
+            _,
+            self.people_to_update,
+            self.add_person,
+            self.already_added_waivers,
+            self.add_waivers,
+            self.update_affiliations,
+            self.other_verified_emails,
+            self.update_membership,
+        ) = start_patchers(self, *patchers)
+
+        self.other_verified_emails.side_effect = lambda email: VerifiedEmails(
+            email, [email]
+        )
+        self.people_to_update.side_effect = lambda email_sets: [37 for _ in email_sets]
+        self.already_added_waivers.side_effect = lambda rows: [False for _ in rows]
+        self.add_waivers.side_effect = lambda rows: [date(2019, 11, 10) for _ in rows]
+
+    def write_envelope(self, name, contents):
+        path = Path(self.directory) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(contents)
+
+    def backfill(self, *args):
+        return self.runner.invoke(
+            args=['backfill-waivers', self.directory, '--processes=2', *args],
+            catch_exceptions=False,
+        )
+
+    def test_backfill(self):
+        self.write_envelope('a.xml', COMPLETED_WAIVER)
+        self.write_envelope('2018/b.xml', COMPLETED_WAIVER)  # Same waiver, again
+        # The envelope status is the last of many statuses
+        head, _, tail = COMPLETED_WAIVER.rpartition('<Status>Completed</Status>')
+        self.write_envelope('c.xml', f'{head}<Status>Sent</Status>{tail}')
+        self.write_envelope('d.xml', '<NotAnEnvelope/>')
+        self.write_envelope('notes.txt', 'Not an envelope at all')
+
+        result = self.backfill()
+
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('d.xml: ValueError: Expected', result.output)
+        self.assertIn('4 envelopes (', result.output)
+        self.assertIn(
+            '1 inserted, 1 already present, 1 ignored, 1 errors', result.output
+        )
+
+        self.people_to_update.assert_called_once_with([['tim@mit.edu']] * 2)
+        time_signed = datetime(2018, 11, 10, 23, 41, 6, 937000, tzinfo=timezone.utc)
+        self.add_waivers.assert_called_once_with([(37, time_signed)])
+        self.update_affiliations.assert_called_once_with({37: 'Non-affiliate'})
+        self.update_membership.assert_called_once_with(
+            'tim@mit.edu', waiver_expires=date(2019, 11, 10)
+        )
+
+    def test_already_added(self):
+        self.already_added_waivers.side_effect = lambda rows: [True for _ in rows]
+        self.write_envelope('a.xml', COMPLETED_WAIVER)
+
+        result = self.backfill('--no-trips')
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('0 inserted, 1 already present', result.output)
+        self.add_waivers.assert_called_once_with([])
+        self.other_verified_emails.assert_not_called()
@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+from member.cache import TTLCache
+
+
+class TTLCacheTests(unittest.TestCase):
+    def test_expiry(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        with mock.patch('time.monotonic', return_value=1000):
+            cache.set('key', 'value')
+        with mock.patch('time.monotonic', return_value=1059):
+            self.assertEqual(cache.get('key'), 'value')
+        with mock.patch('time.monotonic', return_value=1061):
+            self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.stats()[2:4], (1, 1))  # One hit, one miss
+
+    def test_least_recently_used_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual(cache.stats().evictions, 1)
+
+    def test_invalidate_where(self):
+        cache = TTLCache()
+        for i in range(5):
+            cache.set(i, i * 10)
+        cache.invalidate_where(lambda key, value: value >= 30)
+        self.assertEqual(cache.stats().size, 3)
+        self.assertEqual(cache.stats().invalidations, 2)
+
+    def test_disabled(self):
+        cache = TTLCache(maxsize=10, ttl=0)
+        cache.set('key', 'value')
+        self.assertIsNone(cache.get('key'))
+
+    def test_stale(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        with mock.patch('time.monotonic', return_value=1000):
+            cache.set('key', 'value')
+            cache.set('brief', 'value', ttl=5)
+        with mock.patch('time.monotonic', return_value=1030):
+            self.assertEqual(cache.get_stale('key', 60), ('value', False))
+            self.assertEqual(cache.get_stale('brief', 60), ('value', True))
+            self.assertIsNone(cache.get('brief'))
+        with mock.patch('time.monotonic', return_value=1090):
+            self.assertEqual(cache.get_stale('key', 60), ('value', True))
+            self.assertEqual(cache.get_stale('brief', 60), (None, False))
+        self.assertEqual(cache.stats().hit_ratio, 0.6)
@@ -0,0 +1,95 @@
+import threading
+import unittest
+from unittest import mock
+
+from member import coalesce
+from member.app import create_app
+
+from .utils import use_sqlite_file
+
+
+class CoalescerTests(unittest.TestCase):
+    # pylint: disable=protected-access
+    def setUp(self):
+        self.app = create_app()
+        self.coalescer = use_sqlite_file(
+            self, coalesce.Coalescer(), 'WEBHOOK_COALESCE_PATH'
+        )
+
+    def test_concurrent_duplicates(self):
+        """Only one duplicate is handled; the other waits for its result."""
+        started, finish = threading.Event(), threading.Event()
+        handle = mock.Mock(side_effect=lambda: started.set() or finish.wait() and 201)
+
+        statuses = []
+        original = threading.Thread(
+            target=lambda: statuses.append(self.coalescer.run('tim', handle))
+        )
+        original.start()
+        started.wait()
+
+        duplicate = threading.Thread(
+            target=lambda: statuses.append(self.coalescer.run('tim', handle))
+        )
+        duplicate.start()
+        finish.set()
+        original.join()
+        duplicate.join()
+
+        self.assertEqual(statuses, [201, 201])
+        handle.assert_called_once_with()
+
+    def test_still_in_flight(self):
+        """Duplicates are accepted with a 202 if the original takes too long."""
+        self.coalescer.wait_seconds = 0.05
+        self.assertIsNone(self.coalescer._claim('tim'))
+        handle = mock.Mock()
+        self.assertEqual(self.coalescer.run('tim', handle), 202)
+        handle.assert_not_called()
+
+    def test_waiting_only_reads(self):
+        """Waiting duplicates don't take the write lock, and back off."""
+        self.coalescer.wait_seconds = 0.3
+        self.assertIsNone(self.coalescer._claim('tim'))
+        with mock.patch.object(
+            self.coalescer, '_transaction', wraps=self.coalescer._transaction
+        ) as transaction, mock.patch.object(
+            self.coalescer, '_peek', wraps=self.coalescer._peek
+        ) as peek:
+            self.assertEqual(self.coalescer.run('tim', mock.Mock()), 202)
+        transaction.assert_called_once_with()  # (Just the initial claim)
+        self.assertLess(peek.call_count, 6)  # (Rather than every 20ms)
+
+    def test_released_while_waiting(self):
+        """If the original fails while a duplicate waits, the duplicate takes over."""
+        self.assertIsNone(self.coalescer._claim('tim'))
+        self.coalescer.poll_interval = 0.001
+        peek = self.coalescer._peek
+
+        def original_fails(key):
+            self.coalescer._release(key)
+            return peek(key)
+
+        handle = mock.Mock(return_value=201)
+        with mock.patch.object(self.coalescer, '_peek', side_effect=original_fails):
+            self.assertEqual(self.coalescer.run('tim', handle), 201)
+        handle.assert_called_once_with()
+
+    def test_failure_released(self):
+        """If handling fails, a duplicate may try again."""
+        with self.assertRaises(RuntimeError):
+            self.coalescer.run('tim', mock.Mock(side_effect=RuntimeError))
+        self.assertEqual(self.coalescer.run('tim', lambda: 201), 201)
+
+    def test_lapsed(self):
+        """Claims lapse (e.g. if their worker died), and results are forgotten."""
+        self.assertIsNone(self.coalescer._claim('tim'))
+        with mock.patch.object(coalesce.time, 'time', return_value=2e9):
+            self.assertEqual(self.coalescer.run('tim', lambda: 201), 201)
+            self.assertEqual(self.coalescer.run('tim', mock.Mock()), 201)
+        with mock.patch.object(coalesce.time, 'time', return_value=3e9):
+            self.assertEqual(self.coalescer.run('tim', lambda: 204), 204)
+
+    def test_distinct_keys(self):
+        self.assertEqual(self.coalescer.run('tim', lambda: 201), 201)
+        self.assertEqual(self.coalescer.run('bob', lambda: 204), 204)
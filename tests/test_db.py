@@ -3,6 +3,8 @@ import unittest.mock
 from datetime import date, datetime
 
 from member import db, errors
+from member.app import create_app
+from member.cache import TTLCache
 
 
 class TestDbMethods(unittest.TestCase):
@@ -86,3 +88,297 @@ class TestDbMethods(unittest.TestCase):
         """We only attempt to update people with valid affiliations."""
         with self.assertRaises(ValueError):
             db.update_affiliation(42, "Cousin of MIT alumni's brother")
+
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        self.conn = unittest.mock.Mock()
+        self.cursor = self.conn.cursor.return_value
+        self.cursor.lastrowid = 512
+        self.cursor.rowcount = 1
+        for cache in ['person_cache', 'status_cache']:
+            cache_patcher = unittest.mock.patch.object(db, cache, TTLCache())
+            cache_patcher.start()
+            self.addCleanup(cache_patcher.stop)
+
+        self.app_context = create_app().app_context()
+        self.app_context.push()
+        patcher = unittest.mock.patch.object(db, 'get_db', return_value=self.conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.app_context.pop)
+
+    def executed_sql(self):
+        return [' '.join(c[0][0].split()) for c in self.cursor.execute.call_args_list]
+
+    def test_membership_for_known_person(self):
+        """A renewal needs just one lookup and one insert before committing."""
+        self.cursor.fetchall.return_value = [
+            (
+                'tim@mit.edu',
+                37,
+                'MIT undergrad',
+                date(2018, 1, 15),
+                1,
+                date(2018, 1, 15),
+            )
+        ]
+
+        with db.transaction():
+            person_id = db.person_to_update('tim@mit.edu', ['tim@mit.edu'])
+            membership = db.add_membership(
+                person_id, '15.00', datetime(2018, 1, 1, 17, 47), 'MU'
+            )
+
+        # Expiration was computed without re-reading the row, and starts at the end
+        # of the current membership (known from the person lookup)
+        self.assertEqual(membership, (512, date(2019, 1, 15)))
+        # Affiliation was unchanged, so no update was needed
+        sql = self.executed_sql()
+        self.assertEqual(len(sql), 2)
+        self.assertTrue(sql[1].startswith('insert into people_memberships'))
+        self.conn.commit.assert_called_once()
+
+    def test_new_person_with_waiver(self):
+        self.cursor.fetchall.return_value = []
+
+        with db.transaction():
+            self.assertIsNone(db.person_to_update('tim@mit.edu', ['tim@mit.edu']))
+            person_id = db.add_person('Tim', 'Beaver', 'tim@mit.edu')
+            _, expires = db.add_waiver(person_id, datetime(2020, 2, 29, 4, 5))
+            db.update_affiliation(person_id, 'Non-affiliate')
+            db.update_affiliation(person_id, 'Non-affiliate')
+
+        self.assertEqual(expires, date(2021, 2, 28))
+        updates = [s for s in self.executed_sql() if s.startswith('update people')]
+        self.assertEqual(len(updates), 1)
+        self.conn.commit.assert_called_once()
+
+    def test_read_only(self):
+        """Nothing is committed when nothing was written."""
+        self.cursor.fetchall.return_value = [
+            ('tim@mit.edu', 37, 'MIT undergrad', None, None, None)
+        ]
+        with db.transaction():
+            db.person_to_update('tim@mit.edu', ['tim@mit.edu'])
+        self.conn.commit.assert_not_called()
+
+    def test_rolled_back_on_error(self):
+        with self.assertRaises(errors.IncorrectPayment):
+            with db.transaction():
+                db.add_person('Tim', 'Beaver', 'tim@mit.edu')
+                db.add_membership(512, '1.00', datetime.now(), 'MU')
+        self.conn.commit.assert_not_called()
+        self.conn.rollback.assert_called_once()
+
+    def test_person_lookup_cached(self):
+        """Lookups are cached by email (in any case), until we write to that person."""
+        self.cursor.fetchall.return_value = [
+            ('tim@mit.edu', 37, 'MIT undergrad', None, 0, datetime(2016, 5, 2)),
+            ('tim@example.com', 38, None, None, None, None),
+        ]
+        emails = ['tim@mit.edu', 'tim@example.com']
+        with db.transaction():
+            self.assertEqual(db.person_to_update('tim@mit.edu', emails), 37)
+        with db.transaction():
+            self.assertEqual(
+                db.person_to_update('tim@mit.edu', ['TIM@mit.edu', 'tim@example.com']),
+                37,
+            )
+        self.assertEqual(self.cursor.execute.call_count, 1)
+
+        # A waiver for the *other* account may make it the one to update
+        self.cursor.fetchall.return_value = [
+            ('tim@mit.edu', 37, 'MIT undergrad', None, 0, datetime(2016, 5, 2)),
+            ('tim@example.com', 38, None, None, 1, datetime(2019, 11, 10, 23, 41)),
+        ]
+        with db.transaction():
+            db.add_waiver(38, datetime(2018, 11, 10, 23, 41))
+            self.assertEqual(db.person_to_update('tim@mit.edu', emails), 38)
+
+        stats = db.person_cache.stats()
+        self.assertEqual((stats.hits, stats.misses), (1, 2))
+
+    def test_new_person_invalidates_lookup(self):
+        """Nobody is found for an email, until that person is created."""
+        self.cursor.fetchall.return_value = []
+        with db.transaction():
+            self.assertIsNone(db.person_to_update('tim@mit.edu', ['tim@mit.edu']))
+            person_id = db.add_person('Tim', 'Beaver', 'Tim@MIT.edu')
+
+        self.cursor.fetchall.return_value = [
+            ('Tim@MIT.edu', person_id, None, None, None, None)
+        ]
+        with db.transaction():
+            self.assertEqual(
+                db.person_to_update('tim@mit.edu', ['tim@mit.edu']), person_id
+            )
+
+    def test_people_to_update(self):
+        """Many sets of emails are resolved with one query."""
+        self.cursor.fetchall.return_value = [
+            # Tim has two accounts: only one has been active in the last year
+            ('tim@mit.edu', 37, None, None, 0, datetime(2017, 5, 2)),
+            ('tim@csail.mit.edu', 38, None, None, 1, datetime(2018, 1, 1)),
+            # An alternate email on Tim's old account (more recent, but inactive)
+            ('tim@example.com', 37, None, None, 0, datetime(2017, 5, 2)),
+            # Two accounts for Beth, neither ever had a membership or waiver
+            ('beth@example.com', 40, None, None, None, None),
+            ('beth@mit.edu', 41, None, None, None, None),
+            # Beth's third account once had a waiver
+            ('beth@gmail.com', 42, None, None, 0, datetime(2010, 8, 1)),
+        ]
+        people = db.people_to_update(
+            [
+                ['tim@mit.edu', 'tim@csail.mit.edu'],
+                ['tim@example.com'],
+                ['beth@example.com', 'beth@mit.edu', 'beth@gmail.com'],
+                ['beth@example.com'],
+                ['nobody@example.com'],
+            ]
+        )
+        self.assertEqual(people, [38, 37, 42, 40, None])
+        self.cursor.execute.assert_called_once()
+
+    def test_add_memberships(self):
+        """Many memberships are inserted at once, in the order they were paid."""
+        self.cursor.fetchall.return_value = [
+            (37, 'MIT undergrad', date(2018, 1, 15)),
+            (38, None, None),
+        ]
+        self.cursor.rowcount = 3  # Multi-row insert
+        with db.transaction():
+            expirations = db.add_memberships(
+                [
+                    (37, '15.00', datetime(2018, 1, 1, 17, 47), 'MU'),
+                    (38, '40.00', datetime(2018, 1, 1, 17, 47), 'NA'),
+                    # Renewing near the end of the membership just paid for
+                    (37, '15.00', datetime(2018, 12, 20, 17, 47), 'MU'),
+                ]
+            )
+
+        self.assertEqual(
+            expirations, [date(2019, 1, 15), date(2019, 1, 1), date(2020, 1, 15)]
+        )
+        self.cursor.executemany.assert_called_once()
+        self.assertEqual(len(self.cursor.executemany.call_args[0][1]), 3)
+        # One query for both people, then only the changed affiliation is updated
+        sql = self.executed_sql()
+        self.assertEqual(len(sql), 2)
+        self.assertTrue(sql[1].startswith('update people'))
+        self.conn.commit.assert_called_once()
+
+    def test_already_inserted_memberships(self):
+        self.cursor.fetchall.return_value = [
+            (37, date(2018, 1, 1), date(2019, 1, 1)),
+            # Inserted before the day of payment was recorded
+            (38, None, date(2019, 1, 2)),
+        ]
+        already_inserted = db.already_inserted_memberships(
+            [
+                (37, datetime(2018, 1, 1, 17, 47)),
+                (37, datetime(2018, 1, 2, 17, 47)),
+                (38, datetime(2018, 1, 1, 17, 47)),
+                (38, datetime(2018, 1, 2, 17, 47)),
+            ]
+        )
+        self.assertEqual(already_inserted, [True, False, False, True])
+        self.cursor.execute.assert_called_once()
+
+    def test_add_waivers(self):
+        self.cursor.rowcount = 2
+        with db.transaction():
+            expirations = db.add_waivers(
+                [
+                    (37, datetime(2020, 2, 29, 4, 5)),
+                    (38, datetime(2020, 3, 1, 4, 5)),
+                ]
+            )
+        self.assertEqual(expirations, [date(2021, 2, 28), date(2021, 3, 1)])
+        self.cursor.executemany.assert_called_once()
+        self.cursor.execute.assert_not_called()
+        self.conn.commit.assert_called_once()
+
+    def test_duplicate_membership(self):
+        """Duplicates are ignored by a unique key, and nothing is committed."""
+        self.cursor.fetchall.return_value = [(37, 'MIT undergrad', None)]
+        self.cursor.rowcount = 0
+        with self.assertRaises(errors.AlreadyInserted):
+            with db.transaction():
+                db.add_membership(37, '15.00', datetime(2018, 1, 1, 17, 47), 'MU')
+        sql = self.executed_sql()
+        self.assertEqual(len(sql), 2)  # No separate check for an existing row
+        self.assertIn('on duplicate key update id = id', sql[1])
+        self.conn.commit.assert_not_called()
+
+    def test_duplicate_legacy_membership(self):
+        """Payments recorded before `paid_on` existed are still duplicates."""
+        self.cursor.fetchall.return_value = [(37, 'MIT undergrad', date(2019, 1, 1))]
+        self.cursor.rowcount = 0  # A null-`paid_on` row expires on the same day
+        with self.assertRaises(errors.AlreadyInserted):
+            with db.transaction():
+                db.add_membership(37, '15.00', datetime(2018, 1, 1, 17, 47), 'MU')
+
+        statement, params = self.cursor.execute.call_args[0]
+        self.assertIn('paid_on is null', statement)
+        self.assertEqual(params['legacy_expires'], [date(2019, 1, 1)])
+        self.conn.commit.assert_not_called()
+
+    def test_duplicate_waivers(self):
+        self.cursor.rowcount = 1  # Only one of the two was new
+        with self.assertRaises(errors.AlreadyInserted):
+            with db.transaction():
+                db.add_waivers(
+                    [
+                        (37, datetime(2018, 11, 10, 23, 41)),
+                        (38, datetime(2018, 11, 10, 23, 41)),
+                    ]
+                )
+        self.conn.rollback.assert_called_once()
+
+    def test_existing_person(self):
+        """Creating a person who already exists returns their ID."""
+        self.cursor.rowcount = 0
+        self.cursor.lastrowid = 37  # From `last_insert_id(id)`
+        self.cursor.fetchall.return_value = [(37, 'MIT undergrad', date(2019, 1, 1))]
+        with db.transaction():
+            self.assertEqual(db.add_person('Tim', 'Beaver', 'tim@mit.edu'), 37)
+            # What's known about the existing person is not assumed
+            self.assertEqual(db.current_membership_expires(37), date(2019, 1, 1))
+
+    def test_already_added_waivers(self):
+        self.cursor.fetchall.return_value = [(37, date(2018, 11, 10))]
+        already_added = db.already_added_waivers(
+            [
+                (37, datetime(2018, 11, 10, 23, 41)),
+                (37, datetime(2018, 11, 11, 0, 2)),
+                (38, datetime(2018, 11, 10, 23, 41)),
+            ]
+        )
+        self.assertEqual(already_added, [True, False, False])
+        self.cursor.execute.assert_called_once()
+
+    def test_expirations_for(self):
+        """Expirations for many emails are read at once, then cached."""
+        self.cursor.fetchall.side_effect = [
+            [('tim@mit.edu', 37, None, None, 1, date(2019, 1, 15))],
+            [(37, date(2019, 1, 15), date(2018, 6, 1))],
+        ]
+        with db.transaction():
+            tim, nobody = db.expirations_for(['Tim@mit.edu', 'nobody@example.com'])
+        self.assertEqual(
+            (tim.person_id, tim.membership_expires, tim.waiver_expires),
+            (37, date(2019, 1, 15), date(2018, 6, 1)),
+        )
+        self.assertEqual((nobody.person_id, nobody.membership_expires), (None, None))
+        self.assertEqual(self.cursor.execute.call_count, 2)
+
+        with db.transaction():
+            self.assertEqual(db.expirations_for(['tim@mit.edu']), [tim])
+        self.assertEqual(self.cursor.execute.call_count, 2)
+
+        # Writing to Tim means his expirations must be read again
+        with db.transaction():
+            db.add_waiver(37, datetime(2018, 11, 10, 23, 41))
+        self.assertIsNone(db.status_cache.get('tim@mit.edu'))
+        self.assertIsNotNone(db.status_cache.get('nobody@example.com'))
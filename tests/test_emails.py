@@ -1,31 +1,39 @@
+import threading
+import time
 import unittest
 from contextlib import contextmanager
 from datetime import datetime
-from http.client import HTTPResponse
 from unittest import mock
+from urllib.error import HTTPError, URLError
 
 import jwt
 
+from member import extensions, trips_api
 from member.app import create_app
-from member.emails import other_verified_emails, update_membership
+from member.emails import (
+    VerifiedEmails,
+    VerifiedEmailsCache,
+    other_verified_emails,
+    update_membership,
+)
 
 
-class UrlopenHelpers(unittest.TestCase):
-    """Provide some helpers to mocking `urlopen`.
+class TripsClientHelpers(unittest.TestCase):
+    """Provide some helpers to mocking requests to mitoc-trips.
 
     This service aims to be as small as possible, so we don't have `requests`.
     We just instead use the standard library!
     """
 
     def setUp(self):
-        self.urlopen_patcher = unittest.mock.patch('member.emails.urlopen')
-        self.urlopen = self.urlopen_patcher.start()
+        self.request_patcher = mock.patch.object(extensions.trips_client, 'request')
+        self.request = self.request_patcher.start()
 
         self.app = create_app()
         self.app.config['MEMBERSHIP_SECRET_KEY'] = 'secret-key'
 
     def tearDown(self):
-        self.urlopen_patcher.stop()
+        self.request_patcher.stop()
 
     @contextmanager
     def expect_request(self, expected_url, expected_payload, method='POST'):
@@ -33,27 +41,26 @@ class UrlopenHelpers(unittest.TestCase):
 
         Yields a mocked response that the caller can use to tweak as they see fit.
         """
-        response = mock.MagicMock(spec=HTTPResponse)
+        response = mock.Mock()
 
         with self.app.app_context():
-            self.urlopen.side_effect = self._inspect(
+            self.request.side_effect = self._inspect(
                 expected_url, expected_payload, method, response
             )
             yield response
 
         # `_inspect()` will make sure called args were correct.
         # However, we need to make sure it was called at least once!
-        self.urlopen.assert_called_once()
+        self.request.assert_called_once()
 
-    def _inspect(self, expected_url, expected_payload, method, response=None):
+    def _inspect(self, expected_url, expected_payload, method, response):
         """Ensure that the request to `mitoc-trips` is properly formed."""
 
-        @contextmanager
-        def inspect(request):
-            self.assertEqual(request.method, method)
-            self.assertEqual(request.full_url, expected_url)
+        def inspect(request_method, path, headers):
+            self.assertEqual(request_method, method)
+            self.assertEqual(self.app.config['TRIPS_API_URL'] + path, expected_url)
 
-            authorization = request.get_header('Authorization')
+            authorization = headers['Authorization']
             self.assertTrue(authorization.startswith('Bearer: '))
             _, token = authorization.split()
             payload = jwt.decode(
@@ -64,12 +71,33 @@ class UrlopenHelpers(unittest.TestCase):
             payload.pop('exp')  # This claim changes dynamically, we needn't test here
             self.assertEqual(payload, expected_payload)
 
-            yield response or mock.MagicMock(spec=HTTPResponse)
+            return response.read()
 
         return inspect
 
 
-class UpdateMembershipTests(UrlopenHelpers, unittest.TestCase):
+class BearerTokenTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['MEMBERSHIP_SECRET_KEY'] = 'secret-key'
+        trips_api.token_cache.clear()
+
+    def test_token_reused(self):
+        """Tokens for the same claims are only signed once (until near expiry)."""
+        with self.app.app_context(), mock.patch.object(
+            trips_api.jwt, 'encode', wraps=jwt.encode
+        ) as encode:
+            first = trips_api.bearer_jwt(email='tim@mit.edu')
+            self.assertEqual(trips_api.bearer_jwt(email='tim@mit.edu'), first)
+            self.assertNotEqual(trips_api.bearer_jwt(email='bob@mit.edu'), first)
+
+            # A new secret means new tokens
+            self.app.config['MEMBERSHIP_SECRET_KEY'] = 'rotated-key'
+            self.assertNotEqual(trips_api.bearer_jwt(email='tim@mit.edu'), first)
+        self.assertEqual(encode.call_count, 3)
+
+
+class UpdateMembershipTests(TripsClientHelpers, unittest.TestCase):
     def test_update_membership(self):
         """When updating just a membership, we send that via JWT."""
         expires = datetime(2018, 9, 24).date()
@@ -93,7 +121,7 @@ class UpdateMembershipTests(UrlopenHelpers, unittest.TestCase):
         self.assertEqual(ret, {})
 
 
-class OtherVerifiedEmailsTests(UrlopenHelpers, unittest.TestCase):
+class OtherVerifiedEmailsTests(TripsClientHelpers, unittest.TestCase):
     def test_fetch_verified_emails(self):
         with self.expect_request(
             'https://mitoc-trips.mit.edu/data/verified_emails/',
@@ -105,3 +133,81 @@ class OtherVerifiedEmailsTests(UrlopenHelpers, unittest.TestCase):
 
         self.assertEqual(primary, 'tim@mit.edu')
         self.assertEqual(all_emails, ['tim@mit.edu', 'tim@csail.mit.edu'])
+
+    def test_cached(self):
+        """Verified emails are cached, for any of the person's emails."""
+        with self.expect_request(
+            'https://mitoc-trips.mit.edu/data/verified_emails/',
+            {'email': 'tim@mit.edu'},
+            method='GET',
+        ) as response:
+            response.read.return_value = '{"primary": "tim@mit.edu", "emails": ["tim@mit.edu", "Tim@csail.mit.edu"]}'
+            first = other_verified_emails('tim@mit.edu')
+            self.assertEqual(other_verified_emails(' TIM@mit.edu'), first)
+            self.assertEqual(other_verified_emails('tim@csail.mit.edu'), first)
+
+
+class VerifiedEmailsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.cache = VerifiedEmailsCache()
+        self.cache.configure(maxsize=10, ttl=60, negative_ttl=5, max_stale=0)
+        self.fetch = mock.Mock(
+            side_effect=lambda email: VerifiedEmails(email, [email, 'tim@alum.mit.edu'])
+        )
+
+    def test_hit_ratio(self):
+        def slow_fetch(email):
+            time.sleep(0.01)
+            return VerifiedEmails(email, [email])
+
+        self.fetch.side_effect = slow_fetch
+        for _ in range(4):
+            self.cache.get('tim@mit.edu', self.fetch)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats.lookups, 1)
+        self.assertEqual(stats.cache.hit_ratio, 0.75)
+        self.assertAlmostEqual(stats.saved_seconds, 3 * stats.lookup_seconds)
+
+    def test_negative(self):
+        """Refused lookups are cached briefly; errors reaching mitoc-trips are not."""
+        self.fetch.side_effect = HTTPError(
+            'https://trips', 404, 'Not Found', None, None
+        )
+        with mock.patch('time.monotonic', return_value=1000):
+            for _ in range(2):
+                with self.assertRaises(HTTPError) as cm:
+                    self.cache.get('nobody@example.com', self.fetch)
+                self.assertEqual(cm.exception.code, 404)
+        self.assertEqual(self.fetch.call_count, 1)
+
+        with mock.patch('time.monotonic', return_value=1006):
+            with self.assertRaises(HTTPError):
+                self.cache.get('nobody@example.com', self.fetch)
+        self.assertEqual(self.fetch.call_count, 2)
+
+        self.fetch.side_effect = URLError('Oh no')
+        for _ in range(2):
+            with self.assertRaises(URLError):
+                self.cache.get('tim@mit.edu', self.fetch)
+        self.assertEqual(self.fetch.call_count, 4)
+
+    def test_stale_while_revalidate(self):
+        self.cache.max_stale = 3600
+        with mock.patch('time.monotonic', return_value=1000):
+            self.cache.get('tim@mit.edu', self.fetch)
+
+        self.fetch.side_effect = lambda email: VerifiedEmails(email, [email])
+        with self.app.app_context(), mock.patch.object(
+            threading, 'Thread'
+        ) as thread, mock.patch('time.monotonic', return_value=2000):
+            stale = self.cache.get('tim@mit.edu', self.fetch)
+            self.assertEqual(stale.all_emails, ['tim@mit.edu', 'tim@alum.mit.edu'])
+            self.cache.get('tim@mit.edu', self.fetch)  # Already refreshing
+
+            thread.assert_called_once()
+            thread.call_args[1]['target']()  # Refresh (as the thread would)
+            fresh = self.cache.get('tim@mit.edu', self.fetch)
+        self.assertEqual(fresh.all_emails, ['tim@mit.edu'])
+        self.assertEqual(self.cache.stats().refreshes, 1)
@@ -1,10 +1,15 @@
+import io
+import tracemalloc
 import unittest
+import xml.etree.ElementTree as ET
 from contextlib import contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 from unittest import mock
+from xml.etree import ElementPath
 
-from member import envelopes
+from benchmarks import envelope_generator
+from member import envelopes, errors
 
 dir_path = Path(__file__).resolve().parent
 
@@ -102,24 +107,188 @@ class TestWaiverParser(unittest.TestCase):
 
     @mock.patch('member.envelopes.CompletedEnvelope._get_hours_offset')
     def test_offset(self, hours_offset):
-        """The offset is applied in hours from UTC."""
+        """The offset is applied in hours from UTC.
+
+        (The time signed is cached, so each offset needs its own envelope)
+        """
         time_signed = datetime(2018, 11, 10, 18, 41, 6, 937000)
 
         hours_offset.return_value = '0'
-        self.assertEqual(time_signed, self.env.time_signed.replace(tzinfo=None))
+        self.assertEqual(time_signed, load_envelope().time_signed.replace(tzinfo=None))
 
         # Offsets work in both directions
         hours_offset.return_value = '+2'
         self.assertEqual(
             datetime(2018, 11, 10, 16, 41, 6, 937000),
-            self.env.time_signed.replace(tzinfo=None),
+            load_envelope().time_signed.replace(tzinfo=None),
         )
         hours_offset.return_value = '-5'
         self.assertEqual(
             datetime(2018, 11, 10, 23, 41, 6, 937000),
-            self.env.time_signed.replace(tzinfo=None),
+            load_envelope().time_signed.replace(tzinfo=None),
         )
 
     def test_releasor_email(self):
         """The releasor's email is parsed out."""
         self.assertEqual(self.env.releasor_email, 'tim@mit.edu')
+
+    def test_warm_up(self):
+        """Once warmed up, reading an envelope compiles no new XPaths."""
+        # pylint: disable=protected-access
+        with mock.patch.dict(ElementPath._cache, clear=True):
+            envelopes.CompletedEnvelope.warm_up()
+            compiled = set(ElementPath._cache)
+            self.assertTrue(compiled)
+
+            streamed = envelopes.CompletedEnvelope.from_stream(io.BytesIO(with_pdf(0)))
+            for env in [load_envelope(), streamed]:
+                for field in ['completed', 'time_signed', 'first_name', 'affiliation']:
+                    getattr(env, field)
+            self.assertEqual(set(ElementPath._cache), compiled)
+
+    def test_tabs_indexed_once(self):
+        """All tabs are read in one pass, however many fields are used."""
+        # pylint: disable=protected-access
+        env = load_envelope()
+        with mock.patch.object(
+            env, '_all_tab_statuses', wraps=env._all_tab_statuses
+        ) as all_tab_statuses:
+            for _ in range(2):
+                self.assertEqual(env.first_name, 'Tim')
+                self.assertEqual(env.last_name, 'Beaver')
+                self.assertEqual(env.releasor_email, 'tim@mit.edu')
+                with self.assertRaises(ValueError):
+                    env.tab_status("This tab does not exist")
+        all_tab_statuses.assert_called_once()
+
+
+def with_pdf(pdf_size, filename='completed_waiver.xml'):
+    """Return the envelope's XML, including a (fake) PDF of the given size."""
+    xml = (dir_path / filename).read_bytes()
+    pdf = (
+        b'<DocumentPDFs><DocumentPDF><Name>waiver.pdf</Name><PDFBytes>'
+        + b'A' * pdf_size
+        + b'</PDFBytes></DocumentPDF></DocumentPDFs>'
+    )
+    return xml.replace(b'<TimeZone>', pdf + b'<TimeZone>', 1)
+
+
+class TestStreamedEnvelope(unittest.TestCase):
+    def test_same_fields(self):
+        """Fields are identical whether or not the envelope is streamed."""
+        xml = with_pdf(10_000)
+        env = envelopes.CompletedEnvelope(xml)
+        streamed = envelopes.CompletedEnvelope.from_stream(io.BytesIO(xml), 128)
+        for field in [
+            'completed',
+            'releasor_email',
+            'first_name',
+            'last_name',
+            'time_signed',
+            'affiliation',
+        ]:
+            self.assertEqual(getattr(streamed, field), getattr(env, field))
+        self.assertEqual(
+            streamed.tab_status('Phone number'), env.tab_status('Phone number')
+        )
+        with self.assertRaises(ValueError):
+            streamed.tab_status("This tab does not exist")
+
+    def test_pdfs_not_kept(self):
+        """Memory use doesn't grow with the size of embedded PDFs."""
+        peaks = []
+        for pdf_size in [1_000, 10_000_000]:
+            stream = io.BytesIO(with_pdf(pdf_size))
+            tracemalloc.start()
+            envelopes.CompletedEnvelope.from_stream(stream)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.assertLess(peaks[1], peaks[0] + 256 * 1024)
+
+    def test_stops_reading(self):
+        """Nothing after the last element we need is read."""
+        stream = io.BytesIO(with_pdf(0).replace(b'</DocuSign', b'<Unclosed><DocuSign'))
+        env = envelopes.CompletedEnvelope.from_stream(stream, chunk_size=64)
+        self.assertTrue(env.completed)
+
+    def test_incomplete(self):
+        truncated = (dir_path / 'completed_waiver.xml').read_bytes()[:5000]
+        with self.assertRaises(ET.ParseError):
+            envelopes.CompletedEnvelope.from_stream(io.BytesIO(truncated))
+
+    def test_wrong_document(self):
+        stream = io.BytesIO(
+            b'<WrongRootElement><UserName>Bob</UserName></WrongRootElement>'
+        )
+        with self.assertRaises(ValueError):
+            envelopes.CompletedEnvelope.from_stream(stream)
+
+    def test_too_large(self):
+        """Documents of unknown length are refused once too much has been read."""
+        stream = io.BytesIO(with_pdf(100_000))
+        limits = envelopes.ParseLimits(max_bytes=50_000)
+        with self.assertRaises(errors.DocumentTooLarge):
+            envelopes.CompletedEnvelope.from_stream(stream, limits=limits)
+        self.assertLess(stream.tell(), 50_000 + envelopes.CHUNK_SIZE)
+
+    def test_quadratic_blowup(self):
+        """Even where entities are allowed, they may not expand too much."""
+        entity = 'x' * 10_000
+        xml = (
+            f'<!DOCTYPE blowup [<!ENTITY x "{entity}">]>'
+            f'<DocuSignEnvelopeInformation>{"&x;" * 1000}</DocuSignEnvelopeInformation>'
+        )
+        limits = envelopes.ParseLimits(max_entities=1)
+        with self.assertRaises(errors.UnsafeDocument):
+            envelopes.CompletedEnvelope.from_stream(
+                io.BytesIO(xml.encode()), limits=limits
+            )
+
+
+class TestGeneratedEnvelope(unittest.TestCase):
+    """Synthetic envelopes (for benchmarks) parse just like real ones."""
+
+    @staticmethod
+    def both(xml: bytes):
+        return (
+            envelopes.CompletedEnvelope(xml.decode()),
+            envelopes.CompletedEnvelope.from_stream(io.BytesIO(xml), 128),
+        )
+
+    def test_fields(self):
+        xml = envelope_generator.generate_envelope(
+            name='Tim Beaver', email='tim@mit.edu', affiliation='MIT alum'
+        )
+        utc_time_signed = datetime(2018, 11, 10, 23, 41, 6, 937000, tzinfo=timezone.utc)
+        for env in self.both(xml):
+            self.assertTrue(env.completed)
+            self.assertEqual(env.first_name, 'Tim')
+            self.assertEqual(env.last_name, 'Beaver')
+            self.assertEqual(env.releasor_email, 'tim@mit.edu')
+            self.assertEqual(env.affiliation, 'MIT alum')
+            self.assertEqual(env.time_signed, utc_time_signed)
+
+    def test_timestamp_formats(self):
+        """Timestamps may be given with or without microseconds."""
+        xml = envelope_generator.generate_envelope(microseconds=False)
+        self.assertIn(b'<Completed>2018-11-10T18:41:06</Completed>', xml)
+        for env in self.both(xml):
+            self.assertEqual(
+                env.time_signed, datetime(2018, 11, 10, 23, 41, 6, tzinfo=timezone.utc)
+            )
+
+    def test_shape(self):
+        xml = envelope_generator.generate_envelope(
+            recipients=5, tabs=200, pdf_bytes=40_000
+        )
+        env = envelopes.CompletedEnvelope(xml.decode())
+        selector = env.recipient_status + ['TabStatuses', 'TabStatus']
+        self.assertEqual(len(env.get_element(env.recipient_status, findall=True)), 5)
+        self.assertEqual(len(env.get_element(selector, findall=True)), 200)
+        pdf = env.get_element(['DocumentPDFs', 'DocumentPDF', 'PDFBytes'])
+        self.assertEqual(len(pdf.text), 40_000)
+
+    def test_incomplete(self):
+        env, streamed = self.both(envelope_generator.generate_envelope(completed=False))
+        self.assertFalse(env.completed)
+        self.assertFalse(streamed.completed)
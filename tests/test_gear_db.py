@@ -0,0 +1,118 @@
+import unittest
+from datetime import date, datetime
+
+from benchmarks import gear_db
+from member import db
+from member.app import create_app
+from member.errors import AlreadyInserted
+
+from .utils import use_connection
+
+PAID = datetime(2018, 5, 17, 19, 20, 30)
+
+
+class IdempotentWriteTests(unittest.TestCase):
+    """Duplicate webhooks are ignored by the unique keys our migrations add.
+
+    These tests require a scratch MySQL database (see `benchmarks.gear_db`).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = gear_db.connect_from_env()
+        if cls.conn is None:
+            raise unittest.SkipTest("TEST_GEAR_DATABASE_HOST is not configured")
+        gear_db.create_tables(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        gear_db.drop_tables(cls.conn)
+        cls.conn.close()
+
+    def setUp(self):
+        with self.conn.cursor() as cursor:
+            for ddl in gear_db.TABLES:
+                cursor.execute(f'truncate table {ddl.split()[2]}')
+
+        use_connection(self, self.conn)
+        context = create_app().app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    def count(self, table: str) -> int:
+        with self.conn.cursor() as cursor:
+            cursor.execute(f'select count(*) from {table}')
+            return cursor.fetchone()[0]
+
+    def add_person(self) -> int:
+        with db.transaction():
+            return db.add_person('Tim', 'Beaver', 'tim@mit.edu')
+
+    def test_person_added_once(self):
+        """A concurrent duplicate gets the very same person."""
+        person_id = self.add_person()
+        self.assertEqual(self.add_person(), person_id)
+        self.assertEqual(self.count('people'), 1)
+
+    def test_membership_once_per_day(self):
+        person_id = self.add_person()
+        with db.transaction():
+            db.add_membership(person_id, '15.00', PAID, 'MU')
+
+        with self.assertRaises(AlreadyInserted):
+            with db.transaction():
+                db.add_membership(person_id, '15.00', PAID.replace(hour=23), 'MU')
+        self.assertEqual(self.count('people_memberships'), 1)
+
+        with db.transaction():
+            db.add_membership(person_id, '15.00', PAID.replace(day=18), 'MU')
+        self.assertEqual(self.count('people_memberships'), 2)
+
+    def test_legacy_membership(self):
+        """Memberships from before `paid_on` are recognized by when they expire."""
+        person_id = self.add_person()
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                insert into people_memberships
+                       (person_id, price_paid, membership_type, expires)
+                values (%s, 15, 'MU', %s)
+                ''',
+                [person_id, date(2019, 5, 17)],
+            )
+        self.conn.commit()
+
+        with self.assertRaises(AlreadyInserted):
+            with db.transaction():
+                db.add_membership(person_id, '15.00', PAID, 'MU')
+        self.assertEqual(self.count('people_memberships'), 1)
+
+    def test_waiver_once_per_day(self):
+        person_id = self.add_person()
+        with db.transaction():
+            db.add_waiver(person_id, PAID)
+
+        with self.assertRaises(AlreadyInserted):
+            with db.transaction():
+                db.add_waiver(person_id, PAID.replace(hour=23))
+        self.assertEqual(self.count('people_waivers'), 1)
+
+    def test_people_to_update(self):
+        """Accounts are found by their primary or any alternate email."""
+        person_id = self.add_person()
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                insert into geardb_peopleemails (person_id, alternate_email)
+                values (%s, 'tim@alum.mit.edu')
+                ''',
+                [person_id],
+            )
+        self.conn.commit()
+
+        self.assertEqual(
+            db.people_to_update(
+                [['tim@mit.edu'], ['tim@alum.mit.edu'], ['bob@mit.edu']]
+            ),
+            [person_id, person_id, None],
+        )
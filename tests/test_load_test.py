@@ -0,0 +1,43 @@
+import contextlib
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from benchmarks import load_test
+
+
+class LoadTestTests(unittest.TestCase):
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(load_test.percentile(values, 50), 50)
+        self.assertEqual(load_test.percentile(values, 99), 99)
+        self.assertEqual(load_test.percentile([3.0], 95), 3)
+        self.assertEqual(load_test.percentile([], 50), 0)
+
+    @mock.patch.dict('os.environ', {'TEST_GEAR_DATABASE_HOST': ''})
+    def test_against_stand_ins(self):
+        """Both webhooks succeed against the stand-ins, with errors counted."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = Path(tmpdir) / 'results.json'
+            with contextlib.redirect_stdout(io.StringIO()):
+                load_test.main(
+                    [
+                        '--rate=200',
+                        '--duration=0.25',
+                        '--members=10',
+                        '--trips-latency=0',
+                        '--db-latency=0',
+                        f'--output={output}',
+                    ]
+                )
+            results = json.loads(output.read_text())['results']
+
+        self.assertEqual(sorted(results), ['membership', 'waiver'])
+        self.assertEqual(sum(r['requests'] for r in results.values()), 50)
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+            self.assertEqual(list(result['statuses']), ['201'])
+            self.assertLessEqual(result['p50'], result['p99'])
@@ -0,0 +1,134 @@
+import unittest
+from unittest import mock
+
+from benchmarks.envelope_generator import generate_envelope
+from member import extensions, metrics
+from member.app import create_app
+from member.cache import TTLCache
+from member.public import views
+
+from .utils import create_app_with_env_vars
+
+
+class HistogramTests(unittest.TestCase):
+    def test_cumulative(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1))
+        for seconds in [0.05, 0.1, 0.5, 3]:
+            histogram.observe(seconds)
+        self.assertEqual(
+            list(histogram.cumulative()), [('0.1', 2), ('1', 3), ('+Inf', 4)]
+        )
+        self.assertAlmostEqual(histogram.sum, 3.65)
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.metrics = metrics.Metrics()  # (Fresh, so counts start at zero)
+        with mock.patch.object(extensions, 'metrics', self.metrics):
+            self.app = create_app()
+        self.client = self.app.test_client()
+
+    @mock.patch.object(views, 'other_verified_emails')
+    @mock.patch.object(views, '_inform_trips')
+    @mock.patch.object(views, 'db')
+    def test_waiver_phases(self, db, _inform_trips, other_verified_emails):
+        """Each phase of handling a waiver is timed."""
+        other_verified_emails.return_value = ('tim@mit.edu', ['tim@mit.edu'])
+        db.add_waiver.return_value = (37, None)
+        db.person_to_update.return_value = 37
+
+        response = self.client.post('/members/waiver', data=generate_envelope())
+        self.assertEqual(response.status_code, 201)
+
+        timings = response.headers['Server-Timing'].split(', ')
+        self.assertEqual(
+            [timing.split(';')[0] for timing in timings],
+            [
+                'parse',
+                'verified_emails',
+                'person_to_update',
+                'add_waiver',
+                'update_affiliation',
+                'trips',
+                'total',
+            ],
+        )
+
+        report = self.client.get('/metrics').data.decode()
+        self.assertIn(
+            'member_requests_total{endpoint="public.add_waiver",method="POST",'
+            'status="201"} 1',
+            report,
+        )
+        self.assertIn(
+            'member_phase_duration_seconds_count{endpoint="public.add_waiver",'
+            'phase="parse"} 1',
+            report,
+        )
+        self.assertIn(
+            'member_request_duration_seconds_bucket{endpoint="public.add_waiver",'
+            'le="+Inf"} 1',
+            report,
+        )
+        self.assertIn(
+            'member_db_queries_per_request_count{endpoint="public.add_waiver"} 1',
+            report,
+        )
+        self.assertIn('member_db_pool_checkouts_total 0', report)
+        self.assertIn('member_trips_requests_total 0', report)
+
+    def test_counts_by_status(self):
+        """Requests are counted by status, including those with no phases."""
+        for _ in range(2):
+            response = self.client.get('/members/status?email=tim@mit.edu')
+            self.assertEqual(response.status_code, 401)
+            self.assertRegex(response.headers['Server-Timing'], r'^total;dur=[\d.]+$')
+
+        report = self.client.get('/metrics').data.decode()
+        self.assertIn(
+            'member_requests_total{endpoint="public.membership_status",'
+            'method="GET",status="401"} 2',
+            report,
+        )
+        self.assertNotIn('phase="', report)
+
+    def test_queries(self):
+        """Statements sent to the database are counted for each endpoint."""
+        conn = mock.Mock()
+        conn.cursor.return_value.rowcount = 1
+        conn.cursor.return_value.fetchall.return_value = []
+
+        @self.app.route('/lookup')
+        def lookup():  # pylint: disable=unused-variable
+            views.db.person_to_update('tim@mit.edu', ['tim@mit.edu'])
+            views.db.expirations_for(['tim@mit.edu', 'tim@csail.mit.edu'])
+            return ''
+
+        with mock.patch.multiple(
+            views.db,
+            get_db=mock.Mock(return_value=conn),
+            person_cache=TTLCache(),
+            status_cache=TTLCache(),
+        ):
+            self.client.get('/lookup')
+
+        report = self.client.get('/metrics').data.decode()
+        self.assertIn(
+            'member_db_queries_per_request_bucket{endpoint="lookup",le="1"} 0', report
+        )
+        self.assertIn(
+            'member_db_queries_per_request_bucket{endpoint="lookup",le="2"} 1', report
+        )
+        self.assertIn('member_db_rows_total{endpoint="lookup"} 2', report)
+
+    def test_server_timing_disabled(self):
+        self.metrics.server_timing = False
+        response = self.client.get('/members/status?email=tim@mit.edu')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_disabled(self):
+        app = create_app_with_env_vars({'METRICS_ENABLED': 'false'})
+        client = app.test_client()
+        self.assertEqual(client.get('/metrics').status_code, 404)
+        response = client.get('/members/status?email=tim@mit.edu')
+        self.assertNotIn('Server-Timing', response.headers)
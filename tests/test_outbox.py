@@ -0,0 +1,97 @@
+import unittest
+from datetime import date
+from unittest import mock
+from urllib.error import URLError
+
+from member import outbox
+from member.app import create_app
+
+from .utils import start_patchers, use_sqlite_file
+
+
+class OutboxTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TRIPS_OUTBOX_COALESCE_SECONDS'] = 0
+        self.outbox = use_sqlite_file(self, outbox.Outbox(), 'TRIPS_OUTBOX_PATH')
+        (self.update_membership,) = start_patchers(
+            self, mock.patch.object(outbox, 'update_membership')
+        )
+
+    def test_coalesced(self):
+        """Updates for the same email are sent together, with the latest dates."""
+        self.outbox.append('tim@mit.edu', membership_expires=date(2019, 1, 15))
+        self.outbox.append('tim@mit.edu', waiver_expires=date(2019, 11, 10))
+        self.outbox.append('tim@mit.edu', membership_expires=date(2018, 1, 15))
+        self.outbox.append('bob@mit.edu', waiver_expires=date(2019, 3, 1))
+        self.assertEqual(self.outbox.pending(), 2)
+
+        self.assertEqual(self.outbox.deliver_due(), (2, 0))
+        self.update_membership.assert_has_calls(
+            [
+                mock.call(
+                    'tim@mit.edu',
+                    membership_expires=date(2019, 1, 15),
+                    waiver_expires=date(2019, 11, 10),
+                ),
+                mock.call(
+                    'bob@mit.edu',
+                    membership_expires=None,
+                    waiver_expires=date(2019, 3, 1),
+                ),
+            ],
+            any_order=True,
+        )
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_not_yet_due(self):
+        """Updates wait for the coalescing window to pass."""
+        self.outbox.coalesce_seconds = 60
+        self.outbox.append('tim@mit.edu', membership_expires=date(2019, 1, 15))
+        self.assertEqual(self.outbox.deliver_due(), (0, 0))
+        self.assertEqual(self.outbox.pending(), 1)
+
+    def test_failed(self):
+        """Failed updates are kept, and retried after a backoff."""
+        self.update_membership.side_effect = URLError('Oh no')
+        self.outbox.append('tim@mit.edu', membership_expires=date(2019, 1, 15))
+
+        self.assertEqual(self.outbox.deliver_due(), (0, 1))
+        self.assertEqual(self.outbox.pending(), 1)
+        self.assertEqual(self.outbox.deliver_due(), (0, 0))  # Backing off
+
+        with mock.patch.object(outbox.time, 'time', return_value=2e9):
+            (update,) = self.outbox.claim(10)
+        self.assertEqual(update.attempts, 1)
+
+    def test_updated_during_delivery(self):
+        """An update appended while delivering an earlier one is not lost."""
+
+        def append_another(*_args, **_kwargs):
+            self.outbox.append('tim@mit.edu', waiver_expires=date(2019, 11, 10))
+
+        self.update_membership.side_effect = append_another
+        self.outbox.append('tim@mit.edu', membership_expires=date(2019, 1, 15))
+        self.assertEqual(self.outbox.deliver_due(), (1, 0))
+        self.assertEqual(self.outbox.pending(), 1)
+
+        self.update_membership.side_effect = None
+        self.assertEqual(self.outbox.deliver_due(), (1, 0))
+        self.update_membership.assert_called_with(
+            'tim@mit.edu',
+            membership_expires=date(2019, 1, 15),
+            waiver_expires=date(2019, 11, 10),
+        )
+        self.assertEqual(self.outbox.pending(), 0)
+
+    def test_claimed(self):
+        """Claimed updates are not delivered twice (until the lease ends)."""
+        self.outbox.append('tim@mit.edu', membership_expires=date(2019, 1, 15))
+        self.assertEqual(len(self.outbox.claim(10)), 1)
+        self.assertEqual(self.outbox.claim(10), [])
+
+    def test_drain_command(self):
+        self.outbox.append('tim@mit.edu', membership_expires=date(2019, 1, 15))
+        result = self.app.test_cli_runner().invoke(args=['drain-outbox'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Delivered 1 updates (0 failed), 0 pending', result.output)
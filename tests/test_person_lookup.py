@@ -0,0 +1,115 @@
+import random
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from benchmarks import gear_db
+from member import db
+from member.app import create_app
+
+
+class PersonToUpdateEquivalenceTests(unittest.TestCase):
+    """Ensure that `person_to_update()` agrees with the original fan-out query.
+
+    These tests require a scratch MySQL database (see `benchmarks.gear_db`).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = gear_db.connect_from_env()
+        if cls.conn is None:
+            raise unittest.SkipTest("TEST_GEAR_DATABASE_HOST is not configured")
+        gear_db.create_tables(cls.conn)
+        cls.emails = cls._seed(random.Random(4321))
+
+    @classmethod
+    def tearDownClass(cls):
+        gear_db.drop_tables(cls.conn)
+        cls.conn.close()
+
+    @classmethod
+    def _seed(cls, rand):
+        """Seed a few hundred people, some sharing emails and some with no history."""
+        today = date.today()
+        emails = [f'person{i}@example.com' for i in range(120)]
+        with cls.conn.cursor() as cursor:
+            for i in range(300):
+                # Primary emails are unique, but accounts share alternate emails
+                cursor.execute(
+                    '''
+                    insert into people (firstname, lastname, email)
+                    values ('First', 'Last', %s)
+                    ''',
+                    [f'person{i}@example.com'],
+                )
+                person_id = cursor.lastrowid
+                for _ in range(rand.randint(0, 3)):
+                    cursor.execute(
+                        '''
+                        insert into geardb_peopleemails (person_id, alternate_email)
+                        values (%s, %s)
+                        ''',
+                        [person_id, rand.choice(emails)],
+                    )
+                for _ in range(rand.choice([0, 0, 1, 3, 8])):
+                    cursor.execute(
+                        '''
+                        insert into people_memberships
+                               (person_id, price_paid, membership_type, expires)
+                        values (%s, 15, 'MU', %s)
+                        ''',
+                        [person_id, today + timedelta(days=rand.randint(-3000, 365))],
+                    )
+                for _ in range(rand.choice([0, 1, 2, 6])):
+                    cursor.execute(
+                        '''
+                        -- (At most one waiver may be signed per day)
+                        insert ignore into people_waivers
+                               (person_id, date_signed, expires)
+                        values (%(id)s, date_sub(%(expires)s, interval 1 year),
+                                %(expires)s)
+                        ''',
+                        {
+                            'id': person_id,
+                            'expires': datetime.now()
+                            + timedelta(hours=rand.randint(-70000, 8760)),
+                        },
+                    )
+        return emails
+
+    def _legacy_ranking(self, all_emails):
+        """Return the ranking key of the first account the legacy query gives."""
+        with self.conn.cursor() as cursor:
+            cursor.execute(gear_db.LEGACY_PERSON_TO_UPDATE, {'all_emails': all_emails})
+            row = cursor.fetchone()
+        return row and self._ranking(row[0])
+
+    def _ranking(self, person_id):
+        """Return the values the lookup orders by, so ties can be compared."""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                '''
+                select greatest(
+                         coalesce((select max(expires) from people_memberships
+                                    where person_id = %(id)s), from_unixtime(0)),
+                         coalesce((select max(expires) from people_waivers
+                                    where person_id = %(id)s), from_unixtime(0)))
+                ''',
+                {'id': person_id},
+            )
+            return cursor.fetchone()[0]
+
+    def test_same_result_as_legacy_query(self):
+        rand = random.Random(1234)
+        email_sets = [[email] for email in self.emails]
+        email_sets.extend(rand.sample(self.emails, k) for k in [2, 3, 5] * 40)
+        email_sets.append(['nobody@example.com'])  # Not found at all
+
+        with create_app().app_context(), mock.patch.object(
+            db, 'get_db', return_value=self.conn
+        ):
+            for all_emails in email_sets:
+                person_id = db.person_to_update(all_emails[0], all_emails)
+                expected = self._legacy_ranking(all_emails)
+                # Accounts with identical history may come back in either order
+                self.assertEqual(person_id and self._ranking(person_id), expected)
@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+from member.errors import PoolTimeout
+from member.pool import ConnectionPool
+
+
+def fake_connection():
+    conn = mock.Mock(spec=pymysql.connections.Connection)
+    conn.open = True
+    conn.server_status = SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+    return conn
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.connect = mock.Mock(side_effect=fake_connection)
+        self.pool = ConnectionPool(self.connect)
+        self.pool.size = 2
+        self.pool.timeout = 0.01
+        self.pool._reset()  # pylint: disable=protected-access
+
+    def test_connections_reused(self):
+        """Returned connections are lent out again, without reconnecting."""
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        self.assertIs(self.pool.checkout(), conn)
+        self.connect.assert_called_once()
+
+        # The connection was health-checked before being lent out again
+        conn.ping.assert_called_once_with(reconnect=False)
+
+    def test_warm(self):
+        """Warming the pool opens connections before they're needed."""
+        self.pool.warm(2)
+        self.assertEqual(self.connect.call_count, 2)
+        stats = self.pool.stats()
+        self.assertEqual((stats.open, stats.in_use), (2, 0))
+
+        self.pool.checkout()
+        self.pool.checkout()
+        self.assertEqual(self.connect.call_count, 2)
+
+    def test_gone_away(self):
+        """Connections that fail a ping are transparently replaced."""
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        conn.ping.side_effect = pymysql.err.OperationalError(
+            2006, "MySQL server has gone away"
+        )
+
+        replacement = self.pool.checkout()
+        self.assertIsNot(replacement, conn)
+        conn.close.assert_called_once()
+        stats = self.pool.stats()
+        self.assertEqual((stats.open, stats.reconnects), (1, 1))
+
+    def test_open_transaction_rolled_back(self):
+        """A connection is never returned to the pool mid-transaction."""
+        conn = self.pool.checkout()
+        conn.server_status |= SERVER_STATUS.SERVER_STATUS_IN_TRANS
+        self.pool.checkin(conn)
+        conn.rollback.assert_called_once()
+
+    def test_closed_connection_discarded(self):
+        conn = self.pool.checkout()
+        conn.open = False
+        self.pool.checkin(conn)
+        self.assertIsNot(self.pool.checkout(), conn)
+        self.assertEqual(self.pool.stats().open, 1)
+
+    def test_timeout(self):
+        """When every connection is in use, we wait only so long."""
+        self.pool.checkout()
+        self.pool.checkout()
+        with self.assertRaises(PoolTimeout):
+            self.pool.checkout()
+
+        stats = self.pool.stats()
+        self.assertEqual(stats.waits, 1)
+        self.assertGreater(stats.wait_seconds, 0)
+
+    def test_new_process(self):
+        """Connections made before forking are never used by the child."""
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+
+        with mock.patch('os.getpid', return_value=-1):
+            child_conn = self.pool.checkout()
+        self.assertIsNot(child_conn, conn)
+        conn.close.assert_not_called()  # The parent may still be using it!
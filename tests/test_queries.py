@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+
+from member import queries
+from member.app import create_app
+
+from .utils import assert_max_queries
+
+
+class QueryLogTests(unittest.TestCase):
+    def setUp(self):
+        self.log = queries.QueryLog()
+        self.conn = mock.Mock()
+        self.conn.cursor.return_value.rowcount = 3
+        self.cursor = self.log.cursor(self.conn)
+
+        self.app_context = create_app().app_context()
+        self.app_context.push()
+        self.addCleanup(self.app_context.pop)
+
+    def test_totals(self):
+        """Statements are counted (with their rows) for the app context."""
+        self.cursor.execute('select 1')
+        self.cursor.executemany('insert into t values (%s)', [(1,), (2,), (3,)])
+
+        totals = queries.stats()
+        self.assertEqual(totals.count, 2)
+        self.assertEqual(totals.rows, 6)
+        self.assertGreater(totals.seconds, 0)
+
+        # The wrapped cursor is used for everything else
+        self.assertIs(self.cursor.fetchall, self.conn.cursor.return_value.fetchall)
+
+    def test_failed_statement(self):
+        """Statements which raise are still recorded."""
+        self.conn.cursor.return_value.execute.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            self.cursor.execute('select 1')
+        self.assertEqual(queries.stats().count, 1)
+
+    def test_slow_query_logged(self):
+        """Slow statements are logged, naming (but not including) parameters."""
+        self.log.slow_seconds = 0
+        with self.assertLogs('member.queries', 'WARNING') as logs:
+            self.cursor.execute(
+                'select id\n  from people\n where email = %(email)s',
+                {'email': 'tim@mit.edu'},
+            )
+            self.cursor.executemany(
+                'insert into t values (%(person_id)s)',
+                [{'person_id': 37}, {'person_id': 42}],
+            )
+        first, second = logs.output
+        self.assertIn('select id from people where email = %(email)s [email=?]', first)
+        self.assertNotIn('tim@mit.edu', first)
+        self.assertIn('[2 rows of person_id=?]', second)
+        self.assertNotIn('37', second)
+
+    def test_fast_query_not_logged(self):
+        with mock.patch.object(queries.logger, 'warning') as warning:
+            self.cursor.execute('select 1')
+        warning.assert_not_called()
+
+    def test_budget_exceeded(self):
+        """Budgets report every statement executed."""
+        with self.assertRaises(AssertionError) as cm:
+            with assert_max_queries(self, 1):
+                for person_id in [37, 42]:
+                    self.cursor.execute(
+                        'select * from people where id = %s', (person_id,)
+                    )
+        self.assertIn('2 queries (at most 1)', str(cm.exception))
+        self.assertEqual(str(cm.exception).count('select * from people'), 2)
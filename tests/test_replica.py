@@ -0,0 +1,169 @@
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import pymysql
+
+from member import db, replica
+from member.app import create_app
+from member.cache import TTLCache
+
+from .utils import start_patchers
+
+SIGNED = datetime(2019, 11, 10, 12, 30)
+
+
+def fake_connection(lag=0):
+    """Return a connection to a server which is `lag` seconds behind."""
+    conn = mock.MagicMock()
+    conn.cursor.return_value.fetchall.return_value = []
+    lag_cursor = conn.cursor.return_value.__enter__.return_value
+    lag_cursor.description = [('Slave_IO_State',), ('Seconds_Behind_Master',)]
+    lag_cursor.fetchone.return_value = ('Waiting for source', lag)
+    return conn
+
+
+class ReplicaTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.replica = replica.Replica()
+        self.replica.init_app(self.app)
+        self.replica.host = 'replica.example.com'
+        self.replica.pool = mock.Mock()
+        self.replica.pool.checkout.return_value = self.replica_conn = fake_connection()
+
+        self.primary_conn = fake_connection()
+        start_patchers(
+            self,
+            mock.patch.object(db, 'replica', self.replica),
+            mock.patch.object(db, 'get_db', return_value=self.primary_conn),
+        )
+
+    def read(self):
+        """Make a pure read, returning which connection executed it."""
+        for conn in [self.replica_conn, self.primary_conn]:
+            conn.cursor.return_value.execute.reset_mock()
+        db.already_added_waivers([(37, SIGNED)])
+        replica_used = self.replica_conn.cursor.return_value.execute.called
+        primary_used = self.primary_conn.cursor.return_value.execute.called
+        self.assertNotEqual(replica_used, primary_used)
+        return 'replica' if replica_used else 'primary'
+
+    def test_reads_from_replica(self):
+        with self.app.app_context():
+            self.assertEqual(self.read(), 'replica')
+        self.replica.pool.checkin.assert_called_once_with(self.replica_conn)
+        self.assertEqual(self.replica.stats().reads, 1)
+
+    def test_read_your_writes(self):
+        """Once a unit of work has written, it reads only from the primary."""
+        self.primary_conn.cursor.return_value.rowcount = 1
+        with self.app.app_context():
+            with db.transaction():
+                db.add_waiver(37, SIGNED)
+            self.assertEqual(self.read(), 'primary')
+        self.replica.pool.checkout.assert_not_called()
+
+        with self.app.app_context():  # (A new unit of work)
+            self.assertEqual(self.read(), 'replica')
+
+    def test_lagging(self):
+        self.replica.pool.checkout.return_value = self.replica_conn = fake_connection(
+            lag=60
+        )
+        with self.app.app_context():
+            self.assertEqual(self.read(), 'primary')
+        self.replica.pool.checkin.assert_called_once_with(self.replica_conn)
+        self.assertEqual(self.replica.stats().lagging, 1)
+        self.assertEqual(self.replica.stats().lag_seconds, 60)
+
+    def test_not_replicating(self):
+        """Replicas which have stopped replicating are not read from."""
+        self.replica.pool.checkout.return_value = self.replica_conn = fake_connection(
+            lag=None
+        )
+        with self.app.app_context():
+            self.assertEqual(self.read(), 'primary')
+
+    def test_down(self):
+        """Reads fall back to the primary, and the replica is retried later."""
+        self.replica.pool.checkout.side_effect = pymysql.err.OperationalError(2003)
+        with self.app.app_context(), self.assertLogs(replica.logger, 'WARNING'):
+            self.assertEqual(self.read(), 'primary')
+        with self.app.app_context():
+            self.assertEqual(self.read(), 'primary')
+        self.replica.pool.checkout.assert_called_once()
+        self.assertEqual(self.replica.stats().unavailable, 2)
+
+        self.replica.pool.checkout.side_effect = None
+        later = time.monotonic() + self.replica.retry_interval
+        with mock.patch.object(replica.time, 'monotonic', return_value=later):
+            with self.app.app_context():
+                self.assertEqual(self.read(), 'replica')
+
+    def test_writes_read_from_primary(self):
+        """What's read in a unit of work that may write comes from the primary.
+
+        (A lagging replica could report an old membership, from which a renewal
+        would be given the wrong expiration date.)
+        """
+        with self.app.app_context():
+            with db.transaction():
+                self.assertEqual(self.read(), 'primary')
+                db.current_membership_expires(37)
+            self.assertEqual(self.read(), 'replica')  # (Outside the transaction)
+        self.replica_conn.cursor.return_value.execute.assert_called_once()
+
+    def test_resolution_not_cached_from_replica(self):
+        """Which person to update is decided (& cached) only from the primary."""
+        cache = self._patch_cache('person_cache')
+        with self.app.app_context():
+            db.person_to_update('tim@mit.edu', ['tim@mit.edu'])
+        self.assertIsNone(cache.get(frozenset({'tim@mit.edu'})))
+
+        with self.app.app_context():
+            with db.transaction():
+                db.person_to_update('tim@mit.edu', ['tim@mit.edu'])
+        self.assertIsNotNone(cache.get(frozenset({'tim@mit.edu'})))
+
+    def test_not_cached_after_write(self):
+        """Statuses read soon after our own write are not cached.
+
+        Our write invalidated the cache, but the replica may not have it yet.
+        """
+        self._patch_cache('status_cache')
+        replica_execute = self.replica_conn.cursor.return_value.execute
+
+        self.primary_conn.cursor.return_value.rowcount = 1
+        with self.app.app_context():
+            with db.transaction():
+                db.add_person('Tim', 'Beaver', 'tim@mit.edu')
+
+        # The replica hasn't caught up (the person isn't found), so isn't cached
+        for _ in range(2):
+            with self.app.app_context():
+                (status,) = db.expirations_for(['tim@mit.edu'])
+                self.assertIsNone(status.person_id)
+        self.assertEqual(replica_execute.call_count, 2)
+
+        # Once the replica must have caught up, statuses are cached again
+        later = time.monotonic() + self.replica.max_lag + 2
+        with mock.patch.object(replica.time, 'monotonic', return_value=later):
+            for _ in range(2):
+                with self.app.app_context():
+                    db.expirations_for(['tim@mit.edu'])
+        self.assertEqual(replica_execute.call_count, 3)
+
+    def _patch_cache(self, name: str) -> TTLCache:
+        cache = TTLCache(maxsize=16, ttl=300)
+        patcher = mock.patch.object(db, name, cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return cache
+
+    def test_disabled(self):
+        self.replica.host = ''
+        with self.app.app_context():
+            self.assertEqual(self.read(), 'primary')
+        self.replica.pool.checkout.assert_not_called()
@@ -29,3 +29,58 @@ class TestSecureAcceptanceSigner(unittest.TestCase):
         post_data = {'signature': b'gey89FkFpKWsyqwicl2ffjyXDzroaoEvLqluIKO6qls='}
         with self.assertRaises(ValueError):
             self.signer.verify_request(post_data)
+
+
+class TestSignatureVerifier(unittest.TestCase):
+    def setUp(self):
+        self.post_data = {
+            'signature': '6wI69NZPgm2GtiAEFbnKHnBnsYhqybRaQ8hyXCTKcxM=',
+            'signed_field_names': 'name,email',
+            'name': 'Dennis',
+            'email': 'dennis@example.com',
+        }
+
+    def test_any_key(self):
+        """During key rotation, signatures from either key are valid."""
+        self.assertTrue(
+            signature.SignatureVerifier(['secret-key']).verify(self.post_data)
+        )
+        rotated = signature.SignatureVerifier(['new-key', 'secret-key'])
+        self.assertTrue(rotated.verify(self.post_data))
+        retired = signature.SignatureVerifier(['new-key'])
+        self.assertFalse(retired.verify(self.post_data))
+
+    def test_no_keys(self):
+        with self.assertRaises(ValueError):
+            signature.SignatureVerifier([])
+
+    def test_unverifiable(self):
+        """Anything without a signature (or fields to verify) is invalid."""
+        verifier = signature.SignatureVerifier(['secret-key'])
+        for field in ['signature', 'signed_field_names']:
+            data = self.post_data.copy()
+            data.pop(field)
+            self.assertFalse(verifier.verify(data))
+
+    def test_signature_valid(self):
+        """Verifiers are reused, until the keys change."""
+        self.assertTrue(signature.signature_valid(self.post_data, 'secret-key'))
+        self.assertTrue(
+            signature.signature_valid(self.post_data, 'new-key', 'secret-key')
+        )
+        self.assertFalse(signature.signature_valid(self.post_data, 'new-key'))
+        self.assertIs(
+            signature.get_verifier('secret-key'), signature.get_verifier('secret-key')
+        )
+
+    def test_verify_many(self):
+        """Batches may be verified in this process, or across a pool."""
+        invalid = dict(self.post_data, name='Mallory')
+        payloads = [self.post_data, invalid] * 10
+
+        verifier = signature.SignatureVerifier(['new-key', 'secret-key'])
+        self.assertEqual(verifier.verify_many(payloads), [True, False] * 10)
+        with verifier.pool(processes=2) as pool:
+            self.assertEqual(
+                verifier.verify_many(payloads, pool, chunksize=3), [True, False] * 10
+            )
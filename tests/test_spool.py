@@ -0,0 +1,164 @@
+import unittest
+from datetime import date, datetime
+from unittest import mock
+from urllib.error import URLError
+
+import pymysql
+
+from member import backfill, db, spool
+from member.app import create_app
+from member.emails import VerifiedEmails
+from member.errors import AlreadyInserted
+
+from .test_backfill import payment
+from .utils import start_patchers, use_sqlite_file
+
+
+def waiver(email, time_signed='2018-11-10T23:41:06'):
+    return {
+        'email': email,
+        'first_name': 'Tim',
+        'last_name': 'Beaver',
+        'time_signed': time_signed,
+        'affiliation': 'MIT undergrad',
+    }
+
+
+class SpoolTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.spool = use_sqlite_file(self, spool.Spool(), 'WEBHOOK_SPOOL_PATH')
+
+        self.db = self._patch(
+            db,
+            get_db=mock.DEFAULT,
+            update_affiliations=mock.DEFAULT,
+            people_to_update=lambda email_sets: [
+                37 + i for i, _ in enumerate(email_sets)
+            ],
+            already_inserted_memberships=lambda rows: [False for _ in rows],
+            already_added_waivers=lambda rows: [False for _ in rows],
+            add_memberships=lambda rows: [date(2019, 5, 17) for _ in rows],
+            add_waivers=lambda rows: [date(2019, 11, 10) for _ in rows],
+        )
+        self.backfill = self._patch(
+            backfill,
+            other_verified_emails=lambda email: VerifiedEmails(email, [email]),
+            update_membership=mock.DEFAULT,
+        )
+
+    def _patch(self, module, **side_effects):
+        """Mock each named function, returning the mocks by name."""
+        (mocks,) = start_patchers(
+            self,
+            mock.patch.multiple(
+                module, **{name: mock.DEFAULT for name in side_effects}
+            ),
+        )
+        for name, side_effect in side_effects.items():
+            if side_effect is not mock.DEFAULT:
+                mocks[name].side_effect = side_effect
+        return mocks
+
+    def test_batched(self):
+        """Spooled webhooks are recorded together, one transaction per kind."""
+        self.spool.append('membership', payment('tim@mit.edu'))
+        self.spool.append('membership', payment('bob@mit.edu'))
+        self.spool.append('waiver', waiver('tim@mit.edu'))
+        self.assertEqual(self.spool.pending(), 3)
+
+        self.assertEqual(self.spool.process_due(), (3, 0, 0))
+        self.assertEqual(self.spool.pending(), 0)
+
+        self.assertEqual(len(self.db['add_memberships'].call_args[0][0]), 2)
+        self.db['add_waivers'].assert_called_once_with(
+            [(37, datetime(2018, 11, 10, 23, 41, 6))]
+        )
+        self.backfill['update_membership'].assert_has_calls(
+            [
+                mock.call('tim@mit.edu', membership_expires=date(2019, 5, 17)),
+                mock.call('bob@mit.edu', membership_expires=date(2019, 5, 17)),
+                mock.call('tim@mit.edu', waiver_expires=date(2019, 11, 10)),
+            ],
+            any_order=True,
+        )
+
+    def test_database_down(self):
+        """Webhooks are kept (and retried after a backoff) if they can't be recorded."""
+        self.db['add_memberships'].side_effect = pymysql.err.OperationalError(2003)
+        self.spool.append('membership', payment('tim@mit.edu'))
+        self.spool.append('waiver', waiver('tim@mit.edu'))
+
+        with self.assertLogs(spool.logger, 'ERROR'):
+            self.assertEqual(self.spool.process_due(), (1, 1, 0))
+        self.assertEqual(self.spool.pending(), 1)
+        self.assertEqual(self.spool.claim(10), [])  # Backing off
+
+        with mock.patch.object(spool.time, 'time', return_value=2e9):
+            (webhook,) = self.spool.claim(10)
+        self.assertEqual((webhook.kind, webhook.attempts), ('membership', 1))
+
+    def test_bad_webhook_isolated(self):
+        """A webhook which can't be recorded fails alone, not with its batch."""
+
+        def add_memberships(rows):
+            if any(datetime_paid.day == 18 for _, _, datetime_paid, _ in rows):
+                raise pymysql.err.DataError(1292, "Incorrect datetime value")
+            return [date(2019, 5, 17) for _ in rows]
+
+        self.db['add_memberships'].side_effect = add_memberships
+        for email, day in [('tim', 17), ('bob', 18), ('sue', 17)]:
+            self.spool.append(
+                'membership',
+                payment(
+                    f'{email}@mit.edu', signed_date_time=f'2018-05-{day}T19:20:30Z'
+                ),
+            )
+
+        self.assertEqual(self.spool.process_due(), (2, 0, 1))
+        self.assertEqual(self.spool.pending(), 0)
+        self.assertEqual(self.backfill['update_membership'].call_count, 2)
+
+    def test_raced_repeatedly(self):
+        """Batches are retried for as long as duplicates keep racing with them."""
+        self.db['add_memberships'].side_effect = [AlreadyInserted, AlreadyInserted, []]
+        self.db['already_inserted_memberships'].side_effect = [
+            [False, False],
+            [True, False],
+            [True, True],
+        ]
+        self.spool.append('membership', payment('tim@mit.edu'))
+        self.spool.append('membership', payment('bob@mit.edu'))
+        self.assertEqual(self.spool.process_due(), (2, 0, 0))
+        self.backfill['update_membership'].assert_not_called()
+
+    def test_trips_down(self):
+        """Webhooks for whom verified emails can't be found are retried."""
+        self.backfill['other_verified_emails'].side_effect = URLError('Oh no')
+        self.spool.append('waiver', waiver('tim@mit.edu'))
+        self.assertEqual(self.spool.process_due(), (0, 1, 0))
+        self.assertEqual(self.spool.pending(), 1)
+        self.db['add_waivers'].assert_not_called()
+
+    def test_invalid(self):
+        """Webhooks which can never be recorded are kept, but not retried."""
+        self.spool.append('membership', payment('tim@mit.edu', req_amount='1.00'))
+        self.spool.append('waiver', {'email': 'tim@mit.edu'})
+        self.assertEqual(self.spool.process_due(), (0, 0, 2))
+        self.assertEqual(self.spool.pending(), 0)
+        with mock.patch.object(spool.time, 'time', return_value=2e9):
+            self.assertEqual(self.spool.claim(10), [])
+
+    def test_claimed(self):
+        """Claimed webhooks are not processed twice (until the lease ends)."""
+        self.spool.append('waiver', waiver('tim@mit.edu'))
+        self.assertEqual(len(self.spool.claim(10)), 1)
+        self.assertEqual(self.spool.claim(10), [])
+
+    def test_drain_command(self):
+        self.spool.append('waiver', waiver('tim@mit.edu'))
+        result = self.app.test_cli_runner().invoke(args=['drain-spool'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn(
+            'Processed 1 webhooks (0 to retry, 0 failed), 0 pending', result.output
+        )
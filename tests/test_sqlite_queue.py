@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from member import coalesce, outbox, spool
+from member.app import create_app
+
+from .utils import temporary_directory
+
+
+class DurabilityTests(unittest.TestCase):
+    def setUp(self):
+        directory = temporary_directory(self)
+        self.app = create_app()
+        self.app.config['TRIPS_OUTBOX_PATH'] = f'{directory}/outbox.db'
+        self.app.config['WEBHOOK_SPOOL_PATH'] = f'{directory}/spool.db'
+        self.app.config['WEBHOOK_COALESCE_PATH'] = f'{directory}/claims.db'
+
+    def synchronous(self, extension) -> int:
+        extension.init_app(self.app)
+        # pylint: disable=protected-access
+        return extension._connect().execute('pragma synchronous').fetchone()[0]
+
+    def test_queues_fsync_every_commit(self):
+        """Appends to a queue have been acknowledged, so mustn't be lost."""
+        self.assertEqual(self.synchronous(outbox.Outbox()), 2)  # (full)
+        self.assertEqual(self.synchronous(spool.Spool()), 2)
+
+    def test_claims_may_be_lost(self):
+        self.assertEqual(self.synchronous(coalesce.Coalescer()), 1)  # (normal)
+
+
+class DrainThreadTests(unittest.TestCase):
+    def test_stop(self):
+        """Stopping waits for the background thread, which may be started again."""
+        app = create_app()
+        queue = outbox.Outbox()
+        queue.init_app(app)
+        queue.poll_interval = 60
+        with mock.patch.object(queue, 'process_due', return_value=(0, 0)):
+            queue.start()
+            thread = queue._thread  # pylint: disable=protected-access
+            queue.stop()
+            self.assertFalse(thread.is_alive())
+
+            queue.start()
+            self.assertIsNot(queue._thread, thread)  # pylint: disable=protected-access
+            queue.stop()
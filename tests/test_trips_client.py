@@ -0,0 +1,114 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+
+from flask import Flask
+
+from member.errors import TripsBusy
+from member.trips_client import TripsClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.server.connections.add(self.client_address)
+        status = 500 if self.path == '/error/' else 200
+        if self.path == '/slow/':
+            time.sleep(0.2)
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close/':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/timeout/':
+            self.close_connection = True  # (Without telling the client)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class TripsClientTests(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.01,), daemon=True
+        )
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.client = TripsClient()
+        self.client.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.addCleanup(self.client.close)
+
+    def test_keep_alive(self):
+        """Consecutive requests share one connection."""
+        for method in ['GET', 'POST', 'GET']:
+            body = self.client.request(method, '/data/', {'Authorization': 'x'})
+            self.assertEqual(body, b'{"ok": true}')
+
+        self.assertEqual(len(self.server.connections), 1)
+        stats = self.client.stats()
+        self.assertEqual(stats.requests, 3)
+        self.assertEqual(stats.connections, 1)
+        self.assertEqual(stats.failures, 0)
+        self.assertGreater(stats.total_seconds, 0)
+        self.assertGreaterEqual(stats.total_seconds, stats.max_seconds)
+
+    def test_server_closes_connection(self):
+        self.client.request('GET', '/close/', {})
+        self.client.request('GET', '/data/', {})
+        self.assertEqual(self.client.stats().connections, 2)
+
+    def test_stale_connection(self):
+        """A kept-alive connection closed by the server is replaced."""
+        self.client.request('GET', '/timeout/', {})
+        self.assertEqual(self.client.request('GET', '/data/', {}), b'{"ok": true}')
+        stats = self.client.stats()
+        self.assertEqual(stats.reconnects, 1)
+        self.assertEqual(stats.connections, 2)
+
+    def test_error_status(self):
+        with self.assertRaises(HTTPError) as cm:
+            self.client.request('GET', '/error/', {})
+        self.assertEqual(cm.exception.code, 500)
+        self.assertEqual(self.client.stats().failures, 1)
+
+        # The connection is still usable after an error status
+        self.client.request('GET', '/data/', {})
+        self.assertEqual(self.client.stats().connections, 1)
+
+    def test_connection_refused(self):
+        self.server.server_close()
+        self.client.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        with self.assertRaises(URLError):
+            self.client.request('GET', '/data/', {})
+        self.assertEqual(self.client.stats().failures, 1)
+
+    def test_busy(self):
+        """Requests beyond the limit wait only briefly for a slot."""
+        app = Flask(__name__)
+        app.config['TRIPS_API_URL'] = self.client.base_url
+        app.config['TRIPS_API_MAX_CONCURRENT'] = 1
+        app.config['TRIPS_API_SLOT_TIMEOUT'] = 0.01
+        self.client.init_app(app)
+
+        slow = threading.Thread(target=self.client.request, args=('GET', '/slow/', {}))
+        slow.start()
+        time.sleep(0.05)
+        with self.assertRaises(TripsBusy):
+            self.client.request('GET', '/data/', {})
+        slow.join()
+
+        self.client.request('GET', '/data/', {})  # The slot is free again
+        stats = self.client.stats()
+        self.assertEqual((stats.requests, stats.busy, stats.failures), (2, 1, 0))
@@ -1,7 +1,8 @@
+import asyncio
 import unittest
 from unittest import mock
 
-from flask import Flask
+from flask import Flask, request
 
 from member import app
 
@@ -14,3 +15,122 @@ class WsgiTest(unittest.TestCase):
         create_app.assert_called_once()
         self.assertTrue(isinstance(wsgi.application, Flask))
         self.assertTrue(hasattr(wsgi.application, 'wsgi_app'))
+
+
+def run_asgi(adapter, scope, messages):
+    """Run an ASGI app with the given messages received, returning those sent."""
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(adapter(scope, receive, send))
+    return sent
+
+
+class AsgiBodyTest(unittest.TestCase):
+    def setUp(self):
+        from member import asgi  # pylint: disable=import-outside-toplevel
+
+        self.app = Flask(__name__)
+        self.app.config.update(
+            WAIVER_MAX_BYTES=16,
+            ASGI_MAX_IN_FLIGHT=2,
+            ADMISSION_RETRY_AFTER=5,
+        )
+        self.requests = []
+
+        @self.app.route('/echo', methods=['POST'])
+        def echo():
+            self.requests.append(request.path)
+            return request.get_data()
+
+        self.adapter = asgi.AsgiAdapter(self.app)
+        self.addCleanup(self.adapter.close)
+
+    def post(self, chunks, headers=()):
+        scope = {'type': 'http', 'method': 'POST', 'path': '/echo', 'headers': headers}
+        messages = [
+            {'type': 'http.request', 'body': chunk, 'more_body': True}
+            for chunk in chunks
+        ]
+        messages.append({'type': 'http.request', 'body': b'', 'more_body': False})
+        sent = run_asgi(self.adapter, scope, messages)
+        return sent[0]['status'], sent[1]['body']
+
+    def test_streamed(self):
+        """Bodies of any length (e.g. chunked) are read as they arrive."""
+        self.assertEqual(self.post([b'Hello, ', b'world']), (200, b'Hello, world'))
+
+    def test_too_large(self):
+        """Bodies are rejected once they're larger than any view accepts."""
+        status, _ = self.post([b'Hello, ', b'world', b'!' * 1000])
+        self.assertEqual(status, 413)
+
+    def test_too_many_in_flight(self):
+        """Requests beyond `ASGI_MAX_IN_FLIGHT` are refused, not queued."""
+        self.adapter._in_flight = 2  # pylint: disable=protected-access
+        status, _ = self.post([b'Hello'])
+        self.assertEqual(status, 503)
+        self.assertEqual(self.requests, [])
+
+    def test_declared_too_large(self):
+        status, _ = self.post([], headers=[(b'content-length', b'1000')])
+        self.assertEqual(status, 413)
+        self.assertEqual(self.requests, [])
+
+
+class AsgiTest(unittest.TestCase):
+    def test_application(self):
+        """The app is only created on use (or by uvicorn, with `--factory`)."""
+        from member import asgi  # pylint: disable=import-outside-toplevel
+
+        asgi._application.cache_clear()  # pylint: disable=protected-access
+        self.addCleanup(app.create_app)  # (Restoring the default pool size)
+        with mock.patch.object(asgi, 'create_app', wraps=asgi.create_app) as create:
+            adapter = asgi.application
+            self.assertIs(asgi.application, adapter)
+        create.assert_called_once_with({'MYSQL_POOL_SIZE': 20})
+        self.assertEqual(adapter.app.config['MYSQL_POOL_SIZE'], 20)
+
+    def test_lifespan(self):
+        """On startup, database connections are opened (as with gunicorn)."""
+        from member import asgi  # pylint: disable=import-outside-toplevel
+
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        adapter = asgi.AsgiAdapter(app.create_app())
+        with mock.patch.object(asgi.extensions.pool, 'warm') as warm:
+            asyncio.run(adapter({'type': 'lifespan'}, receive, send))
+        warm.assert_called_once()
+        self.assertEqual(
+            [message['type'] for message in sent],
+            ['lifespan.startup.complete', 'lifespan.shutdown.complete'],
+        )
+
+    def test_shutdown(self):
+        """On shutdown, the outbox & spool stop draining in the background."""
+        from member import asgi  # pylint: disable=import-outside-toplevel
+
+        adapter = asgi.AsgiAdapter(app.create_app())
+        with mock.patch.object(
+            asgi.extensions.outbox, 'stop'
+        ) as stop_outbox, mock.patch.object(
+            asgi.extensions.spool, 'stop'
+        ) as stop_spool:
+            sent = run_asgi(
+                adapter, {'type': 'lifespan'}, [{'type': 'lifespan.shutdown'}]
+            )
+        self.assertEqual(sent, [{'type': 'lifespan.shutdown.complete'}])
+        stop_outbox.assert_called_once_with()
+        stop_spool.assert_called_once_with()
@@ -1,8 +1,22 @@
+import asyncio
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
 from importlib import reload
+from typing import List
 from unittest import mock
 
-from member import extensions, settings
+from flask import Flask
+from flask.testing import FlaskClient
+from werkzeug.http import HTTP_STATUS_CODES
+from werkzeug.test import run_wsgi_app
+
+from member import db, extensions, queries, settings
 from member.app import create_app
+from member.asgi import AsgiAdapter
+from member.cache import TTLCache
+from member.spool import Spool
 
 
 def create_app_with_env_vars(desired_env_vars):
@@ -23,6 +37,76 @@ def create_app_with_env_vars(desired_env_vars):
     return app
 
 
+@contextmanager
+def assert_max_queries(test_case, limit):
+    """Fail if more than `limit` statements are sent to the database in the block.
+
+    Budgets catch N+1 regressions (e.g. a query per email), and list every
+    statement executed when exceeded.
+    """
+    with queries.capture() as executed:
+        yield executed
+    if len(executed) > limit:
+        statements = '\n'.join(' '.join(q.statement.split()) for q in executed)
+        test_case.fail(f"{len(executed)} queries (at most {limit}):\n{statements}")
+
+
+def verbs(executed) -> List[str]:
+    """Name each statement by its first word (e.g. `select`), skipping comments."""
+    return [re.sub(r'--.*', '', query.statement).split()[0] for query in executed]
+
+
+def start_patchers(test_case, *patchers) -> list:
+    """Start each patcher (stopping it after the test), returning the mocks."""
+    mocks = [patcher.start() for patcher in patchers]
+    for patcher in patchers:
+        test_case.addCleanup(patcher.stop)
+    return mocks
+
+
+def temporary_directory(test_case) -> str:
+    """Return a directory that's removed (with its contents) after the test."""
+    directory = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, directory)
+    return directory
+
+
+def use_sqlite_file(test_case, extension, setting: str):
+    """Initialize the extension on `test_case.app`, with a temporary SQLite file.
+
+    Extensions with a background thread (e.g. the spool) never start it:
+    tests process the queue themselves.
+    """
+    filename = f'{setting.lower()}.db'
+    test_case.app.config[setting] = f'{temporary_directory(test_case)}/{filename}'
+    extension.init_app(test_case.app)
+    if hasattr(extension, 'start'):
+        start_patchers(test_case, mock.patch.object(extension, 'start'))
+    return extension
+
+
+def use_connection(test_case, conn=None):
+    """Send every statement to `conn` (by default, a mock), with empty caches."""
+    conn = conn or mock.Mock()
+    start_patchers(
+        test_case,
+        mock.patch.object(db, 'get_db', return_value=conn),
+        mock.patch.object(db, 'person_cache', TTLCache()),
+        mock.patch.object(db, 'status_cache', TTLCache()),
+    )
+    return conn
+
+
+def use_spool(test_case) -> Spool:
+    """Spool the webhooks that `test_case.app` receives (in a temporary file).
+
+    Spooled webhooks are left in the spool, rather than processed.
+    """
+    spool = use_sqlite_file(test_case, Spool(), 'WEBHOOK_SPOOL_PATH')
+    start_patchers(test_case, mock.patch.object(extensions, 'spool', spool))
+    return spool
+
+
 def reload_affected_modules():
     """Reload any modules that are affected by toying with env vars.
 
@@ -32,3 +116,84 @@ def reload_affected_modules():
     """
     reload(settings)  # Application settings are used to populate `app.config`
     reload(extensions)  # Sentry is configured on import & reads values from env vars
+
+
+class AsgiClient(FlaskClient):
+    """A test client which makes requests through the ASGI entry point."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.asgi_app = AsgiAdapter(self.application)
+
+    def run_wsgi_app(self, environ, buffered=False):
+        return run_wsgi_app(self._via_asgi, environ, buffered=buffered)
+
+    def _via_asgi(self, environ, start_response):
+        headers = [
+            (
+                key[5:].replace('_', '-').lower().encode('latin-1'),
+                value.encode('latin-1'),
+            )
+            for key, value in environ.items()
+            if key.startswith('HTTP_')
+        ]
+        for key in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+            if environ.get(key):
+                headers.append(
+                    (
+                        key.replace('_', '-').lower().encode('latin-1'),
+                        environ[key].encode('latin-1'),
+                    )
+                )
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': environ['REQUEST_METHOD'],
+            'scheme': environ['wsgi.url_scheme'],
+            'path': environ['PATH_INFO'].encode('latin-1').decode('utf-8'),
+            'query_string': environ['QUERY_STRING'].encode('latin-1'),
+            'root_path': environ['SCRIPT_NAME'],
+            'headers': headers,
+            'server': (environ['SERVER_NAME'], int(environ['SERVER_PORT'])),
+            'client': (environ.get('REMOTE_ADDR', '127.0.0.1'), 0),
+        }
+        requests = [{'type': 'http.request', 'body': environ['wsgi.input'].read()}]
+        sent = []
+
+        async def receive():
+            return requests.pop() if requests else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.asgi_app(scope, receive, send))
+        start, *bodies = sent
+        status = start['status']
+        start_response(
+            f'{status} {HTTP_STATUS_CODES[status]}',
+            [
+                (name.decode('latin-1'), value.decode('latin-1'))
+                for name, value in start['headers']
+            ],
+        )
+        return [b''.join(message['body'] for message in bodies)]
+
+    def close(self):
+        self.asgi_app.close()
+
+
+def asgi_variant(test_case):
+    """Return a copy of the test case which makes its requests via ASGI."""
+
+    class AsgiTestCase(test_case):
+        # pylint: disable=too-few-public-methods
+        def setUp(self):
+            patcher = mock.patch.object(Flask, 'test_client_class', AsgiClient)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            super().setUp()
+            self.addCleanup(self.client.close)
+
+    AsgiTestCase.__name__ = AsgiTestCase.__qualname__ = f'Asgi{test_case.__name__}'
+    return AsgiTestCase
@@ -4,13 +4,24 @@ from pathlib import Path
 from unittest import mock
 from urllib.error import URLError
 
-from member import extensions
+from benchmarks.gear_db import membership_payment
+from member import errors, extensions
 from member.app import create_app
+from member.coalesce import Coalescer
 from member.cybersource import CYBERSOURCE_DT_FORMAT
 from member.public import views
 from member.signature import SecureAcceptanceSigner
 
-from ..utils import create_app_with_env_vars
+from ..utils import (
+    asgi_variant,
+    assert_max_queries,
+    create_app_with_env_vars,
+    start_patchers,
+    use_connection,
+    use_spool,
+    use_sqlite_file,
+    verbs,
+)
 
 DIR_PATH = Path(__file__).resolve().parent
 DUMMY_RAVEN_DSN = 'https://aa11bb22cc33dd44ee55ff6601234560@sentry.io/104648'
@@ -69,7 +80,6 @@ class MembershipViewTests(unittest.TestCase):
         In this situation, the membership update has not yet been processed.
         """
         self.db.person_to_update.return_value = 62
-        self.db.already_inserted_membership.return_value = False
         self.db.add_membership.return_value = (62, one_year_later())
         return 62
 
@@ -107,6 +117,20 @@ class TestSignaturesInMembershipView(MembershipViewTests):
         response = self.client.post('/members/membership', data=payload)
         self.assertEqual(response.status_code, 401)
 
+    @mock.patch.object(views, 'other_verified_emails')
+    def test_previous_key(self, verified_emails):
+        """While keys are being rotated, signatures from the previous key work."""
+        verified_emails.return_value = ('mitoc-member@example.com', [])
+        self.configure_normal_update()
+
+        self.app.config['CYBERSOURCE_SECRET_KEY'] = 'new-secret-key'
+        response = self.client.post('/members/membership', data=self.valid_payload)
+        self.assertEqual(response.status_code, 401)
+
+        self.app.config['CYBERSOURCE_PREVIOUS_SECRET_KEYS'] = ['secret-key']
+        response = self.client.post('/members/membership', data=self.valid_payload)
+        self.assertEqual(response.status_code, 201)
+
 
 class ApiDownTests(MembershipViewTests):
     def setUp(self):
@@ -150,6 +174,8 @@ class ApiDownTests(MembershipViewTests):
 
         with mock.patch.object(views, 'extensions') as view_extensions:
             view_extensions.sentry = None
+            view_extensions.spool.enabled = False
+            view_extensions.coalescer.enabled = False
             response = self.client.post('/members/membership', data=self.valid_payload)
 
         self.assertTrue(response.is_json)
@@ -230,7 +256,7 @@ class TestMembershipView(MembershipViewTests):
         # There's already a person_id in the database for this person,
         # and this particular membership record was already inserted
         self.db.person_to_update.return_value = 128
-        self.db.already_inserted_membership.return_value = True
+        self.db.add_membership.side_effect = errors.AlreadyInserted
 
         # We submit a valid signature for a membership, but get a 202:
         # the membership has already been processed
@@ -241,12 +267,16 @@ class TestMembershipView(MembershipViewTests):
                 'req_merchant_defined_data2': 'MU',
                 'req_merchant_defined_data3': 'mitoc-member@example.com',
                 'auth_amount': '15.00',
+                'req_amount': '15.00',
                 'signed_date_time': cybersource_now(),
             }
         )
         self.assertEqual(response.status_code, 202)
 
-        self.expect_no_processing()
+        # The insert was attempted (a unique key rejected it), but nothing more
+        self.db.add_membership.assert_called_once()
+        self.db.add_person.assert_not_called()
+        self.update_membership.assert_not_called()
 
     @mock.patch.object(views, 'other_verified_emails')
     def test_update_membership(self, verified_emails):
@@ -286,6 +316,22 @@ class TestMembershipView(MembershipViewTests):
             'mitoc-member@example.com', membership_expires=one_year_later()
         )
 
+    @mock.patch.object(views, 'other_verified_emails')
+    def test_outbox(self, verified_emails):
+        """With an outbox, MITOC Trips is informed in the background."""
+        verified_emails.return_value = ('mitoc-member@example.com', [])
+        self.configure_normal_update()
+
+        with mock.patch.object(extensions, 'outbox') as outbox:
+            outbox.enabled = True
+            response = self.client.post('/members/membership', data=self.valid_payload)
+
+        self.assertEqual(response.status_code, 201)
+        outbox.append.assert_called_once_with(
+            'mitoc-member@example.com', membership_expires=one_year_later()
+        )
+        self.update_membership.assert_not_called()
+
     @mock.patch.object(views, 'other_verified_emails')
     def test_new_membership(self, verified_emails):
         """We create a new person record when somebody is new to MITOC."""
@@ -330,6 +376,128 @@ class TestMembershipView(MembershipViewTests):
         )
 
 
+class MembershipQueryBudgetTests(unittest.TestCase):
+    """Database round trips made for a payment (with only the connection mocked)."""
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['VERIFY_CYBERSOURCE_SIGNATURE'] = False
+        self.client = self.app.test_client()
+
+        self.conn = use_connection(self)
+        self.cursor = self.conn.cursor.return_value
+        self.cursor.lastrowid = 62
+        self.cursor.rowcount = 1
+        self.cursor.fetchall.return_value = []
+
+        verified_emails, self.update_membership = start_patchers(
+            self,
+            mock.patch.object(views, 'other_verified_emails'),
+            mock.patch.object(views, 'update_membership'),
+        )
+        verified_emails.return_value = (
+            'mitoc-member@example.com',
+            ['mitoc-member@example.com'],
+        )
+
+    def post(self, limit: int):
+        with assert_max_queries(self, limit) as executed:
+            resp = self.client.post(
+                '/members/membership',
+                data=membership_payment('mitoc-member@example.com'),
+            )
+        return resp, verbs(executed)
+
+    def test_new_person(self):
+        """One lookup, the person, their membership, then their affiliation."""
+        resp, statements = self.post(4)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(statements, ['select', 'insert', 'insert', 'update'])
+        self.conn.commit.assert_called_once()
+
+    def test_existing_person(self):
+        """A known member (with the same affiliation) needs just two."""
+        self.cursor.fetchall.return_value = [
+            ('mitoc-member@example.com', 62, 'MIT undergrad', None, 1, None)
+        ]
+        resp, statements = self.post(2)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(statements, ['select', 'insert'])
+        self.conn.commit.assert_called_once()
+
+    def test_already_inserted(self):
+        """A payment already recorded is found out by the insert itself."""
+        self.cursor.fetchall.return_value = [
+            ('mitoc-member@example.com', 62, 'MIT undergrad', None, 1, None)
+        ]
+        self.cursor.rowcount = 0
+        resp, statements = self.post(2)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(statements, ['select', 'insert'])
+        self.conn.commit.assert_not_called()
+        self.update_membership.assert_not_called()
+
+
+class SpooledMembershipTests(MembershipViewTests):
+    def setUp(self):
+        super().setUp()
+        self.spool = use_spool(self)
+
+    @mock.patch.object(views, 'other_verified_emails')
+    def test_spooled(self, verified_emails):
+        """Verified payments are spooled, then accepted without further work."""
+        response = self.client.post('/members/membership', data=self.valid_payload)
+        self.assertEqual(response.status_code, 202)
+
+        (webhook,) = self.spool.claim(10)
+        self.assertEqual(webhook.kind, 'membership')
+        self.assertEqual(webhook.payload, self.valid_payload)
+        verified_emails.assert_not_called()
+        self.db.person_to_update.assert_not_called()
+        self.update_membership.assert_not_called()
+
+    def test_invalid_signature(self):
+        """Payments are verified before being spooled."""
+        payload = {**self.valid_payload, 'signature': 'this-signature-is-invalid'}
+        response = self.client.post('/members/membership', data=payload)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.spool.pending(), 0)
+
+
+class CoalescedMembershipTests(MembershipViewTests):
+    def setUp(self):
+        super().setUp()
+        coalescer = use_sqlite_file(self, Coalescer(), 'WEBHOOK_COALESCE_PATH')
+        start_patchers(self, mock.patch.object(extensions, 'coalescer', coalescer))
+
+    @mock.patch.object(views, 'other_verified_emails')
+    def test_duplicate(self, verified_emails):
+        """Duplicate deliveries get the original's response, with no more work."""
+        verified_emails.return_value = ('mitoc-member@example.com', [])
+        self.configure_normal_update()
+
+        for _ in range(2):
+            response = self.client.post('/members/membership', data=self.valid_payload)
+            self.assertEqual(response.status_code, 201)
+        verified_emails.assert_called_once()
+        self.db.add_membership.assert_called_once()
+        self.update_membership.assert_called_once()
+
+    @mock.patch.object(views, 'other_verified_emails')
+    def test_failed(self, verified_emails):
+        """If the original fails, a duplicate is handled in full."""
+        verified_emails.return_value = ('mitoc-member@example.com', [])
+        self.configure_normal_update()
+        self.db.person_to_update.side_effect = [RuntimeError('Oh no'), 62]
+
+        with self.assertLogs('member.app', 'ERROR'):
+            response = self.client.post('/members/membership', data=self.valid_payload)
+        self.assertEqual(response.status_code, 500)
+        response = self.client.post('/members/membership', data=self.valid_payload)
+        self.assertEqual(response.status_code, 201)
+        self.db.add_membership.assert_called_once()
+
+
 class TestMembershipWithoutSignatureVerificationView(MembershipViewTests):
     """Test processing a membership _without_ verifying the signature.
 
@@ -391,3 +559,12 @@ class TestMembershipWithoutSignatureVerificationView(MembershipViewTests):
         self.update_membership.assert_called_with(
             'mitoc-member@example.com', membership_expires=one_year_later()
         )
+
+
+# The same tests, served via `member.asgi`
+AsgiTestSignaturesInMembershipView = asgi_variant(TestSignaturesInMembershipView)
+AsgiApiDownTests = asgi_variant(ApiDownTests)
+AsgiTestMembershipView = asgi_variant(TestMembershipView)
+AsgiTestMembershipWithoutSignatureVerificationView = asgi_variant(
+    TestMembershipWithoutSignatureVerificationView
+)
@@ -0,0 +1,172 @@
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+import jwt
+
+from member import db, trips_api
+from member.app import create_app
+from member.public import views
+
+from ..utils import asgi_variant, assert_max_queries, use_connection
+
+
+def status(person_id, membership_expires=None, waiver_expires=None):
+    return db.Expirations(
+        person_id,
+        frozenset([person_id] if person_id else []),
+        membership_expires,
+        waiver_expires,
+    )
+
+
+class StatusViewTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['MEMBERSHIP_SECRET_KEY'] = 'secret-key'
+        self.app.config['STATUS_MAX_EMAILS'] = 3
+        self.client = self.app.test_client()
+
+        patcher = mock.patch.object(views.db, 'expirations_for')
+        self.expirations_for = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def authorization(secret='secret-key', **claims):
+        expires = datetime.utcnow() + timedelta(minutes=15)
+        claims = {'exp': expires, 'aud': 'mitoc-member:status', **claims}
+        token = jwt.encode(claims, secret, algorithm='HS512')
+        return {'Authorization': f'Bearer: {token}'}
+
+    def get(self, *emails, headers=None):
+        return self.client.get(
+            '/members/status',
+            query_string=[('email', email) for email in emails],
+            headers=headers or self.authorization(),
+        )
+
+    def test_single_email(self):
+        self.expirations_for.return_value = [
+            status(37, date(2019, 1, 15), date(2019, 11, 10))
+        ]
+        response = self.get('tim@mit.edu')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json,
+            {
+                'results': [
+                    {
+                        'email': 'tim@mit.edu',
+                        'membership_expires': '2019-01-15',
+                        'waiver_expires': '2019-11-10',
+                    }
+                ]
+            },
+        )
+        self.expirations_for.assert_called_once_with(['tim@mit.edu'])
+        self.assertTrue(response.headers['ETag'])
+        # (Not when the entry was read: the data has no modification time)
+        self.assertNotIn('Last-Modified', response.headers)
+
+    def test_many_emails(self):
+        """All emails are looked up together."""
+        self.expirations_for.return_value = [
+            status(37, date(2019, 1, 15)),
+            status(None),
+        ]
+        response = self.get('tim@mit.edu', 'nobody@example.com')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['membership_expires'] for result in response.json['results']],
+            ['2019-01-15', None],
+        )
+        self.expirations_for.assert_called_once_with(
+            ['tim@mit.edu', 'nobody@example.com']
+        )
+
+    def test_not_modified(self):
+        self.expirations_for.return_value = [status(37, date(2019, 1, 15))]
+        etag = self.get('tim@mit.edu').headers['ETag']
+
+        headers = {**self.authorization(), 'If-None-Match': etag}
+        response = self.get('tim@mit.edu', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.data)
+
+        # Once the membership changes, so does the ETag
+        self.expirations_for.return_value = [status(37, date(2020, 1, 15))]
+        response = self.get('tim@mit.edu', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_unauthorized(self):
+        for headers in [
+            {'Authorization': ''},
+            {'Authorization': 'Basic dGltOmJlYXZlcg=='},
+            self.authorization(secret='wrong-key'),
+        ]:
+            response = self.get('tim@mit.edu', headers=headers)
+            self.assertEqual(response.status_code, 401)
+
+        # Tokens must expire
+        token = jwt.encode({'aud': 'mitoc-member:status'}, 'secret-key', 'HS512')
+        response = self.get('tim@mit.edu', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 401)
+        self.expirations_for.assert_not_called()
+
+    def test_outgoing_tokens_refused(self):
+        """Tokens we issue for mitoc-trips (with the same key) can't be replayed."""
+        with self.app.app_context():
+            outgoing = trips_api.bearer_jwt(email='tim@mit.edu')
+        for headers in [
+            {'Authorization': outgoing},
+            self.authorization(aud='mitoc-trips'),
+        ]:
+            response = self.get('tim@mit.edu', headers=headers)
+            self.assertEqual(response.status_code, 401)
+        self.expirations_for.assert_not_called()
+
+    def test_too_many_emails(self):
+        self.assertEqual(self.get().status_code, 400)
+        response = self.get(*[f'{i}@example.com' for i in range(4)])
+        self.assertEqual(response.status_code, 400)
+        self.expirations_for.assert_not_called()
+
+
+class StatusQueryBudgetTests(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['MEMBERSHIP_SECRET_KEY'] = 'secret-key'
+        self.client = self.app.test_client()
+
+        self.conn = use_connection(self)
+
+    def test_many_emails(self):
+        """Looking up more emails takes no more queries (just two, if uncached)."""
+        emails = [f'member{i}@example.com' for i in range(50)]
+        self.conn.cursor.return_value.fetchall.side_effect = [
+            [
+                (email, i, 'Non-affiliate', None, 1, None)
+                for i, email in enumerate(emails)
+            ],
+            [(i, date(2019, 1, 15), None) for i in range(50)],
+        ]
+        with assert_max_queries(self, 2):
+            response = self.client.get(
+                '/members/status',
+                query_string=[('email', email) for email in emails],
+                headers=StatusViewTests.authorization(),
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['results']), 50)
+
+        with assert_max_queries(self, 0):  # (All cached)
+            self.client.get(
+                '/members/status',
+                query_string=[('email', email) for email in emails],
+                headers=StatusViewTests.authorization(),
+            )
+
+
+AsgiStatusViewTests = asgi_variant(StatusViewTests)
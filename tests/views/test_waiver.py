@@ -6,12 +6,20 @@ from pathlib import Path
 from unittest import mock
 from urllib.error import URLError
 
-from member import extensions
+from member import errors, extensions
 from member.app import create_app
 from member.envelopes import CompletedEnvelope
 from member.public import views
 
-from ..utils import create_app_with_env_vars
+from ..utils import (
+    asgi_variant,
+    assert_max_queries,
+    create_app_with_env_vars,
+    start_patchers,
+    use_connection,
+    use_spool,
+    verbs,
+)
 
 DIR_PATH = Path(__file__).resolve().parent.parent
 DUMMY_RAVEN_DSN = 'https://aa11bb22cc33dd44ee55ff6601234560@sentry.io/104648'
@@ -45,7 +53,6 @@ class WaiverTests(unittest.TestCase):
             verified_emails.return_value = (primary_email, all_emails)
             with mock.patch.object(views, 'db') as db:
                 db.person_to_update.return_value = None  # Not in db!
-                db.already_added_waiver.return_value = False
                 db.add_person.return_value = self.person_id
                 db.add_waiver.return_value = (self.waiver_id, self.VALID_UNTIL)
                 yield db, verified_emails
@@ -64,6 +71,9 @@ class WaiverTests(unittest.TestCase):
 
         with mock.patch.object(views, 'CompletedEnvelope', autospec=True) as env:
             env.side_effect = verify_but_return_mock
+            env.from_stream.side_effect = lambda stream, **_: verify_but_return_mock(
+                stream.read()
+            )
             yield mocked_envelope
 
 
@@ -108,10 +118,7 @@ class TestWaiverView(WaiverTests):
         db.person_to_update.assert_called_once_with('tim@mit.edu', all_emails)
         db.add_person.assert_called_once_with('Tim', 'Beaver', 'tim@mit.edu')
 
-        # We checked if we'd already inserted Tim, then we add his waiver!
-        db.already_added_waiver.assert_called_once_with(
-            self.person_id, self.TIME_SIGNED
-        )
+        # Then we add his waiver!
         db.add_waiver.assert_called_once_with(self.person_id, self.TIME_SIGNED)
 
         db.update_affiliation.assert_called_once_with(self.person_id, 'Non-affiliate')
@@ -131,14 +138,105 @@ class TestWaiverView(WaiverTests):
             verified_emails.return_value = ('tim@mit.edu', ['tim@mit.edu'])
             with mock.patch.object(views, 'db') as db:
                 db.person_to_update.return_value = 37
-                db.already_added_waiver.return_value = True
+                db.add_waiver.side_effect = errors.AlreadyInserted
                 resp = self.client.post('/members/waiver', data=self._waiver_data)
 
         self.assertTrue(resp.is_json)
         self.assertEqual(resp.status_code, 204)
 
         db.add_person.assert_not_called()
-        db.add_waiver.assert_not_called()
+        db.update_affiliation.assert_not_called()
+
+
+class WaiverQueryBudgetTests(WaiverTests):
+    """Database round trips made for a waiver (with only the connection mocked)."""
+
+    def setUp(self):
+        super().setUp()
+        self.conn = use_connection(self)
+        self.cursor = self.conn.cursor.return_value
+        self.cursor.lastrowid = self.waiver_id
+        self.cursor.rowcount = 1
+        verified_emails, _ = start_patchers(
+            self,
+            mock.patch.object(views, 'other_verified_emails'),
+            mock.patch.object(views, 'update_membership'),
+        )
+        verified_emails.return_value = ('tim@mit.edu', ['tim@mit.edu'])
+
+    def test_known_person(self):
+        """One lookup, the waiver itself, then the (changed) affiliation."""
+        self.cursor.fetchall.return_value = [
+            ('tim@mit.edu', self.person_id, 'MIT undergrad', None, 1, None)
+        ]
+        with assert_max_queries(self, 3) as executed:
+            resp = self.client.post('/members/waiver', data=self._waiver_data)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(verbs(executed), ['select', 'insert', 'update'])
+        self.conn.commit.assert_called_once()
+
+
+class SpooledWaiverTests(WaiverTests):
+    def setUp(self):
+        super().setUp()
+        self.spool = use_spool(self)
+
+    def test_spooled(self):
+        """Completed waivers are spooled (as read), then accepted."""
+        with mock.patch.object(views, 'other_verified_emails') as verified_emails:
+            with mock.patch.object(views, 'db') as db:
+                resp = self.client.post('/members/waiver', data=self._waiver_data)
+        self.assertEqual(resp.status_code, 202)
+        verified_emails.assert_not_called()
+        db.transaction.assert_not_called()
+
+        (webhook,) = self.spool.claim(10)
+        self.assertEqual(webhook.kind, 'waiver')
+        self.assertEqual(
+            webhook.payload,
+            {
+                'email': 'tim@mit.edu',
+                'first_name': 'Tim',
+                'last_name': 'Beaver',
+                'time_signed': self.TIME_SIGNED.isoformat(),
+                'affiliation': 'Non-affiliate',
+            },
+        )
+
+    def test_not_yet_completed(self):
+        with self._mocked_env() as env:
+            env.completed = False
+            resp = self.client.post('/members/waiver', data=self._waiver_data)
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(self.spool.pending(), 0)
+
+
+class UnsafeWaiverTests(WaiverTests):
+    """Malicious (or misrouted) documents are refused before costing much."""
+
+    def post(self, data, **kwargs):
+        with mock.patch.object(views, 'other_verified_emails') as verified_emails:
+            resp = self.client.post('/members/waiver', data=data, **kwargs)
+        verified_emails.assert_not_called()
+        return resp
+
+    def test_billion_laughs(self):
+        entities = ''.join(
+            f'<!ENTITY lol{i} "{f"&lol{i - 1};" * 10}">' for i in range(1, 10)
+        )
+        data = (
+            f'<!DOCTYPE lolz [<!ENTITY lol0 "lol">{entities}]>'
+            '<DocuSignEnvelopeInformation>&lol9;</DocuSignEnvelopeInformation>'
+        )
+        self.assertEqual(self.post(data).status_code, 400)
+
+    def test_too_deep(self):
+        data = '<a>' * 1000 + '</a>' * 1000
+        self.assertEqual(self.post(data).status_code, 400)
+
+    def test_too_large(self):
+        self.app.config['WAIVER_MAX_BYTES'] = 1024
+        self.assertEqual(self.post(self._waiver_data).status_code, 413)
 
 
 class ApiDownTests(WaiverTests):
@@ -177,6 +275,8 @@ class ApiDownTests(WaiverTests):
         with self._first_waiver('tim@mit.edu', all_emails) as (db, verified_emails):
             with mock.patch.object(views, 'extensions') as view_extensions:
                 view_extensions.sentry = None
+                view_extensions.spool.enabled = False
+                view_extensions.coalescer.enabled = False
                 resp = self.client.post('/members/waiver', data=self._waiver_data)
 
         # This request goes through all the usual steps!
@@ -187,3 +287,9 @@ class ApiDownTests(WaiverTests):
 
         self.assertTrue(resp.is_json)
         self.assertEqual(resp.status_code, 201)
+
+
+# The same tests, served via `member.asgi`
+AsgiTestWaiverView = asgi_variant(TestWaiverView)
+AsgiUnsafeWaiverTests = asgi_variant(UnsafeWaiverTests)
+AsgiApiDownTests = asgi_variant(ApiDownTests)